@@ -0,0 +1,242 @@
+import secrets
+import time
+
+import numpy as np
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from src import metrics, yao
+
+# Batches garble and evaluate N independent half-gates instances of a circuit
+# at once. Labels are stored in an (N, wires, LABEL_SIZE) array of bytes, in
+# the little-endian layout of the int labels of yao, so that each gate costs
+# one vectorized operation and one AES call for the whole batch.
+
+
+def _mask(labels):
+    """
+    Return 0xff bytes where the colour bit of a label is set, 0 bytes elsewhere
+    :param labels: An (N, LABEL_SIZE) array of labels
+    :return: An (N, 1) array
+    """
+    return np.negative(labels[:, :1] & 1)
+
+
+def _gf_double(labels):
+    """
+    Multiply labels by x in GF(2^128), as yao.gf_double
+    :param labels: An (..., LABEL_SIZE) array of labels
+    :return: An array of the same shape
+    """
+    words = np.ascontiguousarray(labels).view("<u8")  # low, high 64-bit halves
+    doubled = np.empty_like(words)
+    doubled[..., 1] = (words[..., 1] << 1) | (words[..., 0] >> 63)
+    doubled[..., 0] = (words[..., 0] << 1) ^ ((words[..., 1] >> 63) * 0x87)
+    return doubled.view(np.uint8)
+
+
+def _tweak(tweak):
+    return np.frombuffer((tweak & yao.LABEL_MASK).to_bytes(yao.LABEL_SIZE, "little"), np.uint8)
+
+
+class BatchHash:
+    """
+    The fixed-key label hash of yao.FixedKeyCipher for arrays of labels.
+    """
+
+    def __init__(self):
+        self._aes = Cipher(algorithms.AES(yao.FixedKeyCipher.FIXED_KEY),
+                           modes.ECB()).encryptor()
+
+    def __call__(self, labels, tweaks):
+        """
+        Hash single labels with one tweak per group of labels
+        :param labels: A (groups, N, LABEL_SIZE) array of labels
+        :param tweaks: A sequence of one int tweak per group
+        :return: A (groups, N, LABEL_SIZE) array of hashes
+        """
+        block = _gf_double(labels) ^ np.stack([_tweak(t) for t in tweaks])[:, None, :]
+        cipher_block = self._aes.update(block.tobytes())
+        return np.frombuffer(cipher_block, np.uint8).reshape(block.shape) ^ block
+
+
+def random_labels(*shape):
+    """
+    Draw random labels
+    :param shape: The shape of the array, without the last LABEL_SIZE axis
+    :return: An array of random labels
+    """
+    size = int(np.prod(shape, dtype=np.int64)) * yao.LABEL_SIZE
+    return np.frombuffer(bytearray(secrets.token_bytes(size)), np.uint8).reshape(
+        *shape, yao.LABEL_SIZE)
+
+
+def and_gates(plan):
+    """
+    Return the indexes in the plan of the gates that have a garbled table
+    :param plan: A CompiledCircuit
+    :return: The list of indexes of AND, NAND, OR and NOR gates
+    """
+    return [k for k, gate_type in enumerate(plan.types) if gate_type < yao.XOR]
+
+
+class BatchGarbledCircuit:
+    """
+    N independent garblings of a circuit with free-XOR and half-gates.
+
+    Each instance has its own offset delta and input labels, as if garbled
+    by yao.GarbledCircuit, and must be evaluated once only.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit
+        count: The number of instances N
+    """
+
+    def __init__(self, circuit, count):
+        started = time.perf_counter()
+        plan = yao.compile_circuit(circuit)
+        yao.check_scheme(plan, yao.HALF_GATES)
+        self.plan = plan
+        self.count = count
+        hash_labels = BatchHash()
+
+        self.delta = random_labels(count)
+        self.delta[:, 0] |= 1
+        # label of bit 0 of each wire by dense index
+        labels = np.zeros((count, len(plan.wires), yao.LABEL_SIZE), np.uint8)
+        labels[:, :len(plan.inputs)] = random_labels(count, len(plan.inputs))
+        # (T_G, T_E) pair of each gate with a garbled table, in plan order
+        self.tables = np.empty((count, len(and_gates(plan)), 2, yao.LABEL_SIZE), np.uint8)
+
+        delta, j = self.delta, 0
+        for gate_id, gate_type, in_a, in_b, out in zip(plan.gate_ids, plan.types,
+                                                       plan.in_a, plan.in_b, plan.out):
+            if gate_type == yao.NOT:
+                labels[:, out] = labels[:, in_a] ^ delta
+            elif gate_type == yao.XOR:
+                labels[:, out] = labels[:, in_a] ^ labels[:, in_b]
+            elif gate_type == yao.XNOR:
+                labels[:, out] = labels[:, in_a] ^ labels[:, in_b] ^ delta
+            else:
+                invert_a, invert_b, invert_out = yao.HALF_GATES_AND[yao.GATE_TYPES[gate_type]]
+                label_a = labels[:, in_a] ^ delta if invert_a else labels[:, in_a]
+                label_b = labels[:, in_b] ^ delta if invert_b else labels[:, in_b]
+                h_a0, h_a1, h_b0, h_b1 = hash_labels(
+                    np.stack([label_a, label_a ^ delta, label_b, label_b ^ delta]),
+                    (2 * gate_id, 2 * gate_id, 2 * gate_id + 1, 2 * gate_id + 1))
+                p_a, p_b = _mask(label_a), _mask(label_b)
+
+                # Garbler half-gate
+                t_g = h_a0 ^ h_a1 ^ (delta & p_b)
+                w_g = h_a0 ^ (t_g & p_a)
+                # Evaluator half-gate
+                t_e = h_b0 ^ h_b1 ^ label_a
+                w_e = h_b0 ^ ((t_e ^ label_a) & p_b)
+
+                labels[:, out] = w_g ^ w_e ^ delta if invert_out else w_g ^ w_e
+                self.tables[:, j, 0], self.tables[:, j, 1] = t_g, t_e
+                j += 1
+
+        self.labels = labels
+        metrics.observe("garble", time.perf_counter() - started)
+        metrics.count("gates_garbled", count * len(plan))
+
+    def _indexes(self, wires):
+        return [self.plan.index[w] for w in wires]
+
+    def encode(self, wires, bits):
+        """
+        Select the labels of input bits
+        :param wires: The list of input wires
+        :param bits: An (N, len(wires)) array of bits of each instance
+        :return: An (N, len(wires), LABEL_SIZE) array of labels
+        """
+        bits = np.asarray(bits, np.uint8).reshape(self.count, len(wires), 1)
+        return self.labels[:, self._indexes(wires)] ^ (self.delta[:, None, :] & np.negative(bits))
+
+    def get_label_pairs(self, wires):
+        """
+        Return the labels of bits 0 and 1 of wires
+        :param wires: The list of wires
+        :return: A pair of (N, len(wires), LABEL_SIZE) arrays
+        """
+        labels = self.labels[:, self._indexes(wires)]
+        return labels, labels ^ self.delta[:, None, :]
+
+    def get_p_bits_out(self):
+        """Return the (N, outputs) array of the p-bits of the outputs of each instance"""
+        return self.labels[:, self._indexes(self.plan.outputs), 0] & 1
+
+    def get_garbled_tables(self, i):
+        """
+        Return the garbled tables of one instance, as yao.GarbledCircuit does
+        :param i: The index of the instance
+        :return: A dict mapping each non-free gate to its (T_G, T_E) pair
+        """
+        return {
+            self.plan.gate_ids[k]: (self.tables[i, j, 0].tobytes(), self.tables[i, j, 1].tobytes())
+            for j, k in enumerate(and_gates(self.plan))
+        }
+
+
+def evaluate(circuit, tables, inputs, p_bits_out):
+    """
+    Evaluate N garbled instances of a circuit at once
+    :param circuit: A dict containing circuit spec, or its CompiledCircuit
+    :param tables: The (N, non-free gates, 2, LABEL_SIZE) array of garbled tables
+    :param inputs: The (N, inputs, LABEL_SIZE) array of the labels of the
+        input wires, in the order of the inputs of the CompiledCircuit
+    :param p_bits_out: The (N, outputs) array of the p-bits of outputs
+    :return: The (N, outputs) array of the clear output bits of each instance
+    """
+    started = time.perf_counter()
+    plan = yao.compile_circuit(circuit)
+    yao.check_scheme(plan, yao.HALF_GATES)
+    hash_labels = BatchHash()
+    count = len(inputs)
+    labels = np.empty((count, len(plan.wires), yao.LABEL_SIZE), np.uint8)
+    labels[:, :len(plan.inputs)] = inputs
+
+    j = 0
+    for gate_id, gate_type, in_a, in_b, out in zip(plan.gate_ids, plan.types,
+                                                   plan.in_a, plan.in_b, plan.out):
+        if gate_type == yao.NOT:
+            labels[:, out] = labels[:, in_a]
+        elif gate_type >= yao.XOR:
+            labels[:, out] = labels[:, in_a] ^ labels[:, in_b]
+        else:
+            label_a, label_b = labels[:, in_a], labels[:, in_b]
+            h_a, h_b = hash_labels(np.stack([label_a, label_b]), (2 * gate_id, 2 * gate_id + 1))
+            # Garbler half-gate, keyed by the colour bit of a
+            w_g = h_a ^ (tables[:, j, 0] & _mask(label_a))
+            # Evaluator half-gate, keyed by the colour bit of b
+            w_e = h_b ^ ((tables[:, j, 1] ^ label_a) & _mask(label_b))
+            labels[:, out] = w_g ^ w_e
+            j += 1
+
+    outputs = [plan.index[w] for w in plan.outputs]
+    metrics.observe("evaluate", time.perf_counter() - started)
+    metrics.count("gates_evaluated", count * len(plan))
+    return (labels[:, outputs, 0] & 1) ^ p_bits_out
+
+
+def to_buffer(array):
+    """
+    Return a flat byte view of an array, to send it without copy
+    :param array: A numpy array
+    :return: A memoryview
+    """
+    return memoryview(np.ascontiguousarray(array, np.uint8)).cast("B")
+
+
+def from_buffer(buffer, shape):
+    """
+    View received bytes as an array of bytes
+    :param buffer: A bytes-like object
+    :param shape: The expected shape of the array
+    :return: A read-only numpy array
+    :raise ValueError: if the size of the buffer does not match the shape
+    """
+    array = np.frombuffer(buffer, np.uint8)
+    if array.size != int(np.prod(shape, dtype=np.int64)):
+        raise ValueError(f"Expected an array of shape {tuple(shape)}, got {array.size} bytes")
+    return array.reshape(shape)
@@ -0,0 +1,454 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import secrets
+import statistics
+import subprocess
+import threading
+import time
+
+from src import generators, loader, ot, player, server, util, yao
+
+BENCH_PORT = 4090
+SUITE_KINDS = ("adder", "comparator", "multiplier", "random")
+SUITE_SIZES = {"adder": (8, 32, 128), "comparator": (8, 32, 128), "multiplier": (8, 16, 32),
+               "random": (1000, 10000)}
+
+
+def bench_ot(backend=ot.PRIME_BACKEND, group=util.DEFAULT_GROUP, count=128, port=BENCH_PORT,
+             transport=util.TCP):
+    """
+    Measure batched public-key OTs per second between two local parties
+    :param backend: The OT backend, prime or ec
+    :param group: The named group of the prime backend, None for a random one
+    :param count: The number of OTs of the timed batch
+    :param port: The local TCP port of the evaluator
+    :param transport: Optional; the transport between the parties (default tcp)
+    :return: A dict of results
+    """
+    endpoint = util.local_endpoint(transport, port)
+    evaluator_socket = util.EvaluatorSocket(endpoint)
+    garbler_socket = util.GarblerSocket(endpoint)
+    garbler = ot.ObliviousTransfer(garbler_socket, group=group, backend=backend)
+    evaluator = ot.ObliviousTransfer(evaluator_socket, group=group, backend=backend)
+
+    msgs = {w: (secrets.token_bytes(16), secrets.token_bytes(16)) for w in range(count)}
+    choices = {w: secrets.randbits(1) for w in range(count)}
+    received = {}
+
+    def evaluate(batch_choices):
+        received.update(evaluator.receive(batch_choices)[1])
+        evaluator_socket.send(True)
+
+    timings = []
+    # The first round agrees on the group of the session and is not timed
+    for batch_msgs, batch_choices in (({0: msgs[0]}, {0: choices[0]}), (msgs, choices)):
+        thread = threading.Thread(target=evaluate, args=(batch_choices,))
+        thread.start()
+        start = time.perf_counter()
+        garbler.transfer(batch_msgs)
+        garbler_socket.receive()
+        timings.append(time.perf_counter() - start)
+        thread.join()
+
+    evaluator_socket.socket.close()
+    garbler_socket.socket.close()
+    if any(received[w] != msgs[w][b] for w, b in choices.items()):
+        raise RuntimeError(f"OT backend '{backend}' returned wrong messages")
+
+    return {
+        "benchmark": "ot",
+        "backend": backend,
+        "group": (group or "random") if backend == ot.PRIME_BACKEND else "curve25519",
+        "transport": transport,
+        "ots": count,
+        "setup_seconds": timings[0],
+        "seconds": timings[1],
+        "ots_per_sec": count / timings[1],
+    }
+
+
+def _garbling_seed(seed):
+    """
+    Turn the seed of a benchmark into the seed of its garbled circuits
+    :param seed: An int, or None for random garbled circuits
+    :return: A yao.SEED_SIZE-byte seed, or None
+    """
+    return None if seed is None else seed.to_bytes(yao.SEED_SIZE, "little")
+
+
+def bench_garble(circuit, scheme=yao.CLASSIC, cipher=yao.FERNET, workers=None, seed=None):
+    """
+    Measure garbled gates per second of a circuit
+    :param circuit: A dict containing circuit spec
+    :param scheme: The garbling scheme
+    :param cipher: The label cipher of the classic scheme
+    :param workers: The number of worker processes, None to garble in this process
+    :param seed: Optional; the seed of the labels, None for random labels (default None)
+    :return: A dict of results
+    """
+    start = time.perf_counter()
+    garbled_circuit = yao.GarbledCircuit(circuit, scheme=scheme, cipher=cipher, workers=workers,
+                                         seed=_garbling_seed(seed))
+    seconds = time.perf_counter() - start
+    return {
+        "benchmark": "garble",
+        "circuit": circuit["id"],
+        "scheme": scheme,
+        "cipher": garbled_circuit.cipher.name,
+        "workers": workers or 1,
+        "gates": len(circuit["gates"]),
+        "seconds": seconds,
+        "gates_per_sec": len(circuit["gates"]) / seconds,
+    }
+
+
+def _encode_inputs(wires, keys, p_bits, bits):
+    """
+    Select the (key, encr_bit) inputs of input bits
+    :param wires: The input wires
+    :param keys: A dict mapping each wire to its pair of keys
+    :param p_bits: A dict mapping each wire to its p-bit
+    :param bits: A dict mapping each wire to its input bit
+    :return: A dict mapping each wire to its (key, encr_bit) input
+    """
+    return {w: (keys[w][bits[w]], p_bits[w] ^ bits[w]) for w in wires}
+
+
+def bench_evaluate(circuit, scheme=yao.CLASSIC, cipher=yao.FERNET, rounds=3, seed=None):
+    """
+    Measure evaluated gates per second of a circuit, on random inputs
+    :param circuit: A dict containing circuit spec
+    :param scheme: The garbling scheme
+    :param cipher: The label cipher of the classic scheme
+    :param rounds: The number of timed evaluations, of one garbling each
+    :param seed: Optional; the seed of the labels and of the inputs, None for
+        random ones (default None)
+    :return: A dict of results, of the fastest evaluation
+    """
+    plan = yao.compile_circuit(circuit)
+    rng = random.Random(seed)
+    timings = []
+    for _ in range(rounds):
+        garbled_circuit = yao.GarbledCircuit(circuit, scheme=scheme, cipher=cipher,
+                                             seed=_garbling_seed(seed))
+        keys, p_bits = garbled_circuit.get_keys(), garbled_circuit.get_p_bits()
+        tables = yao.PackedTables.pack(garbled_circuit.get_garbled_tables())
+        bits = {w: rng.getrandbits(1) for w in plan.inputs}
+        a_inputs = _encode_inputs(circuit.get("alice", []), keys, p_bits, bits)
+        b_inputs = _encode_inputs(circuit.get("bob", []), keys, p_bits, bits)
+        p_bits_out = {w: p_bits[w] for w in circuit["out"]}
+        start = time.perf_counter()
+        yao.evaluate(plan, tables, p_bits_out, a_inputs, b_inputs, scheme,
+                     garbled_circuit.cipher.name)
+        timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+    return {
+        "benchmark": "evaluate",
+        "circuit": circuit["id"],
+        "scheme": scheme,
+        "cipher": yao.FIXED_KEY if scheme == yao.HALF_GATES else cipher,
+        "gates": len(plan),
+        "seconds": seconds,
+        "gates_per_sec": len(plan) / seconds,
+    }
+
+
+def bench_e2e(circuit, scheme=yao.CLASSIC, cipher=yao.FERNET, rounds=3, port=BENCH_PORT,
+              ot_backend=ot.EC_BACKEND, transport=util.TCP, **options):
+    """
+    Measure the latency and the bytes on the wire of evaluations of a circuit
+    between two local parties over a loopback util.Socket, from garbling to
+    the result, OTs of Bob's inputs included
+    :param circuit: A dict containing circuit spec
+    :param scheme: The garbling scheme
+    :param cipher: The label cipher of the classic scheme
+    :param rounds: The number of evaluations
+    :param port: The local TCP port of the evaluator
+    :param ot_backend: The OT backend
+    :param transport: The transport between the parties, inproc to leave the
+        network out of the measure
+    :param options: The other options of the ObliviousTransfer of both parties
+    :return: A dict of results
+    """
+    endpoint = util.local_endpoint(transport, port)
+    evaluator_socket = util.EvaluatorSocket(endpoint)
+    garbler_socket = util.GarblerSocket(endpoint)
+    garbler = ot.ObliviousTransfer(garbler_socket, backend=ot_backend, **options)
+    evaluator = ot.ObliviousTransfer(evaluator_socket, backend=ot_backend, **options)
+    plan = yao.compile_circuit(circuit)
+
+    def evaluate():
+        for _ in range(rounds):
+            entry = evaluator_socket.receive()
+            evaluator_socket.send(True)
+            b_inputs = {w: secrets.randbits(1) for w in circuit.get("bob", [])}
+            evaluator.send_result(plan, entry["garbled_tables"], entry["p_bits_out"], b_inputs,
+                                  entry["scheme"], entry["cipher"])
+        evaluator_socket.receive()
+        evaluator_socket.send(True)
+
+    thread = threading.Thread(target=evaluate)
+    thread.start()
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        garbled_circuit = yao.GarbledCircuit(circuit, scheme=scheme, cipher=cipher)
+        keys, p_bits = garbled_circuit.get_keys(), garbled_circuit.get_p_bits()
+        garbler_socket.send_wait({
+            "circuit": circuit,
+            "scheme": scheme,
+            "cipher": garbled_circuit.cipher.name,
+            "garbled_tables": yao.PackedTables.pack(garbled_circuit.get_garbled_tables()),
+            "p_bits_out": {w: p_bits[w] for w in circuit["out"]},
+        })
+        bits = {w: secrets.randbits(1) for w in circuit.get("alice", [])}
+        a_inputs = _encode_inputs(circuit.get("alice", []), keys, p_bits, bits)
+        b_keys = {w: util.get_encr_bits(p_bits[w], *keys[w]) for w in circuit.get("bob", [])}
+        garbler.get_result(a_inputs, b_keys)
+        latencies.append(time.perf_counter() - start)
+    garbler_socket.send_wait(None)
+    thread.join()
+    evaluator_socket.socket.close()
+    garbler_socket.socket.close()
+
+    return {
+        "benchmark": "e2e",
+        "circuit": circuit["id"],
+        "scheme": scheme,
+        "cipher": yao.FIXED_KEY if scheme == yao.HALF_GATES else cipher,
+        "ot_backend": ot_backend,
+        "transport": transport,
+        "gates": len(plan),
+        "rounds": rounds,
+        "latency_p50": statistics.median(latencies),
+        "latency_max": max(latencies),
+        "bytes_sent_per_round": garbler_socket.bytes_sent / rounds,
+        "bytes_received_per_round": garbler_socket.bytes_received / rounds,
+    }
+
+
+def environment():
+    """
+    Describe the machine and the version of the code, to compare results
+    :return: A dict
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def bench_suite(kinds=SUITE_KINDS, sizes=None, scheme=yao.CLASSIC, cipher=yao.FERNET, rounds=3,
+                ot_count=128, seed=0, garbling_seed=None, transport=util.TCP):
+    """
+    Run the garble, evaluate and e2e benchmarks on generated circuits, and
+    the OT benchmark
+    :param kinds: The kinds of generated circuits, keys of generators.GENERATORS
+    :param sizes: Optional; the sizes of all kinds (default SUITE_SIZES of each kind)
+    :param scheme: The garbling scheme
+    :param cipher: The label cipher of the classic scheme
+    :param rounds: The number of evaluations of each circuit
+    :param ot_count: The number of OTs of each OT backend
+    :param seed: The seed of random circuits
+    :param garbling_seed: Optional; the seed of the labels and of the inputs
+        of the garble and evaluate benchmarks, None for random ones (default None)
+    :param transport: Optional; the transport of the e2e and OT benchmarks (default tcp)
+    :return: A dict of the environment and of the list of results
+    """
+    results = []
+    for kind in kinds:
+        for size in sizes or SUITE_SIZES[kind]:
+            circuit = generators.generate(kind, size, seed)
+            results.append(bench_garble(circuit, scheme, cipher, seed=garbling_seed))
+            results.append(bench_evaluate(circuit, scheme, cipher, rounds, garbling_seed))
+            results.append(bench_e2e(circuit, scheme, cipher, rounds, transport=transport))
+    results.append(bench_ot(ot.PRIME_BACKEND, util.DEFAULT_GROUP, ot_count,
+                            transport=transport))
+    results.append(bench_ot(ot.EC_BACKEND, None, ot_count, transport=transport))
+    return {"environment": environment(), "results": results}
+
+
+def _run_garbler(circuit_path, endpoint, sessions, options):
+    """
+    Run sessions of Alice one after the other, without printing
+    :param circuit_path: The JSON circuit file
+    :param endpoint: The endpoint of the evaluator server
+    :param sessions: The number of sessions
+    :param options: The keyword arguments of Alice
+    :return:
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(sessions):
+            alice = player.Alice(circuit_path, endpoint=endpoint, **options)
+            alice.start()
+            alice.socket.socket.close()
+
+
+def bench_sessions(circuit_path, garblers=8, sessions=4, workers=server.SESSION_WORKERS,
+                   port=BENCH_PORT, transport=util.TCP, **options):
+    """
+    Measure sessions per second and session latency of an evaluator server
+    under the load of concurrent garbler processes
+    :param circuit_path: The JSON circuit file of the sessions
+    :param garblers: The number of concurrent garbler processes
+    :param sessions: The number of sessions of each garbler
+    :param workers: The number of sessions the server runs at once
+    :param port: The local TCP port of the server
+    :param transport: Optional; the transport of the garblers, tcp or ipc (default tcp)
+    :param options: The OT options shared by Alice and the server
+    :return: A dict of results
+    """
+    if transport == util.INPROC:
+        raise ValueError("Garbler processes cannot connect to the server over inproc")
+    endpoint = util.local_endpoint(transport, port)
+    evaluator = server.EvaluatorServer(endpoint, workers, **options)
+    stop = threading.Event()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        thread = threading.Thread(target=evaluator.serve, args=(stop,))
+        thread.start()
+        processes = [
+            multiprocessing.Process(target=_run_garbler,
+                                    args=(circuit_path, endpoint, sessions, options))
+            for _ in range(garblers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        stop.set()
+        thread.join()
+    evaluator.close()
+
+    return {
+        "benchmark": "sessions",
+        "circuit": circuit_path,
+        "transport": transport,
+        "garblers": garblers,
+        "workers": workers,
+        **evaluator.stats(),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark Yao Protocol building blocks.")
+    parser.add_argument("benchmark", choices=["ot", "garble", "evaluate", "e2e", "sessions",
+                                              "suite"],
+                        help="the benchmark to run, 'suite' for all of them on generated "
+                             "circuits")
+    parser.add_argument("-n",
+                        "--count",
+                        type=int,
+                        default=128,
+                        help="the number of OTs (default 128)")
+    parser.add_argument("-c",
+                        "--circuit",
+                        metavar="circuit.json",
+                        default="circuits/add.json",
+                        help="the circuit file to garble: JSON, Bristol Fashion or binary")
+    parser.add_argument("-s",
+                        "--scheme",
+                        choices=yao.SCHEMES,
+                        default=yao.CLASSIC,
+                        help="the garbling scheme (default 'classic')")
+    parser.add_argument("--cipher",
+                        choices=list(yao.CIPHERS),
+                        default=yao.FERNET,
+                        help="the label cipher of the classic scheme (default 'fernet')")
+    parser.add_argument("-w",
+                        "--workers",
+                        type=int,
+                        nargs="+",
+                        default=[1],
+                        help="the numbers of garbling processes to compare (default 1)")
+    parser.add_argument("-g",
+                        "--garblers",
+                        type=int,
+                        default=8,
+                        help="the number of concurrent garblers of the server (default 8)")
+    parser.add_argument("--sessions",
+                        type=int,
+                        default=4,
+                        help="the number of sessions of each garbler (default 4)")
+    parser.add_argument("-r",
+                        "--rounds",
+                        type=int,
+                        default=3,
+                        help="the number of evaluations of each circuit (default 3)")
+    parser.add_argument("-k",
+                        "--kinds",
+                        choices=list(generators.GENERATORS),
+                        nargs="+",
+                        default=list(SUITE_KINDS),
+                        help="the kinds of generated circuits of the suite (default all)")
+    parser.add_argument("--sizes",
+                        type=int,
+                        nargs="+",
+                        help="the sizes of the generated circuits of the suite: bit sizes, "
+                             "or numbers of gates of random circuits (default depends on "
+                             "the kind)")
+    parser.add_argument("--seed",
+                        type=int,
+                        help="seed the labels and inputs of the garble and evaluate "
+                             "benchmarks, for reproducible runs")
+    parser.add_argument("-t",
+                        "--transport",
+                        choices=util.TRANSPORTS,
+                        default=util.TCP,
+                        help="the transport between the local parties: tcp, ipc, or inproc "
+                             "within the process to leave the network out (default 'tcp')")
+    parser.add_argument("-o",
+                        "--output",
+                        help="write the JSON results to this file instead of printing them")
+    args = parser.parse_args()
+
+    if args.benchmark == "sessions":
+        results = [
+            bench_sessions(args.circuit, args.garblers, args.sessions, workers,
+                           transport=args.transport, ot_backend=ot.EC_BACKEND)
+            for workers in args.workers
+        ]
+    elif args.benchmark == "garble":
+        results = [
+            bench_garble(circuit, args.scheme, args.cipher, workers, args.seed)
+            for circuit in loader.load_circuits(args.circuit)["circuits"]
+            for workers in args.workers
+        ]
+    elif args.benchmark == "evaluate":
+        results = [
+            bench_evaluate(circuit, args.scheme, args.cipher, args.rounds, args.seed)
+            for circuit in loader.load_circuits(args.circuit)["circuits"]
+        ]
+    elif args.benchmark == "e2e":
+        results = [
+            bench_e2e(circuit, args.scheme, args.cipher, args.rounds, transport=args.transport)
+            for circuit in loader.load_circuits(args.circuit)["circuits"]
+        ]
+    elif args.benchmark == "suite":
+        results = bench_suite(args.kinds, args.sizes, args.scheme, args.cipher, args.rounds,
+                              args.count, garbling_seed=args.seed, transport=args.transport)
+    else:
+        results = [
+            bench_ot(ot.PRIME_BACKEND, None, args.count, transport=args.transport),
+            bench_ot(ot.PRIME_BACKEND, util.DEFAULT_GROUP, args.count, transport=args.transport),
+            bench_ot(ot.EC_BACKEND, None, args.count, transport=args.transport),
+        ]
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
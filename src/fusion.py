@@ -0,0 +1,201 @@
+import logging
+
+from src import yao
+
+# LUT FUSION
+# Small subcircuits are fused into LUT gates. A cut of a gate is a set of at
+# most max_inputs wires separating it from the inputs, and its cone the
+# gates between the cut and the gate, computed by one LUT gate over the cut.
+# The cuts of a gate are merged from the cuts of its inputs, keeping the
+# CUTS_PER_GATE best ones: the smallest area flow, the 2^k rows of the table
+# of the cut plus the area flow of each leaf shared among its readers, then
+# the largest cone, for the fewest decryptions. Gates are then mapped from
+# the outputs: a gate whose best cut is not its inputs becomes a LUT gate,
+# and the gates of its cone are dropped unless another mapped gate reads
+# them. A gate in the cones of several LUT gates is computed in each.
+LUT_FUSE_INPUTS = 3  # default maximum number of inputs of fused LUT gates
+CUTS_PER_GATE = 8
+
+
+def count_rows(circuit):
+    """
+    Count the gates and the rows of the classic garbled tables of a circuit
+    :param circuit: A dict containing circuit spec
+    :return: A dict of the count of gates, of LUT gates and of table rows
+    """
+    gates = circuit["gates"]
+    return {
+        "gates": len(gates),
+        "luts": sum(1 for gate in gates if gate["type"] == yao.LUT_TYPE),
+        "rows": sum(2**len(gate["in"]) for gate in gates),
+    }
+
+
+def _cone(plan, inputs, k, cut):
+    """
+    Return the gates between a cut and a gate
+    :param plan: The CompiledCircuit
+    :param inputs: The tuple of the dense indexes of the inputs of each gate
+    :param k: The index of the gate
+    :param cut: A set of dense indexes of wires
+    :return: The sorted list of the indexes of the gates of the cone, k included
+    """
+    input_count = len(plan.inputs)
+    cone, pending = {k}, [k]
+    while pending:
+        for i in inputs[pending.pop()]:
+            if i not in cut and i - input_count not in cone:
+                cone.add(i - input_count)
+                pending.append(i - input_count)
+    return sorted(cone)
+
+
+def _truth_table(plan, inputs, logic, cone, leaves):
+    """
+    Compute the truth table of a cone over its leaves
+    :param plan: The CompiledCircuit
+    :param inputs: The tuple of the dense indexes of the inputs of each gate
+    :param logic: The logical function of each gate
+    :param cone: The sorted indexes of the gates of the cone, the last one its output
+    :param leaves: The dense indexes of the leaves, the first one the most significant
+    :return: The list of the 2^len(leaves) output bits
+    """
+    table = []
+    for n in range(2**len(leaves)):
+        values = {i: (n >> (len(leaves) - 1 - j)) & 1 for j, i in enumerate(leaves)}
+        for k in cone:
+            values[plan.out[k]] = logic[k](*(values[i] for i in inputs[k]))
+        table.append(values[plan.out[cone[-1]]])
+    return table
+
+
+def fuse(circuit, max_inputs=LUT_FUSE_INPUTS):
+    """
+    Fuse small subcircuits of a circuit into LUT gates
+    :param circuit: A dict containing circuit spec
+    :param max_inputs: Optional; the maximum number of inputs of the LUT
+        gates (default LUT_FUSE_INPUTS)
+    :return: A dict containing the spec of an equivalent circuit, with the
+        same ID, inputs and outputs, to garble with the classic scheme
+    """
+    if not 1 <= max_inputs <= yao.LUT_MAX_INPUTS:
+        raise ValueError(f"LUT gates have 1 to {yao.LUT_MAX_INPUTS} inputs, not {max_inputs}")
+    plan = yao.compile_circuit(circuit)
+    input_count = len(plan.inputs)
+    inputs = [plan.gate_inputs(k) for k in range(len(plan))]
+    logic = [yao.gate_logic(yao.GATE_NAMES[gate_type], plan.lut_tables.get(k))
+             for k, gate_type in enumerate(plan.types)]
+
+    fanout = [0] * len(plan.wires)  # number of gates and outputs reading each wire
+    for gate_inputs in inputs:
+        for i in gate_inputs:
+            fanout[i] += 1
+    for w in plan.outputs:
+        fanout[plan.index[w]] += 1
+
+    # Cut enumeration, in evaluation order
+    cuts = [[frozenset((i,))] for i in range(input_count)]  # candidate cuts of each wire
+    flow = [0.0] * len(plan.wires)  # area flow of the best cut of each wire
+    best = []  # best cut of each gate
+    for k in range(len(plan)):
+        merged = {frozenset()}
+        for i in inputs[k]:
+            merged = {cut | other for cut in merged for other in cuts[i]
+                      if len(cut | other) <= max_inputs}
+        ranked = []
+        for cut in merged:
+            area = 2**len(cut) + sum(flow[i] / max(fanout[i], 1) for i in cut)
+            ranked.append((area, -len(_cone(plan, inputs, k, cut)), sorted(cut), cut))
+        ranked.sort(key=lambda item: item[:3])
+        if ranked:
+            best.append(ranked[0][3])
+            flow[plan.out[k]] = ranked[0][0]
+        else:
+            # Gates with more inputs than a LUT keep them
+            best.append(frozenset(inputs[k]))
+            flow[plan.out[k]] = 2**len(inputs[k]) + sum(flow[i] / max(fanout[i], 1)
+                                                         for i in inputs[k])
+        cuts.append([frozenset((plan.out[k],))] + [item[3] for item in ranked[:CUTS_PER_GATE]])
+
+    # Mapping from the outputs
+    mapped, pending = set(), [plan.index[w] - input_count for w in plan.outputs
+                              if plan.index[w] >= input_count]
+    while pending:
+        k = pending.pop()
+        if k not in mapped:
+            mapped.add(k)
+            pending.extend(i - input_count for i in best[k] if i >= input_count)
+
+    gates = []
+    for k in sorted(mapped):
+        if best[k] == frozenset(inputs[k]):
+            gates.append(plan.gate(k))
+            continue
+        leaves = sorted(best[k])
+        table = _truth_table(plan, inputs, logic, _cone(plan, inputs, k, best[k]), leaves)
+        gates.append({"id": plan.gate_ids[k], "type": yao.LUT_TYPE,
+                      "in": [plan.wires[i] for i in leaves], "table": table})
+
+    return {
+        "id": circuit["id"],
+        "alice": list(circuit.get("alice", [])),
+        "bob": list(circuit.get("bob", [])),
+        "out": list(circuit["out"]),
+        "gates": gates,
+    }
+
+
+def report(circuit, fused):
+    """
+    Describe the gate and row counts of a circuit before and after fusion
+    :param circuit: A dict containing circuit spec
+    :param fused: A dict containing the spec of the fused circuit
+    :return: A line of text
+    """
+    before, after = count_rows(circuit), count_rows(fused)
+    return (f"{circuit['id']}: {before['gates']} -> {after['gates']} gates "
+            f"({after['luts']} LUT), {before['rows']} -> {after['rows']} table rows")
+
+
+def fuse_all(circuits, max_inputs=LUT_FUSE_INPUTS):
+    """
+    Fuse the gates of circuits and log their counts before and after
+    :param circuits: A list of dicts containing circuit spec
+    :param max_inputs: Optional; the maximum number of inputs of the LUT
+        gates (default LUT_FUSE_INPUTS)
+    :return: The list of the fused circuits
+    """
+    fused = []
+    for circuit in circuits:
+        fused.append(fuse(circuit, max_inputs))
+        logging.info(report(circuit, fused[-1]))
+    return fused
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    from src import loader
+
+    parser = argparse.ArgumentParser(description="Fuse small subcircuits into LUT gates.")
+    parser.add_argument("input", help="the circuit file: JSON, Bristol Fashion or binary")
+    parser.add_argument("-k",
+                        "--max-inputs",
+                        type=int,
+                        default=LUT_FUSE_INPUTS,
+                        help=f"the maximum number of inputs of the LUT gates, up to "
+                             f"{yao.LUT_MAX_INPUTS} (default {LUT_FUSE_INPUTS})")
+    parser.add_argument("-o",
+                        "--output",
+                        help="write the fused circuits to this JSON file")
+    args = parser.parse_args()
+
+    circuits = loader.load_circuits(args.input)
+    fused = []
+    for circuit in circuits["circuits"]:
+        fused.append(fuse(circuit, args.max_inputs))
+        print(report(circuit, fused[-1]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"name": circuits["name"], "circuits": fused}, f, indent=2)
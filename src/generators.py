@@ -0,0 +1,199 @@
+import random
+
+from src import yao
+
+# Generators of circuits of any size for benchmarks. Alice's input is the
+# first operand and Bob's the second, both least significant bit first, as
+# are the outputs.
+
+
+class CircuitBuilder:
+    """
+    A builder of circuits numbering wires from 1, in the order they are created.
+
+    Args:
+        circuit_id: The circuit ID
+    """
+
+    def __init__(self, circuit_id):
+        self.id = circuit_id
+        self.next_wire = 1
+        self.gates = []
+
+    def inputs(self, count):
+        """
+        Create input wires
+        :param count: The number of wires
+        :return: The list of the wires
+        """
+        wires = list(range(self.next_wire, self.next_wire + count))
+        self.next_wire += count
+        return wires
+
+    def gate(self, gate_type, *inputs):
+        """
+        Add a gate
+        :param gate_type: The type of the gate
+        :param inputs: The input wires of the gate
+        :return: The output wire of the gate
+        """
+        self.gates.append({"id": self.next_wire, "type": gate_type, "in": list(inputs)})
+        self.next_wire += 1
+        return self.next_wire - 1
+
+    def add(self, xs, ys):
+        """
+        Add a ripple-carry adder of two numbers
+        :param xs: The bits of a number, least significant first
+        :param ys: The bits of another number, least significant first
+        :return: The bits of the sum, least significant first, one longer
+            than the longest number
+        """
+        if len(xs) > len(ys):
+            xs, ys = ys, xs
+        bits, carry = [], None
+        for k, y in enumerate(ys):
+            operands = [w for w in (xs[k] if k < len(xs) else None, y, carry) if w is not None]
+            if len(operands) == 1:
+                bits.append(operands[0])
+                carry = None
+            elif len(operands) == 2:
+                bits.append(self.gate("XOR", *operands))
+                carry = self.gate("AND", *operands)
+            else:
+                a, b, c = operands
+                half = self.gate("XOR", a, b)
+                bits.append(self.gate("XOR", half, c))
+                carry = self.gate("OR", self.gate("AND", a, b), self.gate("AND", half, c))
+        return bits + ([carry] if carry is not None else [])
+
+    def circuit(self, alice, bob, out):
+        """
+        Return the built circuit
+        :param alice: Alice's input wires
+        :param bob: Bob's input wires
+        :param out: The output wires
+        :return: A dict containing circuit spec
+        """
+        return {"id": self.id, "alice": alice, "bob": bob, "out": out, "gates": self.gates}
+
+
+def adder(bits):
+    """
+    Create an adder of two unsigned numbers
+    :param bits: The bit size of the numbers
+    :return: A dict containing circuit spec, with bits + 1 outputs
+    """
+    builder = CircuitBuilder(f"{bits}-bit adder")
+    a, b = builder.inputs(bits), builder.inputs(bits)
+    return builder.circuit(a, b, builder.add(a, b))
+
+
+def comparator(bits):
+    """
+    Create a comparator of two unsigned numbers
+    :param bits: The bit size of the numbers
+    :return: A dict containing circuit spec, whose output is 1 if Alice's
+        number is greater than Bob's
+    """
+    builder = CircuitBuilder(f"{bits}-bit comparator")
+    a, b = builder.inputs(bits), builder.inputs(bits)
+    greater = None
+    for x, y in zip(a, b):
+        # greater on bits 0..k: x > y, or x == y and greater on bits 0..k-1
+        bit_greater = builder.gate("AND", x, builder.gate("NOT", y))
+        if greater is None:
+            greater = bit_greater
+        else:
+            equal = builder.gate("XNOR", x, y)
+            greater = builder.gate("OR", bit_greater, builder.gate("AND", equal, greater))
+    return builder.circuit(a, b, [greater])
+
+
+def multiplier(bits):
+    """
+    Create a schoolbook multiplier of two unsigned numbers
+    :param bits: The bit size of the numbers
+    :return: A dict containing circuit spec, with 2 * bits outputs
+    """
+    builder = CircuitBuilder(f"{bits}-bit multiplier")
+    a, b = builder.inputs(bits), builder.inputs(bits)
+    product = [builder.gate("AND", x, b[0]) for x in a]
+    for i in range(1, bits):
+        row = [builder.gate("AND", x, b[i]) for x in a]
+        product = product[:i] + builder.add(product[i:], row)
+    return builder.circuit(a, b, product[:2 * bits])
+
+
+def random_dag(gates, inputs=64, outputs=64, seed=None):
+    """
+    Create a random circuit, whose gates read uniformly random earlier wires
+    :param gates: The number of gates
+    :param inputs: Optional; the number of input wires, half Alice's (default 64)
+    :param outputs: Optional; the number of outputs, the last wires (default 64)
+    :param seed: Optional; the seed of the random generator (default None)
+    :return: A dict containing circuit spec
+    """
+    if inputs < 2:
+        raise ValueError("Random circuits need at least 2 inputs")
+    rng = random.Random(seed)
+    builder = CircuitBuilder(f"random DAG of {gates} gates")
+    wires = builder.inputs(inputs)
+    for _ in range(gates):
+        gate_type = rng.choice(yao.GATE_TYPES)
+        if gate_type == "NOT":
+            wires.append(builder.gate(gate_type, rng.choice(wires)))
+        else:
+            wires.append(builder.gate(gate_type, *rng.sample(wires, 2)))
+    return builder.circuit(wires[:inputs // 2], wires[inputs // 2:inputs],
+                           wires[-min(outputs, len(wires)):])
+
+
+GENERATORS = {
+    "adder": adder,
+    "comparator": comparator,
+    "multiplier": multiplier,
+    "random": random_dag,
+}
+
+
+def generate(kind, size, seed=None):
+    """
+    Create a circuit of a kind
+    :param kind: The kind of circuit, a key of GENERATORS
+    :param size: The bit size of the operands, or the number of gates of random circuits
+    :param seed: Optional; the seed of random circuits (default None)
+    :return: A dict containing circuit spec
+    """
+    if kind == "random":
+        return random_dag(size, seed=seed)
+    return GENERATORS[kind](size)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    from src import loader
+
+    parser = argparse.ArgumentParser(description="Generate circuits for benchmarks.")
+    parser.add_argument("kind", choices=list(GENERATORS), help="the kind of circuit")
+    parser.add_argument("sizes",
+                        type=int,
+                        nargs="+",
+                        help="the bit sizes of the operands, or the numbers of gates of "
+                             "random circuits")
+    parser.add_argument("-o",
+                        "--output",
+                        required=True,
+                        help=f"the circuit file to write, binary if it ends with "
+                             f"{loader.BINARY_SUFFIX} and JSON otherwise")
+    parser.add_argument("--seed", type=int, help="the seed of random circuits")
+    args = parser.parse_args()
+
+    circuits = [generate(args.kind, size, args.seed) for size in args.sizes]
+    if args.output.endswith(loader.BINARY_SUFFIX):
+        loader.save_binary(args.output, args.kind, circuits)
+    else:
+        with open(args.output, "w") as f:
+            json.dump({"name": args.kind, "circuits": circuits}, f)
@@ -0,0 +1,427 @@
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+from src import util, wire, yao
+
+# BINARY CIRCUIT FILES
+# A binary circuit file holds circuits already compiled to dense evaluation
+# order, as little-endian typed arrays aligned on 8 bytes: the wire ID of
+# each dense index (inputs first, then the output of gate k at inputs + k),
+# the dense indexes of the first and second input of each gate (-1 for NOT
+# gates), the dense index of each output and the code of each gate. Loading
+# maps the file in memory and reads the arrays in place, without parsing.
+MAGIC = b"YAOC"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sHHI")  # magic, version, length of the name, count of circuits
+# count of inputs, of gates, of Alice's inputs, of Bob's inputs, of outputs, length of the
+# JSON-encoded ID
+CIRCUIT_HEADER = struct.Struct("<QQQQQQ")
+ALIGNMENT = 8
+MAX_WIRES = 2**31 - 1  # dense indexes are stored as 32-bit integers
+
+BINARY_SUFFIX = ".ybc"
+BRISTOL_SUFFIXES = (".txt", ".bristol")
+VALIDATION_CHUNK_SIZE = 1 << 20  # number of gates checked at once when loading
+
+# Gates of Bristol Fashion circuits and their gate in this package
+BRISTOL_GATES = {"XOR": "XOR", "AND": "AND", "INV": "NOT", "NOT": "NOT"}
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+class GateView(Sequence):
+    """
+    A read-only view of the gates of a BinaryCircuit as dicts of gate spec,
+    created when accessed.
+
+    Args:
+        plan: The CompiledCircuit of the circuit
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+
+    def __len__(self):
+        return len(self.plan)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self.plan.gate(i) for i in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("gate index out of range")
+        return self.plan.gate(k)
+
+    def __iter__(self):
+        return (self.plan.gate(k) for k in range(len(self)))
+
+
+class BinaryCircuit(Mapping):
+    """
+    A circuit stored as typed arrays in dense evaluation order.
+
+    It reads as a dict of circuit spec, whose gates are created when
+    accessed, and carries its CompiledCircuit: garbling and evaluation use
+    the arrays directly, whatever the size of the circuit.
+
+    Args:
+        circuit_id: The circuit ID
+        alice: The number of Alice's inputs, the first input wires
+        bob: The number of Bob's inputs, following Alice's
+        wires: A sequence of the wire ID of each dense index, inputs first
+        in_a: A sequence of the dense index of the first input of each gate
+        in_b: A sequence of the dense index of the second input of each gate,
+            -1 for NOT gates
+        outputs: A sequence of the dense index of each output
+        types: A sequence of the gate code of each gate
+        source: Optional; the path of the binary file and the index of the
+            circuit in the file, to reload the circuit in other processes
+
+    Raises:
+        ValueError: if the arrays do not describe a circuit in evaluation order
+    """
+
+    def __init__(self, circuit_id, alice, bob, wires, in_a, in_b, outputs, types, source=None):
+        gate_count = len(types)
+        input_count = len(wires) - gate_count
+        if not (len(in_a) == len(in_b) == gate_count and 0 <= alice + bob <= input_count):
+            raise ValueError(f"Inconsistent arrays of circuit {circuit_id}")
+        self.id = circuit_id
+        self.alice = alice
+        self.bob = bob
+        self.arrays = (wires, in_a, in_b, outputs, types)
+        self.source = source
+        self._digest = None
+        self._check()
+        self.plan = yao.CompiledCircuit.from_arrays(circuit_id, wires, input_count, types,
+                                                    in_a, in_b, outputs)
+        self._spec = {
+            "id": circuit_id,
+            "alice": list(wires[:alice]),
+            "bob": list(wires[alice:alice + bob]),
+            "out": self.plan.outputs,
+            "gates": GateView(self.plan),
+        }
+
+    def _check(self):
+        """
+        Check that gates only read earlier wires, by chunks of gates
+        :return:
+        :raise ValueError: if the arrays do not describe a circuit in evaluation order
+        """
+        wires, in_a, in_b, outputs, types = self.arrays
+        input_count = len(wires) - len(types)
+        for start in range(0, len(types), VALIDATION_CHUNK_SIZE):
+            stop = min(start + VALIDATION_CHUNK_SIZE, len(types))
+            limit = np.arange(input_count + start, input_count + stop)
+            gate_types = np.asarray(types[start:stop], np.uint8)
+            first = np.asarray(in_a[start:stop], np.int64)
+            second = np.asarray(in_b[start:stop], np.int64)
+            if (gate_types >= len(yao.GATE_TYPES)).any():
+                raise ValueError(f"Unknown gate type in circuit {self.id}")
+            if ((first < 0) | (first >= limit) | (second >= limit)).any():
+                raise ValueError(f"Circuit {self.id} is not in evaluation order")
+            if ((second < 0) != (gate_types == yao.NOT)).any():
+                raise ValueError(f"Gates of circuit {self.id} have a wrong number of inputs")
+        out = np.asarray(outputs, np.int64)
+        if ((out < 0) | (out >= len(wires))).any():
+            raise ValueError(f"Unknown output wire in circuit {self.id}")
+
+    def __getitem__(self, key):
+        return self._spec[key]
+
+    def __iter__(self):
+        return iter(self._spec)
+
+    def __len__(self):
+        return len(self._spec)
+
+    def digest(self):
+        """
+        Return a hash of the circuit, computed once
+        :return: The SHA-256 digest of its ID, input counts and arrays
+        """
+        if self._digest is None:
+            h = hashlib.sha256(b"binary circuit")
+            h.update(json.dumps([self.id, self.alice, self.bob]).encode())
+            for values in self.arrays:
+                h.update(struct.pack("<Q", len(values)))
+                h.update(memoryview(values).cast("B"))
+            self._digest = h.digest()
+        return self._digest
+
+    def to_state(self):
+        return {
+            "id": self.id,
+            "alice": self.alice,
+            "bob": self.bob,
+            "arrays": [memoryview(values).cast("B") for values in self.arrays],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        buffers = state["arrays"]
+        if len(buffers) != 5:
+            raise ValueError("Expected the 5 arrays of a circuit")
+        arrays = [memoryview(buffer).cast("B").cast(fmt)
+                  for buffer, fmt in zip(buffers, ("q", "i", "i", "i", "B"))]
+        return cls(state["id"], state["alice"], state["bob"], *arrays)
+
+    def __reduce__(self):
+        # Worker processes map the file again instead of receiving the arrays
+        if self.source is not None:
+            return _load_circuit, self.source
+        state = self.to_state()
+        state["arrays"] = [bytes(values) for values in state["arrays"]]
+        return BinaryCircuit.from_state, (state,)
+
+
+wire.register(BinaryCircuit, "circuit", BinaryCircuit.to_state, BinaryCircuit.from_state)
+
+
+def _check_byteorder():
+    if sys.byteorder != "little":
+        raise NotImplementedError("Binary circuit files need a little-endian machine")
+
+
+def from_compiled(circuit):
+    """
+    Convert a circuit to a BinaryCircuit
+    :param circuit: A dict containing circuit spec
+    :return: A BinaryCircuit holding the arrays of its evaluation plan
+    """
+    _check_byteorder()
+    plan = yao.CompiledCircuit(circuit)
+    alice, bob = len(circuit.get("alice", [])), len(circuit.get("bob", []))
+    if len(plan.wires) > MAX_WIRES:
+        raise ValueError(f"Circuit {plan.id} has more than {MAX_WIRES} wires")
+    if plan.lut_inputs:
+        raise ValueError(f"Circuit {plan.id} has LUT gates, which binary circuit files "
+                         f"cannot hold")
+    return BinaryCircuit(plan.id, alice, bob, array.array("q", plan.wires),
+                         array.array("i", plan.in_a), array.array("i", plan.in_b),
+                         array.array("i", [plan.index[w] for w in plan.outputs]),
+                         array.array("B", plan.types))
+
+
+def save_binary(path, name, circuits):
+    """
+    Write circuits to a binary circuit file
+    :param path: The path of the file
+    :param name: The name of the circuits
+    :param circuits: A list of dicts containing circuit spec or of BinaryCircuits
+    :return:
+    """
+    _check_byteorder()
+    circuits = [c if isinstance(c, BinaryCircuit) else from_compiled(c) for c in circuits]
+    name = name.encode()
+    with open(path, "wb") as f:
+        def write(data):
+            f.write(data)
+            f.write(bytes(_padding(f.tell())))
+
+        f.write(FILE_HEADER.pack(MAGIC, VERSION, len(name), len(circuits)))
+        write(name)
+        for circuit in circuits:
+            circuit_id = json.dumps(circuit.id).encode()
+            wires, in_a, in_b, outputs, types = circuit.arrays
+            f.write(CIRCUIT_HEADER.pack(len(wires) - len(types), len(types), circuit.alice,
+                                        circuit.bob, len(outputs), len(circuit_id)))
+            write(circuit_id)
+            for values in circuit.arrays:
+                write(memoryview(values).cast("B"))
+
+
+def load_binary(path):
+    """
+    Map a binary circuit file in memory
+    :param path: The path of the file
+    :return: A dict containing the name of the circuits and the list of
+        BinaryCircuits, whose arrays are views of the memory map
+    :raise ValueError: if the file is not a valid binary circuit file
+    """
+    _check_byteorder()
+    with open(path, "rb") as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def read(offset, size):
+        if offset + size > len(data):
+            raise ValueError(f"Truncated binary circuit file {path}")
+        return data[offset:offset + size], offset + size
+
+    def read_aligned(offset, size):
+        block, offset = read(offset, size)
+        return block, offset + _padding(offset)
+
+    header, offset = read(0, FILE_HEADER.size)
+    magic, version, name_size, count = FILE_HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a binary circuit file of version {VERSION}")
+    name, offset = read_aligned(offset, name_size)
+    circuits = []
+    for i in range(count):
+        header, offset = read(offset, CIRCUIT_HEADER.size)
+        input_count, gate_count, alice, bob, output_count, id_size = CIRCUIT_HEADER.unpack(header)
+        circuit_id, offset = read_aligned(offset, id_size)
+        arrays = []
+        for fmt, length in (("q", input_count + gate_count), ("i", gate_count),
+                            ("i", gate_count), ("i", output_count), ("B", gate_count)):
+            values, offset = read_aligned(offset, length * struct.calcsize(fmt))
+            arrays.append(values.cast(fmt))
+        circuits.append(BinaryCircuit(json.loads(bytes(circuit_id)), alice, bob, *arrays,
+                                      source=(os.path.abspath(path), i)))
+    return {"name": bytes(name).decode(), "circuits": circuits}
+
+
+def _load_circuit(path, i):
+    return load_binary(path)["circuits"][i]
+
+
+def load_bristol(path, circuit_id=None):
+    """
+    Load a Bristol Fashion circuit.
+
+    The first input value is Alice's and the others Bob's. Wires keep their
+    Bristol number; the outputs are the last wires. INV, XOR, AND, MAND, EQ
+    and EQW gates are supported, EQW being an alias of its input wire unless
+    it writes an output.
+    :param path: The path of the file
+    :param circuit_id: Optional; the circuit ID (default the file name)
+    :return: A BinaryCircuit
+    :raise ValueError: if the file is not a topologically ordered Bristol
+        Fashion circuit
+    """
+    _check_byteorder()
+    if circuit_id is None:
+        circuit_id = os.path.splitext(os.path.basename(path))[0]
+    with open(path) as f:
+        lines = (line.split() for line in f)
+        lines = (tokens for tokens in lines if tokens)
+        try:
+            _, wire_count = map(int, next(lines))
+            input_sizes = list(map(int, next(lines)))[1:]
+            output_sizes = list(map(int, next(lines)))[1:]
+        except (StopIteration, ValueError):
+            raise ValueError(f"{path} has no Bristol Fashion header") from None
+
+        input_count, output_count = sum(input_sizes), sum(output_sizes)
+        if not input_count:
+            raise ValueError(f"Circuit {circuit_id} has no input")
+        index = array.array("q", [-1]) * wire_count  # dense index of each Bristol wire
+        index[:input_count] = array.array("q", range(input_count))
+        wires = array.array("q", range(input_count))
+        in_a, in_b, types = array.array("i"), array.array("i"), array.array("B")
+
+        def dense(w):
+            if not 0 <= w < wire_count or index[w] < 0:
+                raise ValueError(f"Wire {w} of circuit {circuit_id} is read before written")
+            return index[w]
+
+        def append_gate(gate_type, a, b, out):
+            wires.append(out)
+            in_a.append(a)
+            in_b.append(b)
+            types.append(yao.GATE_CODES[gate_type])
+
+        def add_gate(gate_type, a, b, out):
+            if not 0 <= out < wire_count or index[out] >= 0:
+                raise ValueError(f"Wire {out} of circuit {circuit_id} is written twice")
+            index[out] = len(wires)
+            append_gate(gate_type, a, b, out)
+
+        zero_wire = []  # dense index of a wire of constant 0, once created
+
+        def zero():
+            # x XOR x is 0 for any wire x, written to the ID after the Bristol wires
+            if not zero_wire:
+                zero_wire.append(len(wires))
+                append_gate("XOR", 0, 0, wire_count)
+            return zero_wire[0]
+
+        for tokens in lines:
+            n_in, n_out, gate = int(tokens[0]), int(tokens[1]), tokens[-1]
+            values = list(map(int, tokens[2:-1]))
+            if len(values) != n_in + n_out:
+                raise ValueError(f"Malformed gate {' '.join(tokens)} of circuit {circuit_id}")
+            ins, outs = values[:n_in], values[n_in:]
+            if gate in BRISTOL_GATES:
+                gate_type = BRISTOL_GATES[gate]
+                add_gate(gate_type, dense(ins[0]), dense(ins[1]) if gate_type != "NOT" else -1,
+                         outs[0])
+            elif gate == "MAND":
+                for a, b, out in zip(ins[:n_out], ins[n_out:], outs):
+                    add_gate("AND", dense(a), dense(b), out)
+            elif gate == "EQ":
+                # constant: x XOR x is 0 and x XNOR x is 1, for any wire x
+                add_gate("XNOR" if ins[0] else "XOR", 0, 0, outs[0])
+            elif gate == "EQW" and outs[0] >= wire_count - output_count:
+                add_gate("XOR", dense(ins[0]), zero(), outs[0])
+            elif gate == "EQW":
+                if index[outs[0]] >= 0:
+                    raise ValueError(f"Wire {outs[0]} of circuit {circuit_id} is written twice")
+                index[outs[0]] = dense(ins[0])
+            else:
+                raise ValueError(f"Unsupported gate {gate} in circuit {circuit_id}")
+
+    outputs = array.array("i", (dense(w) for w in range(wire_count - output_count, wire_count)))
+    return BinaryCircuit(circuit_id, input_sizes[0], input_count - input_sizes[0], wires, in_a,
+                         in_b, outputs, types)
+
+
+def load_circuits(path):
+    """
+    Load a file of circuits, by extension: JSON, Bristol Fashion or binary
+    :param path: The path of the file
+    :return: A dict containing the name of the circuits and their list
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == BINARY_SUFFIX:
+        return load_binary(path)
+    if suffix in BRISTOL_SUFFIXES:
+        circuit = load_bristol(path)
+        return {"name": circuit.id, "circuits": [circuit]}
+    return util.parse_json(path)
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+    import resource
+    import time
+
+    parser = argparse.ArgumentParser(description="Convert circuits to binary circuit files.")
+    parser.add_argument("input",
+                        help="the circuit file to convert: JSON, Bristol Fashion "
+                             f"({', '.join(BRISTOL_SUFFIXES)}) or binary ({BINARY_SUFFIX})")
+    parser.add_argument("output", help=f"the binary circuit file to write ({BINARY_SUFFIX})")
+    parser.add_argument("-n",
+                        "--name",
+                        help="the name of the circuits (default the name in the input file)")
+    parser.add_argument("-v",
+                        "--verbose",
+                        action="store_true",
+                        help="check that the output file loads and print its load time")
+    args = parser.parse_args()
+
+    circuits = load_circuits(args.input)
+    save_binary(args.output, args.name or circuits["name"], circuits["circuits"])
+    if args.verbose:
+        logging.basicConfig(format="%(message)s", level=logging.INFO)
+        start = time.perf_counter()
+        loaded = load_binary(args.output)
+        seconds = time.perf_counter() - start
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for circuit in loaded["circuits"]:
+            logging.info(f"{circuit['id']}: {len(circuit['gates'])} gates")
+        logging.info(f"Loaded {args.output} in {seconds:.3f}s, max RSS {rss / 1024:.1f} MiB")
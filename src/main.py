@@ -2,13 +2,18 @@
 
 # Press Shift+F10 to execute it or replace it with your code.
 # Press Double Shift to search everywhere for classes, files, tool windows, actions, and settings.
+import cProfile
 import logging
+import pstats
+import sys
 
-from src import player
+from src import metrics, ot, player, pool, server, util, vectors, yao
 
 logging.basicConfig(format="[%(levelname)s] %(message)s",
                     level=logging.WARNING)
 
+PROFILE_LINES = 30  # number of functions of the profile printed at exit
+
 
 def main(
         party,
@@ -16,17 +21,78 @@ def main(
         oblivious_transfer=True,
         print_mode="circuit",
         log_level=logging.WARNING,
+        scheme="classic",
+        cipher="fernet",
+        ot_extension=False,
+        ot_group="modp2048",
+        ot_backend="prime",
+        stream=False,
+        workers=None,
+        batch_mode=False,
+        sessions=server.SESSION_WORKERS,
+        pool_dir=None,
+        random_ots=0,
+        optimize=False,
+        metrics_format=None,
+        profile=None,
+        inputs=None,
+        input_format=None,
+        pipelined=False,
+        window=ot.PIPELINE_DEPTH,
+        endpoint=None,
+        fuse=0,
+        seed=None,
+        keep_keys=True,
 ):
     logging.getLogger().setLevel(log_level)
 
-    if party == "alice":
-        alice = player.Alice(circuit_path, oblivious_transfer=oblivious_transfer)
-        alice.start()
-    elif party == "bob":
-        bob = player.Bob()
-        bob.listen()
-    else:
-        logging.error(f"Unknown party '{party}'")
+    profiler = None
+    if profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        if party == "alice":
+            garbled_pool = None
+            if pool_dir:
+                garbled_pool = pool.GarbledPool(pool_dir, scheme, cipher, workers=workers)
+            if seed is not None:
+                seed = seed.to_bytes(yao.SEED_SIZE, "little")
+            alice = player.Alice(circuit_path, oblivious_transfer=oblivious_transfer,
+                                 scheme=scheme, cipher=cipher, ot_extension=ot_extension,
+                                 ot_group=ot_group, ot_backend=ot_backend, stream=stream,
+                                 workers=workers, batch_mode=batch_mode,
+                                 garbled_pool=garbled_pool, random_ots=random_ots,
+                                 optimize=optimize, inputs=inputs, input_format=input_format,
+                                 pipelined=pipelined, window=window, fuse=fuse,
+                                 seed=seed, keep_keys=keep_keys,
+                                 endpoint=endpoint or util.GARBLER_ENDPOINT)
+            alice.start()
+        elif party == "bob":
+            bob = player.Bob(oblivious_transfer=oblivious_transfer, ot_extension=ot_extension,
+                             ot_group=ot_group, ot_backend=ot_backend, random_ots=random_ots,
+                             inputs=inputs, input_format=input_format,
+                             socket=util.EvaluatorSocket(endpoint) if endpoint else None)
+            bob.listen()
+        elif party == "server":
+            evaluator = server.EvaluatorServer(endpoint or util.EVALUATOR_ENDPOINT,
+                                               workers=sessions,
+                                               oblivious_transfer=oblivious_transfer,
+                                               ot_extension=ot_extension, ot_group=ot_group,
+                                               ot_backend=ot_backend, random_ots=random_ots)
+            evaluator.serve()
+            logging.info(evaluator.stats())
+        else:
+            logging.error(f"Unknown party '{party}'")
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+        if metrics_format == "prometheus":
+            print(metrics.to_prometheus(), file=sys.stderr)
+        elif metrics_format == "json" or profiler is not None:
+            print(metrics.to_json(), file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -43,24 +109,139 @@ if __name__ == '__main__':
         }
         parser = argparse.ArgumentParser(description="Run Yao Protocol.")
         parser.add_argument("party",
-                            choices=["alice", "bob"],
-                            help="the yao party to run")
+                            choices=["alice", "bob", "server"],
+                            help="the yao party to run, 'server' for a bob serving "
+                                 "many alices at once")
         parser.add_argument(
             "-c",
             "--circuit",
             metavar="circuit.json",
             default="circuits/default.json",
-            help="the JSON circuit file for alice and local tests",
+            help="the circuit file for alice and local tests: JSON, Bristol "
+                 "Fashion or binary",
         )
         parser.add_argument("--no-oblivious-transfer",
                             action="store_true",
                             help="disable oblivious transfer")
+        parser.add_argument("--ot-extension",
+                            action="store_true",
+                            help="derive oblivious transfers from base OTs (both parties)")
+        parser.add_argument(
+            "--ot-group",
+            metavar="group",
+            choices=["modp768", "modp1024", "modp1536", "modp2048", "random"],
+            default="modp2048",
+            help="the group of the OT sender, 'random' for a random 64-bit one "
+                 "(default 'modp2048')")
+        parser.add_argument(
+            "--ot-backend",
+            metavar="backend",
+            choices=["prime", "ec"],
+            default="prime",
+            help="the public-key OT, 'ec' for the simplest OT on Curve25519 "
+                 "(default 'prime')")
+        parser.add_argument("--random-ots",
+                            metavar="n",
+                            type=int,
+                            default=0,
+                            help="the number of random OTs precomputed before each circuit by "
+                                 "alice, or stored by bob (default 0, none)")
         parser.add_argument(
             "-m",
             metavar="mode",
             choices=["circuit", "table"],
             default="circuit",
             help="the print mode for local tests (default 'circuit')")
+        parser.add_argument(
+            "-s",
+            "--scheme",
+            metavar="scheme",
+            choices=["classic", "half-gates"],
+            default="classic",
+            help="the garbling scheme of alice (default 'classic')")
+        parser.add_argument(
+            "--cipher",
+            metavar="cipher",
+            choices=["fernet", "fixed-key"],
+            default="fernet",
+            help="the label cipher of the classic scheme (default 'fernet')")
+        parser.add_argument("--stream",
+                            action="store_true",
+                            help="send the garbled tables of alice in chunks while garbling")
+        parser.add_argument("-w",
+                            "--workers",
+                            metavar="n",
+                            type=int,
+                            help="the number of processes garbling each circuit of alice")
+        parser.add_argument("--sessions",
+                            metavar="n",
+                            type=int,
+                            default=server.SESSION_WORKERS,
+                            help="the number of sessions the server runs at once "
+                                 f"(default {server.SESSION_WORKERS})")
+        parser.add_argument("--pool",
+                            metavar="directory",
+                            help="send circuits garbled offline into this pool by "
+                                 "'python -m src.pool' instead of garbling them")
+        parser.add_argument("--batch",
+                            action="store_true",
+                            help="evaluate all inputs of alice in one half-gates batch")
+        parser.add_argument("--metrics",
+                            metavar="format",
+                            choices=["json", "prometheus"],
+                            help="print the metrics of the run to stderr at exit, as 'json' "
+                                 "or 'prometheus' text")
+        parser.add_argument("--profile",
+                            metavar="file",
+                            help="profile the run with cProfile into this file, and print "
+                                 "the slowest functions and the metrics to stderr at exit")
+        parser.add_argument("-O",
+                            "--optimize",
+                            action="store_true",
+                            help="optimize the circuits of alice before garbling them")
+        parser.add_argument("--fuse",
+                            type=int,
+                            default=0,
+                            metavar="k",
+                            help="fuse small subcircuits of alice into LUT gates of up to k "
+                                 "inputs, with the classic scheme only (default 0, off)")
+        parser.add_argument("--seed",
+                            type=int,
+                            help="garble the instances of alice from seeds derived from this "
+                                 "one, for reproducible runs; anyone knowing it can decode the "
+                                 "wire labels")
+        parser.add_argument("--no-keep-keys",
+                            action="store_true",
+                            help="derive the keys of the wires of alice while garbling instead "
+                                 "of keeping them all in memory")
+        parser.add_argument("-i",
+                            "--inputs",
+                            metavar="file",
+                            help="evaluate the circuits on the input vectors of the party in "
+                                 "this file, '-' for stdin, instead of on all inputs")
+        parser.add_argument("--input-format",
+                            metavar="format",
+                            choices=vectors.FORMATS,
+                            help="the format of the input vectors, 'csv' or 'binary' (default "
+                                 f"binary for {vectors.BINARY_SUFFIX} files, csv otherwise)")
+        parser.add_argument("--pipelined",
+                            action="store_true",
+                            help="evaluate the truth tables of alice with one instance per "
+                                 "input combination, garbled ahead of their evaluation")
+        parser.add_argument("--window",
+                            metavar="n",
+                            type=int,
+                            default=ot.PIPELINE_DEPTH,
+                            help="the number of instances alice garbles ahead of their "
+                                 "evaluation with --pipelined or --inputs, and bob evaluates "
+                                 f"at once (default {ot.PIPELINE_DEPTH})")
+        parser.add_argument("-e",
+                            "--endpoint",
+                            metavar="endpoint",
+                            help="the endpoint alice connects to and bob binds, e.g. "
+                                 f"{util.local_endpoint(util.IPC)} for parties of one host "
+                                 f"(default {util.GARBLER_ENDPOINT} for alice, "
+                                 f"{util.EVALUATOR_ENDPOINT} for bob)")
 
         parser.add_argument("-l",
                             "--loglevel",
@@ -68,12 +249,35 @@ if __name__ == '__main__':
                             choices=log_levels.keys(),
                             default="warning",
                             help="the log level (default 'warning')")
+        ot_group = parser.parse_args().ot_group
         main(
             party=parser.parse_args().party,
             circuit_path=parser.parse_args().circuit,
             oblivious_transfer=not parser.parse_args().no_oblivious_transfer,
             print_mode=parser.parse_args().m,
             log_level=log_levels[parser.parse_args().loglevel],
+            scheme=parser.parse_args().scheme,
+            cipher=parser.parse_args().cipher,
+            ot_extension=parser.parse_args().ot_extension,
+            ot_backend=parser.parse_args().ot_backend,
+            ot_group=None if ot_group == "random" else ot_group,
+            stream=parser.parse_args().stream,
+            workers=parser.parse_args().workers,
+            batch_mode=parser.parse_args().batch,
+            sessions=parser.parse_args().sessions,
+            pool_dir=parser.parse_args().pool,
+            random_ots=parser.parse_args().random_ots,
+            optimize=parser.parse_args().optimize,
+            metrics_format=parser.parse_args().metrics,
+            profile=parser.parse_args().profile,
+            inputs=parser.parse_args().inputs,
+            input_format=parser.parse_args().input_format,
+            pipelined=parser.parse_args().pipelined,
+            window=parser.parse_args().window,
+            endpoint=parser.parse_args().endpoint,
+            fuse=parser.parse_args().fuse,
+            seed=parser.parse_args().seed,
+            keep_keys=not parser.parse_args().no_keep_keys,
         )
 
 
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+
+# METRICS
+# Counters and timers of the phases of the protocol, shared by all the
+# threads of a process. They are updated once per phase, never per gate, so
+# that they stay on at near-zero cost.
+PREFIX = "yao"
+
+# Metrics of the package, for reference:
+# counters: gates_garbled, gates_evaluated, decrypt_failures, ots, messages_sent,
+#   messages_received, bytes_sent, bytes_received, evaluations
+# timers: garble, evaluate, serialize, deserialize, send, recv, ot, pipeline_wait
+# peaks: live_wires
+
+
+class Registry:
+    """
+    A set of counters, timers and peaks.
+
+    Args:
+        enabled: Optional; record updates (default true)
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}  # map from name to value
+        self._timers = {}  # map from name to [count, total seconds, max seconds]
+        self._peaks = {}  # map from name to the highest value recorded
+
+    def count(self, name, value=1):
+        """
+        Increase a counter
+        :param name: The name of the counter
+        :param value: Optional; the increment (default 1)
+        :return:
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """
+        Record a duration in a timer
+        :param name: The name of the timer
+        :param seconds: The duration
+        :return:
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            timer = self._timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def peak(self, name, value):
+        """
+        Record a value in a peak, which keeps the highest value recorded
+        :param name: The name of the peak
+        :param value: The value
+        :return:
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._peaks[name] = max(self._peaks.get(name, value), value)
+
+    def timer(self, name):
+        """
+        Time a block of code
+        :param name: The name of the timer
+        :return: A context manager recording the duration of the block
+        """
+        return _Timer(self, name)
+
+    def reset(self):
+        """
+        Clear all counters, timers and peaks
+        :return:
+        """
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self._peaks.clear()
+
+    def snapshot(self):
+        """
+        Return the current values of the counters, timers and peaks
+        :return: A dict of counters, of timers, each a dict of count,
+            seconds and max seconds, and of peaks
+        """
+        with self._lock:
+            return {
+                "counters": dict(sorted(self._counters.items())),
+                "timers": {
+                    name: {"count": count, "seconds": total, "max_seconds": longest}
+                    for name, (count, total, longest) in sorted(self._timers.items())
+                },
+                "peaks": dict(sorted(self._peaks.items())),
+            }
+
+    def to_json(self):
+        """Return the snapshot as JSON text"""
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """
+        Return the snapshot in the Prometheus text exposition format:
+        counters as <prefix>_<name>_total, timers as summaries
+        <prefix>_<name>_seconds with a <prefix>_<name>_seconds_max gauge,
+        peaks as <prefix>_<name>_peak gauges
+        :return: The text
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot["counters"].items():
+            metric = f"{PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, timer in snapshot["timers"].items():
+            metric = f"{PREFIX}_{name}_seconds"
+            lines += [f"# TYPE {metric} summary",
+                      f"{metric}_count {timer['count']}",
+                      f"{metric}_sum {timer['seconds']:.9f}",
+                      f"# TYPE {metric}_max gauge",
+                      f"{metric}_max {timer['max_seconds']:.9f}"]
+        for name, value in snapshot["peaks"].items():
+            metric = f"{PREFIX}_{name}_peak"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "start")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+
+
+REGISTRY = Registry()  # the metrics of the package
+count = REGISTRY.count
+observe = REGISTRY.observe
+peak = REGISTRY.peak
+timer = REGISTRY.timer
+snapshot = REGISTRY.snapshot
+reset = REGISTRY.reset
+to_json = REGISTRY.to_json
+to_prometheus = REGISTRY.to_prometheus
+
+
+def set_enabled(enabled):
+    """
+    Turn the recording of the metrics of the package on or off
+    :param enabled: Record updates
+    :return:
+    """
+    REGISTRY.enabled = enabled
@@ -0,0 +1,290 @@
+import logging
+
+from src import yao
+
+# Gates are rewritten as literals: a pair (wire, negation), or (None, bit)
+# for the constants. AND-family gates become an AND of literals whose output
+# is negated or not, XOR-family gates an XOR of wires whose output is negated
+# or not, and NOT gates only negate a literal: negations are folded into the
+# gates reading them, then each gate is emitted with the type that absorbs
+# the negations of its inputs and output.
+CONSTANT = None
+
+# negation of the inputs and of the output of each AND-family gate, as an AND
+AND_FORMS = {"AND": (0, 0), "NAND": (0, 1), "OR": (1, 1), "NOR": (1, 0)}
+# gate emitted for an AND node by negation of its inputs and of its output
+AND_GATES = {(0, 0): "AND", (0, 1): "NAND", (1, 1): "OR", (1, 0): "NOR"}
+ASSIGNMENT_DEPTH = 2  # levels of nested AND nodes followed to prove gates disjoint
+
+
+def count_gates(circuit):
+    """
+    Count the gates of a circuit
+    :param circuit: A dict containing circuit spec
+    :return: A dict of the count of gates and of non-free gates, the gates
+        with a garbled table under free-XOR
+    """
+    types = [gate["type"] for gate in circuit["gates"]]
+    return {
+        "gates": len(types),
+        "non_free": sum(1 for gate_type in types if gate_type in AND_FORMS),
+    }
+
+
+def _negate(literal, negation=1):
+    return literal[0], literal[1] ^ negation
+
+
+class _Builder:
+    """
+    The nodes of an optimized circuit, built gate by gate in evaluation order.
+
+    Nodes are named after the first gate computing them. Equal nodes are
+    merged (common subexpressions) and the literal of each wire is recorded.
+
+    Args:
+        inputs: The input wires of the circuit
+    """
+
+    def __init__(self, inputs):
+        self.literals = {w: (w, 0) for w in inputs}  # map from wire to its literal
+        self.nodes = {}  # map from node to (op, literal, literal), in evaluation order
+        self.merged = {}  # map from (op, literal, literal) to its node
+
+    def node(self, op, a, b, node_id):
+        key = (op,) + tuple(sorted((a, b)))
+        if key not in self.merged:
+            self.merged[key] = node_id
+            self.nodes[node_id] = key
+        return self.merged[key], 0
+
+    def xor(self, a, b, node_id):
+        negation = a[1] ^ b[1]
+        if a[0] is CONSTANT:
+            return b[0], negation
+        if b[0] is CONSTANT:
+            return a[0], negation
+        if a[0] == b[0]:
+            return CONSTANT, negation
+        return _negate(self.node("XOR", (a[0], 0), (b[0], 0), node_id), negation)
+
+    def and_(self, a, b, node_id):
+        for x, y in ((a, b), (b, a)):
+            if x[0] is CONSTANT:
+                return y if x[1] else (CONSTANT, 0)
+        if a[0] == b[0]:
+            return a if a[1] == b[1] else (CONSTANT, 0)
+        return self.node("AND", a, b, node_id)
+
+    def gate(self, gate):
+        """
+        Add a gate of the original circuit
+        :param gate: A dict containing gate spec
+        :return:
+        """
+        gate_type, gate_id = gate["type"], gate["id"]
+        if gate_type == yao.LUT_TYPE:
+            raise ValueError(f"Cannot optimize LUT gate {gate_id}: optimize circuits before "
+                             f"fusing their gates")
+        a = self.literals[gate["in"][0]]
+        if gate_type == "NOT":
+            self.literals[gate_id] = _negate(a)
+            return
+        b = self.literals[gate["in"][1]]
+        if gate_type in ("XOR", "XNOR"):
+            self.literals[gate_id] = _negate(self.xor(a, b, gate_id), gate_type == "XNOR")
+            return
+        input_negation, output_negation = AND_FORMS[gate_type]
+        a, b = _negate(a, input_negation), _negate(b, input_negation)
+        if output_negation and self.disjoint(_negate(a), _negate(b)):
+            # the OR of two literals that are never both 1 is their XOR
+            self.literals[gate_id] = self.xor(_negate(a), _negate(b), gate_id)
+            return
+        self.literals[gate_id] = _negate(self.and_(a, b, gate_id), output_negation)
+
+    def assignments(self, literal, depth=ASSIGNMENT_DEPTH):
+        """
+        Return the values of wires implied by a literal of value 1
+        :param literal: The literal
+        :param depth: The levels of AND nodes to follow
+        :return: A dict mapping wires to bits
+        """
+        wire, negation = literal
+        values = {wire: 1 ^ negation}
+        node = self.nodes.get(wire)
+        if node is not None and node[0] == "AND" and not negation and depth:
+            for operand in node[1:]:
+                for w, bit in self.assignments(operand, depth - 1).items():
+                    values.setdefault(w, bit)
+        return values
+
+    def disjoint(self, a, b):
+        """
+        Tell whether two literals are never both 1
+        :param a: A literal
+        :param b: A literal
+        :return: True if proven disjoint, False if unknown
+        """
+        if a[0] is CONSTANT or b[0] is CONSTANT:
+            return False
+        values_a, values_b = self.assignments(a), self.assignments(b)
+        if any(values_b.get(w, bit) != bit for w, bit in values_a.items()):
+            return True
+        # an XOR node set by one literal whose operands are set by the other
+        for values, other in ((values_a, values_b), (values_b, values_a)):
+            for w, bit in values.items():
+                node = self.nodes.get(w)
+                if node is not None and node[0] == "XOR":
+                    (x, _), (y, _) = node[1:]
+                    if x in other and y in other and other[x] ^ other[y] != bit:
+                        return True
+        return False
+
+
+def optimize(circuit):
+    """
+    Optimize a circuit before garbling: propagate constants, fold NOT gates,
+    merge common subexpressions, rewrite OR-like gates of disjoint inputs as
+    XOR gates and remove the gates no output depends on
+    :param circuit: A dict containing circuit spec
+    :return: A dict containing the spec of an equivalent circuit, with the
+        same ID, inputs and outputs
+    """
+    plan = yao.compile_circuit(circuit)
+    builder = _Builder(plan.inputs)
+    for k in range(len(plan)):
+        builder.gate(plan.gate(k))
+
+    # Dead-gate elimination: keep the nodes outputs depend on
+    live = set()
+    pending = [builder.literals[w][0] for w in plan.outputs]
+    while pending:
+        node = pending.pop()
+        if node in builder.nodes and node not in live:
+            live.add(node)
+            pending.extend(literal[0] for literal in builder.nodes[node][1:])
+
+    # Each node is written to a wire, named after an output computing it if
+    # any, holding its value XOR its polarity
+    names = {node: node for node in live}
+    polarity = dict.fromkeys(live, 0)
+    claimed = set()
+    for first in (True, False):
+        for w in plan.outputs:
+            node, negation = builder.literals[w]
+            if node in live and node not in claimed and (node == w) == first:
+                names[node], polarity[node] = w, negation
+                claimed.add(node)
+
+    next_id = max(plan.wires, default=0) + 1
+    gates, not_wires = [], {}
+
+    def new_wire():
+        nonlocal next_id
+        next_id += 1
+        return next_id - 1
+
+    def physical(literal):
+        # the wire holding a literal and the negation to apply to it
+        node, negation = literal
+        if node in live:
+            return names[node], negation ^ polarity[node]
+        return node, negation
+
+    def not_wire(w):
+        if w not in not_wires:
+            not_wires[w] = new_wire()
+            gates.append({"id": not_wires[w], "type": "NOT", "in": [w]})
+        return not_wires[w]
+
+    for node, (op, a, b) in builder.nodes.items():
+        if node not in live:
+            continue
+        (wire_a, negation_a), (wire_b, negation_b) = physical(a), physical(b)
+        if op == "XOR":
+            negation = negation_a ^ negation_b ^ polarity[node]
+            gate_type = "XNOR" if negation else "XOR"
+        else:
+            if negation_a != negation_b:
+                # no gate negates one input only: read a negated copy
+                if negation_a:
+                    wire_a, negation_a = not_wire(wire_a), 0
+                else:
+                    wire_b, negation_b = not_wire(wire_b), 0
+            gate_type = AND_GATES[(negation_a, polarity[node])]
+        gates.append({"id": names[node], "type": gate_type, "in": [wire_a, wire_b]})
+
+    # Outputs without their own node: constants, inputs and shared nodes
+    for w in plan.outputs:
+        literal = builder.literals[w]
+        if (literal[0] in live and names[literal[0]] == w) or literal == (w, 0):
+            continue
+        if literal[0] is CONSTANT:
+            if not plan.inputs:
+                raise ValueError(f"Circuit {plan.id} has a constant output and no input")
+            x = plan.inputs[0]
+            gates.append({"id": w, "type": "XNOR" if literal[1] else "XOR", "in": [x, x]})
+            continue
+        source, negation = physical(literal)
+        if not negation:
+            source = not_wire(source)
+        gates.append({"id": w, "type": "NOT", "in": [source]})
+
+    return {
+        "id": circuit["id"],
+        "alice": list(circuit.get("alice", [])),
+        "bob": list(circuit.get("bob", [])),
+        "out": list(circuit["out"]),
+        "gates": gates,
+    }
+
+
+def report(circuit, optimized):
+    """
+    Describe the gate counts of a circuit before and after optimization
+    :param circuit: A dict containing circuit spec
+    :param optimized: A dict containing the spec of the optimized circuit
+    :return: A line of text
+    """
+    before, after = count_gates(circuit), count_gates(optimized)
+    return (f"{circuit['id']}: {before['gates']} -> {after['gates']} gates, "
+            f"{before['non_free']} -> {after['non_free']} non-free gates")
+
+
+def optimize_all(circuits):
+    """
+    Optimize circuits and log their gate counts before and after
+    :param circuits: A list of dicts containing circuit spec
+    :return: The list of the optimized circuits
+    """
+    optimized = []
+    for circuit in circuits:
+        optimized.append(optimize(circuit))
+        logging.info(report(circuit, optimized[-1]))
+    return optimized
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    from src import loader
+
+    parser = argparse.ArgumentParser(description="Optimize circuits before garbling.")
+    parser.add_argument("input", help="the circuit file: JSON, Bristol Fashion or binary")
+    parser.add_argument("-o",
+                        "--output",
+                        help="write the optimized circuits to this file, binary if it ends "
+                             f"with {loader.BINARY_SUFFIX} and JSON otherwise")
+    args = parser.parse_args()
+
+    circuits = loader.load_circuits(args.input)
+    optimized = []
+    for circuit in circuits["circuits"]:
+        optimized.append(optimize(circuit))
+        print(report(circuit, optimized[-1]))
+    if args.output and args.output.endswith(loader.BINARY_SUFFIX):
+        loader.save_binary(args.output, circuits["name"], optimized)
+    elif args.output:
+        with open(args.output, "w") as f:
+            json.dump({"name": circuits["name"], "circuits": optimized}, f, indent=2)
@@ -1,14 +1,114 @@
 import hashlib
 import logging
-import pickle
+import secrets
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from src import yao, util
+import numpy as np
+
+from src import batch, metrics, yao, util
+
+# OT BACKENDS
+PRIME_BACKEND = "prime"  # Smart's OT in a prime group
+EC_BACKEND = "ec"  # Chou and Orlandi's simplest OT on Curve25519
+BACKENDS = (PRIME_BACKEND, EC_BACKEND)
+
+# OT EXTENSION
+BASE_OT_COUNT = 128  # number of base OTs, i.e. the security parameter
+SEED_SIZE = 16  # byte size of the base OT seeds
+
+PIPELINE_DEPTH = 2  # instances garbled ahead by Alice, and evaluated at once by Bob
+
+
+class RandomOTStore:
+    """
+    A bounded store of random OTs precomputed with one peer.
+
+    The sender stores pairs of random seeds (r0, r1) and the receiver stores
+    pairs (c, r_c) of a random choice bit and the selected seed. Both sides
+    add and take the same number of random OTs in the same order.
+
+    Args:
+        capacity: The maximum number of stored random OTs
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = deque()
+        self.consumed = 0  # number of random OTs taken since the session started
+
+    def __len__(self):
+        return len(self.items)
+
+    def room(self):
+        """Return the number of random OTs that can be added"""
+        return self.capacity - len(self.items)
+
+    def add(self, items):
+        """
+        Add random OTs
+        :param items: A list of seed pairs, or of (choice, seed) pairs
+        :return:
+        """
+        if len(items) > self.room():
+            raise ValueError(f"Cannot store {len(items)} more random OTs")
+        self.items.extend(items)
+
+    def take(self, count):
+        """
+        Take the oldest random OTs
+        :param count: The number of random OTs
+        :return: A list of seed pairs, or of (choice, seed) pairs
+        """
+        self.consumed += count
+        return [self.items.popleft() for _ in range(count)]
 
 
 class ObliviousTransfer:
-    def __init__(self, socket, enabled=True):
+    """
+    Transfer of Bob's input keys from Alice.
+
+    All of Bob's wires are transferred at once: Alice sends, Bob answers and
+    Alice sends again, whatever the number of wires. The OT sender picks the
+    group of the session and sends it along with the first OT only. With OT
+    extension, BASE_OT_COUNT public-key OTs with swapped roles are run once
+    per session; every later OT is derived from their seeds with symmetric
+    crypto only (Ishai-Kilian-Nissim-Petrank).
+
+    Attributes:
+        socket: the socket to the other party
+        enabled: Optional; enable the Oblivious Transfer protocol (default true)
+        extension: Optional; enable OT extension (default false)
+        group: Optional; the name of the group of util.NAMED_GROUPS for the
+            public-key OTs, or None for a random group (default modp2048)
+        backend: Optional; the public-key OT, prime or ec (default prime)
+        random_ots: Optional; the number of random OTs precomputed with the
+            peer that can be stored, 0 to disable them (default 0)
+    """
+    def __init__(self, socket, enabled=True, extension=False, group=util.DEFAULT_GROUP,
+                 backend=PRIME_BACKEND, random_ots=0):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown OT backend '{backend}'")
         self.socket = socket
         self.enabled = enabled
+        self.extension = extension
+        self.backend = backend
+        self.group_name = group
+        self.group = None  # group of the session once agreed
+        self.base_ot = None  # seeds of the base OTs once set up
+        self.ot_count = 0  # number of extended OTs of the session
+        self.random_ots = RandomOTStore(random_ots) if random_ots else None
+
+    def reset(self):
+        """
+        Forget the state of the session, before a session with another party
+        :return:
+        """
+        self.group = None
+        self.base_ot = None
+        self.ot_count = 0
+        if self.random_ots is not None:
+            self.random_ots = RandomOTStore(self.random_ots.capacity)
 
     def get_result(self, a_inputs, b_keys):
         """
@@ -18,52 +118,348 @@ class ObliviousTransfer:
         :return: The result of the yao circuit evaluation
         """
         logging.debug("Sending inputs to Bob")
-        self.socket.send(a_inputs)
-
-        for _ in range(len(b_keys)):
-            w = self.socket.receive()  # receive wire ID where to perform OT
-            logging.debug(f"Received gate ID {w}")
-
-            if self.enabled:
-                pair = (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
-                self.ot_garbler(pair)
-            else:
-                to_send = (b_keys[w][0], b_keys[w][1])
-                self.socket.send(to_send)
-
+        msgs = {
+            w: (util.pack_input(*key_pair[0]), util.pack_input(*key_pair[1]))
+            for w, key_pair in b_keys.items()
+        }
+        self.transfer(msgs, a_inputs)
         return self.socket.receive()
 
-    def send_result(self, circuit, g_tables, p_bits_out, b_inputs):
+    def send_result(self, circuit, g_tables, p_bits_out, b_inputs, scheme=yao.CLASSIC,
+                    cipher=yao.FERNET):
         """
         Evaluate circuit and send the result to Alice
-        :param circuit: A dict containing circuit spec
+        :param circuit: A dict containing circuit spec, or its CompiledCircuit
         :param g_tables: Garbled tables of yao circuit
         :param p_bits_out: p-bits of outputs
         :param b_inputs: A dict mapping Bob's wires to (clear) input bits
+        :param scheme: Optional; the garbling scheme of the circuit (default classic)
+        :param cipher: Optional; the label cipher of the circuit (default fernet)
         :return:
         """
         # map from Alice's wires to (key, encr_bit) inputs
-        a_inputs = self.socket.receive()
+        a_inputs, msgs = self.receive(b_inputs)
         # map from Bob's wires to (key, encr_bit) inputs
-        b_inputs_encr = {}
+        b_inputs_encr = {w: util.unpack_input(msg) for w, msg in msgs.items()}
 
         logging.debug(f"Received Alice's inputs: {a_inputs}")
 
-        for w, b_input in b_inputs.items():
-            logging.debug(f"Sending wire ID {w}")
-            self.socket.send(w)
+        result = yao.evaluate(circuit, g_tables, p_bits_out, a_inputs, b_inputs_encr, scheme,
+                              cipher)
+        self.socket.send(result)
+
+    def get_streamed_result(self, a_inputs, b_keys, garbler):
+        """
+        Send Alice's inputs, then the garbled tables chunk by chunk as they are
+        created, and retrieve Bob's result of evaluation.
+
+        Bob acknowledges each chunk before evaluating it, so that Alice garbles
+        the next chunk while Bob evaluates the previous one.
+        :param a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs
+        :param b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit)
+        :param garbler: The yao.StreamingGarbler of the evaluation
+        :return: The result of the yao circuit evaluation
+        """
+        self.transfer({
+            w: (util.pack_input(*key_pair[0]), util.pack_input(*key_pair[1]))
+            for w, key_pair in b_keys.items()
+        }, a_inputs)
+        self.socket.receive()
+        for chunk in garbler.chunks():
+            self.socket.send_wait(chunk)
+        logging.debug("Sent all chunks to Bob")
+        return self.socket.send_wait({"p_bits_out": garbler.get_p_bits_out()})
+
+    def send_streamed_result(self, circuit, b_inputs, scheme=yao.CLASSIC, cipher=yao.FERNET):
+        """
+        Evaluate a streamed circuit chunk by chunk and send the result to Alice
+        :param circuit: A dict containing circuit spec, or its CompiledCircuit
+        :param b_inputs: A dict mapping Bob's wires to (clear) input bits
+        :param scheme: Optional; the garbling scheme of the circuit (default classic)
+        :param cipher: Optional; the label cipher of the circuit (default fernet)
+        :return:
+        """
+        a_inputs, msgs = self.receive(b_inputs)
+        b_inputs_encr = {w: util.unpack_input(msg) for w, msg in msgs.items()}
+        evaluator = yao.Evaluator(circuit, a_inputs, b_inputs_encr, scheme, cipher)
+        self.socket.send(True)
+
+        while True:
+            msg = self.socket.receive()
+            if "p_bits_out" in msg:
+                self.socket.send(evaluator.get_result(msg["p_bits_out"]))
+                return
+            self.socket.send(True)
+            evaluator.evaluate(msg["tables"], msg["start"], msg["stop"])
+
+    def send_vector(self, a_inputs, b_keys, g_tables, p_bits_out):
+        """
+        Send a garbled instance of a circuit for one input vector of Alice and
+        Bob, and Alice's inputs, then transfer Bob's inputs. Bob evaluates the
+        instance while the next one is sent.
+        :param a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs
+        :param b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit)
+        :param g_tables: The garbled tables of the instance
+        :param p_bits_out: The p-bits of outputs of the instance
+        :return: The list of the results of the previous vectors Bob finished
+            since the last call, in order
+        """
+        results = self.socket.send_wait({"garbled_tables": g_tables, "p_bits_out": p_bits_out})
+        msgs = {
+            w: (util.pack_input(*key_pair[0]), util.pack_input(*key_pair[1]))
+            for w, key_pair in b_keys.items()
+        }
+        self.transfer(msgs, a_inputs)
+        self.socket.receive()
+        return results
+
+    def end_vectors(self):
+        """
+        End the input vectors of a circuit
+        :return: The list of the results of the vectors Bob had not returned yet
+        """
+        return self.socket.send_wait(None)
+
+    def send_vector_results(self, circuit, read_vector, scheme=yao.CLASSIC, cipher=yao.FERNET,
+                            depth=PIPELINE_DEPTH):
+        """
+        Evaluate instances of a circuit on input vectors until Alice ends
+        them, Bob's side of send_vector. Each instance is evaluated in the
+        background while the next one is transferred, with up to depth
+        instances at once, and results are returned as they are finished.
+        :param circuit: A dict containing circuit spec, or its CompiledCircuit
+        :param read_vector: A function returning Bob's next input vector, as a
+            dict mapping Bob's wires to (clear) input bits
+        :param scheme: Optional; the garbling scheme of the circuit (default classic)
+        :param cipher: Optional; the label cipher of the circuit (default fernet)
+        :param depth: Optional; the maximum number of instances evaluated at
+            once (default PIPELINE_DEPTH)
+        :return: The number of evaluated vectors
+        """
+        pending = deque()  # futures of the results not returned yet, in order
+        count = 0
+        with ThreadPoolExecutor(1) as executor:
+            while True:
+                instance = self.socket.receive()
+                if instance is not None and "random_ots" in instance:
+                    self.answer_precompute(instance)
+                    continue
+                results = []
+                # Finished results, blocking on the oldest one when the
+                # pipeline is full, and all of them at the end
+                while pending and (instance is None or len(pending) >= depth
+                                   or pending[0].done()):
+                    results.append(pending.popleft().result())
+                self.socket.send(results)
+                if instance is None:
+                    return count
+
+                b_inputs = read_vector()
+                if b_inputs is None:
+                    raise ValueError("Bob has fewer input vectors than Alice")
+                a_inputs, msgs = self.receive(b_inputs)
+                b_inputs_encr = {w: util.unpack_input(msg) for w, msg in msgs.items()}
+                self.socket.send(True)
+                pending.append(executor.submit(yao.evaluate, circuit,
+                                               instance["garbled_tables"],
+                                               instance["p_bits_out"], a_inputs,
+                                               b_inputs_encr, scheme, cipher))
+                count += 1
+
+    def get_batch_result(self, a_labels, b_labels, garbled):
+        """
+        Send the garbled instances of a batch along with Alice's inputs and
+        retrieve the results of Bob's batch evaluation.
+        :param a_labels: The (N, Alice's wires, LABEL_SIZE) array of Alice's input labels
+        :param b_labels: A pair of (N, Bob's wires, LABEL_SIZE) arrays of the
+            labels of bits 0 and 1 of Bob's wires
+        :param garbled: The batch.BatchGarbledCircuit
+        :return: The (N, outputs) array of the results of each instance
+        """
+        label0, label1 = b_labels
+        wire_count = label0.shape[1]
+        msgs = {
+            i * wire_count + j: (label0[i, j].tobytes(), label1[i, j].tobytes())
+            for i in range(garbled.count) for j in range(wire_count)
+        }
+        self.transfer(msgs, {
+            "count": garbled.count,
+            "a_labels": batch.to_buffer(a_labels),
+            "tables": batch.to_buffer(garbled.tables),
+            "p_bits_out": batch.to_buffer(garbled.get_p_bits_out()),
+        })
+        outputs = self.socket.receive()
+        return batch.from_buffer(outputs, (garbled.count, len(garbled.plan.outputs)))
+
+    def send_batch_result(self, circuit, b_inputs):
+        """
+        Evaluate the garbled instances of a batch and send the results to Alice
+        :param circuit: A dict containing circuit spec
+        :param b_inputs: A list of dicts mapping Bob's wires to (clear) input
+            bits, one per instance
+        :return:
+        """
+        plan = yao.compile_circuit(circuit)
+        a_wires, b_wires = circuit.get("alice", []), circuit.get("bob", [])
+        header, msgs = self.receive({
+            i * len(b_wires) + j: inputs[w]
+            for i, inputs in enumerate(b_inputs) for j, w in enumerate(b_wires)
+        })
+        count, label_size = header["count"], yao.LABEL_SIZE
+        if count != len(b_inputs):
+            raise ValueError(f"Expected {len(b_inputs)} instances, got {count}")
+
+        # Labels of the input wires in the order of the plan
+        labels = np.zeros((count, len(plan.inputs), label_size), np.uint8)
+        index = {w: k for k, w in enumerate(plan.inputs)}
+        for w in plan.inputs:
+            if w not in a_wires and w not in b_wires:
+                raise ValueError(f"Missing input for wire {w}")
+        labels[:, [index[w] for w in a_wires]] = batch.from_buffer(
+            header["a_labels"], (count, len(a_wires), label_size))
+        labels[:, [index[w] for w in b_wires]] = batch.from_buffer(
+            b"".join(msgs[i] for i in range(count * len(b_wires))),
+            (count, len(b_wires), label_size))
+        tables = batch.from_buffer(header["tables"],
+                                   (count, len(batch.and_gates(plan)), 2, label_size))
+        p_bits_out = batch.from_buffer(header["p_bits_out"], (count, len(plan.outputs)))
+
+        outputs = batch.evaluate(plan, tables, labels, p_bits_out)
+        self.socket.send(batch.to_buffer(outputs))
 
-            if self.enabled:
-                b_inputs_encr[w] = pickle.loads(self.ot_evaluator(b_input))
+    def transfer(self, msgs, header=None, precomputed=True):
+        """
+        Transfer one message of each pair to Bob in a constant number of
+        messages: Alice sends, receives and sends again.
+        :param msgs: A dict mapping each Bob's wire to a pair (msg0, msg1)
+        :param header: Optional; data sent to Bob along with the first message
+        :param precomputed: Optional; use precomputed random OTs when enough
+            are stored (default true)
+        :return:
+        """
+        with metrics.timer("ot"):
+            if precomputed and self._use_random_ots(len(msgs)):
+                self.random_ot_garbler(msgs, header)
+            elif not self.enabled:
+                # Without OT, Bob receives both messages and selects one of them
+                self.socket.send((header, msgs))
+            elif self.extension:
+                self.ot_extension_garbler(msgs, header)
             else:
-                # Here the variable pair is in a specified order [clear input 0, clear input 1], so that we do not
-                # need ot But in practice, we need ot to determine which key to choose
-                pair = self.socket.receive()
-                logging.debug(f"Received key pair, key {b_input} selected")
-                b_inputs_encr[w] = pair[b_input]
+                self.ot_garbler_batch(msgs, header)
+        metrics.count("ots", len(msgs))
 
-        result = yao.evaluate(circuit, g_tables, p_bits_out, a_inputs, b_inputs_encr)
-        self.socket.send(result)
+    def receive(self, choices, precomputed=True):
+        """
+        Receive one message of each pair from Alice, Bob's side of transfer.
+        :param choices: A dict mapping Bob's wires to (clear) input bits
+        :param precomputed: Optional; use precomputed random OTs when enough
+            are stored (default true)
+        :return: A pair (header, dict mapping Bob's wires to the selected message)
+        """
+        with metrics.timer("ot"):
+            if precomputed and self._use_random_ots(len(choices)):
+                result = self.random_ot_evaluator(choices)
+            elif not self.enabled:
+                header, msgs = self.socket.receive()
+                logging.debug("Received message pairs")
+                result = header, {w: msgs[w][b] for w, b in choices.items()}
+            elif self.extension:
+                result = self.ot_extension_evaluator(choices)
+            else:
+                result = self.ot_evaluator_batch(choices)
+        metrics.count("ots", len(choices))
+        return result
+
+    def _use_random_ots(self, count):
+        """
+        Whether a transfer uses precomputed random OTs. Both parties store
+        the same number of them, so that they take the same decision.
+        :param count: The number of OTs of the transfer
+        :return:
+        """
+        return self.random_ots is not None and 0 < count <= len(self.random_ots)
+
+    def precompute(self, count):
+        """
+        Precompute random OTs with Bob ahead of the transfers, Alice's side
+        :param count: The number of random OTs to have in store, within the
+            capacity of the stores of both parties
+        :return: The number of precomputed random OTs
+        """
+        if self.random_ots is None:
+            return 0
+        count = min(count - len(self.random_ots), self.random_ots.room())
+        if count <= 0:
+            return 0
+        # Bob answers with the number of random OTs he can store
+        count = self.socket.send_wait({"random_ots": count})
+        if count:
+            seeds = {
+                j: (secrets.token_bytes(SEED_SIZE), secrets.token_bytes(SEED_SIZE))
+                for j in range(count)
+            }
+            self.transfer(seeds, precomputed=False)
+            self.socket.receive()
+            self.random_ots.add([seeds[j] for j in range(count)])
+        logging.debug(f"Precomputed {count} random OTs")
+        return count
+
+    def answer_precompute(self, request):
+        """
+        Precompute random OTs with Alice, Bob's side
+        :param request: The request of Alice, a dict holding the number of random OTs
+        :return:
+        """
+        count = 0
+        if self.random_ots is not None:
+            count = min(request["random_ots"], self.random_ots.room())
+        self.socket.send(count)
+        if count:
+            choices = {j: secrets.randbits(1) for j in range(count)}
+            _, seeds = self.receive(choices, precomputed=False)
+            self.random_ots.add([(choices[j], bytes(seeds[j])) for j in range(count)])
+            self.socket.send(True)
+
+    def random_ot_garbler(self, msgs, header=None):
+        """
+        Transfer derandomizing precomputed random OTs, Alice's side: Bob tells
+        for each wire whether his choice differs from his random choice, and
+        Alice sends each message XOR the pad of the matching seed
+        :param msgs: A dict mapping each Bob's wire to a pair (msg0, msg1)
+        :param header: Optional; data sent to Bob along with the first message
+        :return:
+        """
+        wires = sorted(msgs)
+        flips = self.socket.send_wait((header, self.random_ots.consumed))
+        e = []
+        for j, (w, seeds) in enumerate(zip(wires, self.random_ots.take(len(wires)))):
+            flip = (flips >> j) & 1
+            e.append(tuple(
+                util.xor_bytes(msg, self.random_ot_pad(seeds[b ^ flip], len(msg)))
+                for b, msg in enumerate(msgs[w])))
+        self.socket.send(e)
+        logging.debug(f"Transferred {len(wires)} wires with random OTs")
+
+    def random_ot_evaluator(self, choices):
+        """
+        Transfer derandomizing precomputed random OTs, Bob's side
+        :param choices: A dict mapping Bob's wires to (clear) input bits
+        :return: A pair (header, dict mapping Bob's wires to the selected message)
+        """
+        wires = sorted(choices)
+        header, consumed = self.socket.receive()
+        if consumed != self.random_ots.consumed:
+            raise ValueError(f"Alice used {consumed} random OTs, Bob {self.random_ots.consumed}")
+        random_ots = self.random_ots.take(len(wires))
+        # One bit per wire: the choice XOR the random choice
+        flips = sum((choices[w] ^ c) << j for j, (w, (c, _)) in enumerate(zip(wires, random_ots)))
+        e = self.socket.send_wait(flips)
+        msgs = {}
+        for j, (w, (_, seed)) in enumerate(zip(wires, random_ots)):
+            e_b = e[j][choices[w]]
+            msgs[w] = util.xor_bytes(e_b, self.random_ot_pad(seed, len(e_b)))
+        return header, msgs
 
     def ot_garbler(self, msgs):
         """
@@ -71,9 +467,13 @@ class ObliviousTransfer:
         :param msgs: A pair (msg1, msg2) to suggest to Bob.
         :return:
         """
+        if self.backend == EC_BACKEND:
+            self.ec_ot_garbler_batch({0: msgs})
+            return
+
         logging.debug("OT protocol started")
-        g = util.PrimeGroup()
-        self.socket.send_wait(g)
+        g, g_params = self._sender_group()
+        self.socket.send_wait(g_params)
 
         # OT protocol based on Nigel Smart's "Cryptography Made Simple"
         c = g.gen_pow(g.rand_int())
@@ -96,8 +496,11 @@ class ObliviousTransfer:
         Returns:
             The message selected by Bob
         """
+        if self.backend == EC_BACKEND:
+            return self.ec_ot_evaluator_batch({0: b})[1][0]
+
         logging.debug("OT protocol started")
-        g = self.socket.receive()
+        g = self._receiver_group(self.socket.receive())
         self.socket.send(True)
 
         # OT protocol based on Nigel Smart's "Cryptography Made Simple"
@@ -113,6 +516,294 @@ class ObliviousTransfer:
         logging.debug("OT protocol ended")
         return mb
 
+    def ot_garbler_batch(self, msgs, header=None):
+        """
+        Batched oblivious transfer, Alice's side: the group, the wire IDs and
+        all OT messages of a round travel together
+        :param msgs: A dict mapping each Bob's wire to a pair (msg0, msg1)
+        :param header: Optional; data sent to Bob along with the first message
+        :return:
+        """
+        if self.backend == EC_BACKEND:
+            self.ec_ot_garbler_batch(msgs, header)
+            return
+
+        logging.debug(f"Batched OT of {len(msgs)} wires started")
+        g, g_params = self._sender_group()
+        wires = list(msgs)
+
+        # OT protocol based on Nigel Smart's "Cryptography Made Simple"
+        cs = [g.gen_pow(g.rand_int()) for _ in wires]
+        h0s = self.socket.send_wait((header, wires, g_params, cs))
+        e = []
+        for w, c, h0 in zip(wires, cs, h0s):
+            msg0, msg1 = msgs[w]
+            h1 = g.mul(c, g.inv(h0))
+            k = g.rand_int()
+            c1 = g.gen_pow(k)
+            e0 = util.xor_bytes(msg0, self.ot_hash(g.pow(h0, k), len(msg0)))
+            e1 = util.xor_bytes(msg1, self.ot_hash(g.pow(h1, k), len(msg1)))
+            e.append((c1, e0, e1))
+        self.socket.send(e)
+
+        logging.debug("Batched OT ended")
+
+    def ot_evaluator_batch(self, choices):
+        """
+        Batched oblivious transfer, Bob's side
+        :param choices: A dict mapping Bob's wires to (clear) input bits
+        :return: A pair (header, dict mapping Bob's wires to the selected message)
+        """
+        if self.backend == EC_BACKEND:
+            return self.ec_ot_evaluator_batch(choices)
+
+        header, wires, g_params, cs = self.socket.receive()
+        g = self._receiver_group(g_params)
+        logging.debug(f"Batched OT of {len(wires)} wires started")
+
+        # OT protocol based on Nigel Smart's "Cryptography Made Simple"
+        xs = [g.rand_int() for _ in wires]
+        hs = []
+        for w, c, x in zip(wires, cs, xs):
+            x_pow = g.gen_pow(x)
+            h = (x_pow, g.mul(c, g.inv(x_pow)))
+            hs.append(h[choices[w]])
+        e = self.socket.send_wait(hs)
+
+        msgs = {}
+        for w, x, (c1, e0, e1) in zip(wires, xs, e):
+            e_b = (e0, e1)[choices[w]]
+            msgs[w] = util.xor_bytes(e_b, self.ot_hash(g.pow(c1, x), len(e_b)))
+
+        logging.debug("Batched OT ended")
+        return header, msgs
+
+    def ec_ot_garbler_batch(self, msgs, header=None):
+        """
+        Batched simplest OT on Curve25519, Alice's side
+        :param msgs: A dict mapping each Bob's wire to a pair (msg0, msg1)
+        :param header: Optional; data sent to Bob along with the first message
+        :return:
+        """
+        logging.debug(f"Batched EC OT of {len(msgs)} wires started")
+        curve = util.get_curve()
+        wires = list(msgs)
+
+        # Simplest OT of Chou and Orlandi: A = aG, k0 = H(aB) and k1 = H(a(B - A))
+        a = curve.rand_scalar()
+        a_point = curve.base_mul(a)
+        a_bytes = curve.encode(a_point)
+        minus_a = curve.neg(a_point)
+        bs = self.socket.send_wait((header, wires, a_bytes))
+        e = []
+        for j, (w, b_bytes) in enumerate(zip(wires, bs)):
+            msg0, msg1 = msgs[w]
+            b_point = curve.decode(b_bytes)
+            k0 = curve.dh(a, b_point)
+            k1 = curve.dh(a, curve.add(b_point, minus_a))
+            e.append((util.xor_bytes(msg0, self.ec_ot_hash(j, a_bytes, b_bytes, k0, len(msg0))),
+                      util.xor_bytes(msg1, self.ec_ot_hash(j, a_bytes, b_bytes, k1, len(msg1)))))
+        self.socket.send(e)
+
+        logging.debug("Batched EC OT ended")
+
+    def ec_ot_evaluator_batch(self, choices):
+        """
+        Batched simplest OT on Curve25519, Bob's side
+        :param choices: A dict mapping Bob's wires to (clear) input bits
+        :return: A pair (header, dict mapping Bob's wires to the selected message)
+        """
+        header, wires, a_bytes = self.socket.receive()
+        logging.debug(f"Batched EC OT of {len(wires)} wires started")
+        curve = util.get_curve()
+        a_point = curve.decode(a_bytes)
+
+        # B = bG to select msg0 and B = A + bG to select msg1, kb = H(bA)
+        scalars = [curve.rand_scalar() for _ in wires]
+        bs = []
+        for w, b in zip(wires, scalars):
+            b_point = curve.base_mul(b)
+            if choices[w]:
+                b_point = curve.add(b_point, a_point)
+            bs.append(curve.encode(b_point))
+        e = self.socket.send_wait(bs)
+
+        msgs = {}
+        for j, (w, b, b_bytes) in enumerate(zip(wires, scalars, bs)):
+            e_b = e[j][choices[w]]
+            ot_hash = self.ec_ot_hash(j, a_bytes, b_bytes, curve.dh(b, a_point), len(e_b))
+            msgs[w] = util.xor_bytes(e_b, ot_hash)
+
+        logging.debug("Batched EC OT ended")
+        return header, msgs
+
+    def ot_extension_garbler(self, msgs, header=None):
+        """
+        OT extension, Alice's side
+        :param msgs: A dict mapping each Bob's wire to a pair (msg0, msg1)
+        :param header: Optional; data sent to Bob before the extension
+        :return:
+        """
+        self.socket.send(header)
+        if self.base_ot is None:
+            self.base_ot = self._base_ot_garbler()
+        choices, seeds = self.base_ot
+
+        # Bob's wire order and the matrix U, column by column
+        wires, u = self.socket.receive()
+        m, start = len(wires), self.ot_count
+        logging.debug(f"OT extension of {m} wires started")
+
+        # Column i of Q is T_i XOR (s_i * r), so row j is t_j XOR (r_j * s)
+        q = [
+            self.ot_prg(seed, start, m) ^ (u_col if choice else 0)
+            for choice, seed, u_col in zip(choices, seeds, u)
+        ]
+        s = sum(choice << i for i, choice in enumerate(choices))
+        e = []
+        for j, (w, q_row) in enumerate(zip(wires, self.transpose(q, m))):
+            msg0, msg1 = msgs[w]
+            index = (start + j) << BASE_OT_COUNT
+            e.append((util.xor_bytes(msg0, self.ot_hash(index | q_row, len(msg0))),
+                      util.xor_bytes(msg1, self.ot_hash(index | (q_row ^ s), len(msg1)))))
+        self.socket.send(e)
+        self.ot_count += m
+
+        logging.debug("OT extension ended")
+
+    def ot_extension_evaluator(self, choices):
+        """
+        OT extension, Bob's side
+        :param choices: A dict mapping Bob's wires to (clear) input bits
+        :return: A pair (header, dict mapping Bob's wires to the selected message)
+        """
+        header = self.socket.receive()
+        if self.base_ot is None:
+            self.base_ot = self._base_ot_evaluator()
+
+        wires = list(choices)
+        m, start = len(wires), self.ot_count
+        r = sum(choices[w] << j for j, w in enumerate(wires))
+        logging.debug(f"OT extension of {m} wires started")
+
+        t = [self.ot_prg(seed0, start, m) for seed0, _ in self.base_ot]
+        u = [
+            t_col ^ self.ot_prg(seed1, start, m) ^ r
+            for t_col, (_, seed1) in zip(t, self.base_ot)
+        ]
+        e = self.socket.send_wait((wires, u))
+
+        msgs = {}
+        for j, (w, t_row) in enumerate(zip(wires, self.transpose(t, m))):
+            e_b = e[j][choices[w]]
+            ot_hash = self.ot_hash(((start + j) << BASE_OT_COUNT) | t_row, len(e_b))
+            msgs[w] = util.xor_bytes(e_b, ot_hash)
+        self.ot_count += m
+
+        logging.debug("OT extension ended")
+        return header, msgs
+
+    def _sender_group(self):
+        """
+        Return the group of the session, choosing it on the first OT
+        :return: A pair (group, parameters to send or None once agreed)
+        """
+        if self.group is not None:
+            return self.group, None
+        if self.group_name:
+            self.group = util.get_group(self.group_name)
+            return self.group, self.group_name
+        self.group = util.PrimeGroup().precompute()
+        return self.group, self.group
+
+    def _receiver_group(self, g_params):
+        """
+        Return the group of the session, agreeing on the sender's on the first OT
+        :param g_params: The name or the PrimeGroup sent by the sender, None once agreed
+        :return: A PrimeGroup
+        """
+        if g_params is not None:
+            if isinstance(g_params, str):
+                self.group = util.get_group(g_params)
+            else:
+                self.group = g_params.precompute()
+        return self.group
+
+    def _base_ot_garbler(self):
+        """
+        Base OTs of the OT extension, Alice's side: Alice receives one seed
+        of each of Bob's pairs according to her random choice bits
+        :return: A pair (choice bits, selected seeds)
+        """
+        logging.debug("Base OTs started")
+        choices = [secrets.randbits(1) for _ in range(BASE_OT_COUNT)]
+        _, seeds = self.ot_evaluator_batch(dict(enumerate(choices)))
+        self.socket.send(True)
+
+        logging.debug("Base OTs ended")
+        return choices, [seeds[i] for i in range(BASE_OT_COUNT)]
+
+    def _base_ot_evaluator(self):
+        """
+        Base OTs of the OT extension, Bob's side: Bob offers pairs of random seeds
+        :return: The list of pairs of seeds
+        """
+        logging.debug("Base OTs started")
+        seeds = [(secrets.token_bytes(SEED_SIZE), secrets.token_bytes(SEED_SIZE))
+                 for _ in range(BASE_OT_COUNT)]
+        self.ot_garbler_batch(dict(enumerate(seeds)))
+        self.socket.receive()
+
+        logging.debug("Base OTs ended")
+        return seeds
+
+    @staticmethod
+    def random_ot_pad(seed, length):
+        """
+        Expand the seed of a random OT
+        :param seed: The seed
+        :param length: The byte length of the pad
+        :return: The pad
+        """
+        return hashlib.shake_256(b"random-ot" + seed).digest(length)
+
+    @staticmethod
+    def ot_prg(seed, start, length):
+        """
+        Pseudo-random generator of the OT extension columns
+        :param seed: A base OT seed
+        :param start: The index of the first OT of the batch
+        :param length: The bit length of the output
+        :return: A random int of [length] bits
+        """
+        stream = hashlib.shake_256(seed + start.to_bytes(8, byteorder="big"))
+        value = int.from_bytes(stream.digest((length + 7) // 8), byteorder="big")
+        return value >> (-length % 8)
+
+    @staticmethod
+    def transpose(columns, length):
+        """
+        Transpose a bit matrix
+        :param columns: The columns of the matrix as ints of [length] bits
+        :param length: The number of rows
+        :return: The rows of the matrix as ints
+        """
+        rows = [0] * length
+        for i, column in enumerate(columns):
+            bit = 1 << i
+            for j, c in enumerate(reversed(format(column, f"0{length}b"))):
+                if c == "1":
+                    rows[j] |= bit
+        return rows
+
+    @staticmethod
+    def ec_ot_hash(index, a_bytes, b_bytes, key, msg_length):
+        """
+        Hash function for EC OT keys, bound to the OT index and transcript
+        """
+        data = index.to_bytes(8, byteorder="big") + a_bytes + b_bytes + key
+        return hashlib.shake_256(data).digest(msg_length)
+
     @staticmethod
     def ot_hash(pub_key, msg_length):
         """
@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+
+from src import metrics
+
+# PIPELINED EXECUTION
+# Instances of a circuit are garbled by a background thread, ahead of their
+# use, into a bounded queue: the garbler garbles instance i+1 while instance
+# i is sent and its OT runs, and Bob evaluates instance i-1 (see
+# ot.send_vector_results). The window is the bound of the queue, as Bob's
+# depth is the bound of the instances he has not returned yet.
+_END = object()  # marks the end of the instances in the queue
+
+
+class InstancePipeline:
+    """
+    An iterator over garbled instances of a circuit, one per input vector,
+    garbled by a background thread at most window instances ahead.
+
+    Args:
+        garble: A function returning a new garbled instance
+        vectors: An iterable of the input vectors, read by the background thread
+        window: The maximum number of instances garbled ahead
+    """
+
+    def __init__(self, garble, vectors, window):
+        if window < 1:
+            raise ValueError(f"The window of a pipeline must be at least 1, not {window}")
+        self.garble = garble
+        self.vectors = vectors
+        self.queue = queue.Queue(window)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="garbler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            for vector in self.vectors:
+                instance = self.garble()
+                if not self._put((vector, instance)):
+                    return
+        except BaseException as e:
+            self._put(e)
+            return
+        self._put(_END)
+
+    def _put(self, item):
+        # Block while the window is full, unless the pipeline is closed
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        while True:
+            start = time.perf_counter()
+            item = self.queue.get()
+            metrics.observe("pipeline_wait", time.perf_counter() - start)
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def close(self):
+        """
+        Stop garbling and wait for the background thread
+        :return:
+        """
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def report_rate(name, count, seconds):
+    """
+    Describe the throughput of a run of instances
+    :param name: The name of the run
+    :param count: The number of instances
+    :param seconds: The duration of the run
+    :return: A line of text
+    """
+    rate = count / seconds if seconds > 0 else 0.0
+    return f"{name}: {count} instances in {seconds:.3f}s, {rate:.1f} instances/sec"
@@ -1,32 +1,101 @@
-import util
+import itertools
 import logging
-import yao
+import sys
+import time
 from abc import ABC, abstractmethod
-from src import ot
+
+import numpy as np
+
+from src import batch, fusion, loader, metrics, optimizer, ot, pipeline, pool, util, vectors, yao
+
+PRECOMPUTED_VECTORS = 64  # number of input vectors of Bob's random OTs precomputed at once
 
 
 class YaoGarbler(ABC):
     """An abstract class for Yao garblers"""
 
-    def __init__(self, circuit_file_path):
-        circuits = util.parse_json(circuit_file_path)
+    def __init__(self, circuit_file_path, scheme=yao.CLASSIC, cipher=yao.FERNET, stream=False,
+                 workers=None, batch_mode=False, garbled_pool=None, optimize=False,
+                 vector_mode=False, fuse=0, seed=None, keep_keys=True):
+        circuits = loader.load_circuits(circuit_file_path)
         self.name = circuits["name"]
+        if optimize:
+            circuits["circuits"] = optimizer.optimize_all(circuits["circuits"])
+        if fuse:
+            circuits["circuits"] = fusion.fuse_all(circuits["circuits"], fuse)
+        if batch_mode:
+            # Batches are garbled with half-gates only
+            scheme, cipher = yao.HALF_GATES, yao.FIXED_KEY
+        self.scheme = scheme
+        self.cipher = cipher
+        self.stream = stream
+        self.workers = workers
+        self.batch = batch_mode
+        self.pool = garbled_pool
+        self.seed = seed
+        self.keep_keys = keep_keys
+        self.instances = itertools.count()  # index of the next instance garbled from the seed
         self.circuits = []
 
         for circuit in circuits["circuits"]:
-            garbled_circuit = yao.GarbledCircuit(circuit)
-            p_bits = garbled_circuit.get_p_bits()
-            entry = {
-                "circuit": circuit,
-                "garbled_circuit": garbled_circuit,
-                "garbled_tables": garbled_circuit.get_garbled_tables(),
-                "keys": garbled_circuit.get_keys(),
-                "p_bits": p_bits,
-                "p_bits_out": {
-                    w: p_bits[w] for w in circuit["out"]
-                }
+            if stream or batch_mode or vector_mode:
+                # Streamed, batched and vector circuits are garbled anew for each evaluation
+                self.circuits.append({
+                    "circuit": circuit,
+                    "scheme": scheme,
+                    "cipher": yao.FIXED_KEY if scheme == yao.HALF_GATES else cipher,
+                })
+            elif garbled_pool is not None:
+                # Pooled circuits were garbled offline and are popped when sent
+                self.circuits.append({"circuit": circuit, "pooled": True})
+            else:
+                self.circuits.append(self.garble(circuit))
+
+    def garble(self, circuit):
+        """
+        Garble a circuit
+        :param circuit: A dict containing circuit spec
+        :return: The entry of the garbled circuit
+        """
+        garbled_circuit = yao.GarbledCircuit(circuit, scheme=self.scheme, cipher=self.cipher,
+                                             workers=self.workers, seed=self.instance_seed(),
+                                             keep_keys=self.keep_keys)
+        p_bits = garbled_circuit.get_p_bits()
+        return {
+            "circuit": circuit,
+            "scheme": self.scheme,
+            "cipher": garbled_circuit.cipher.name,
+            "garbled_circuit": garbled_circuit,
+            "garbled_tables": yao.PackedTables.pack(garbled_circuit.get_garbled_tables()),
+            "keys": garbled_circuit.get_keys(),
+            "p_bits": p_bits,
+            "p_bits_out": {
+                w: p_bits[w] for w in circuit["out"]
             }
-            self.circuits.append(entry)
+        }
+
+    def instance_seed(self):
+        """
+        Return the seed of the next garbled instance
+        :return: A yao.SEED_SIZE-byte seed derived from the seed of the
+            garbler, or None for a random one
+        """
+        if self.seed is None:
+            return None
+        return yao.instance_seed(self.seed, next(self.instances))
+
+    def pop(self, circuit):
+        """
+        Take a garbled instance of a circuit from the pool, or garble one if
+        the pool is empty
+        :param circuit: A dict containing circuit spec
+        :return: The entry of the garbled circuit
+        """
+        try:
+            return self.pool.pop(circuit)
+        except pool.PoolEmpty as e:
+            logging.warning(f"{e}, garbling online")
+            return self.garble(circuit)
 
     @abstractmethod
     def start(self):
@@ -48,12 +117,63 @@ class Alice(YaoGarbler):
     Attributes:
         circuits: the JSON file containing circuits
         oblivious_transfer: Optional; enable the Oblivious Transfer protocol (default true)
+        scheme: Optional; the garbling scheme, classic or half-gates (default classic)
+        cipher: Optional; the label cipher, fernet or fixed-key (default fernet)
+        ot_extension: Optional; derive Bob's OTs from base OTs (default false)
+        ot_group: Optional; the named group of the OTs, None for a random one (default modp2048)
+        ot_backend: Optional; the public-key OT, prime or ec (default prime)
+        stream: Optional; garble each evaluation anew and send its tables in
+            chunks while garbling (default false)
+        workers: Optional; the number of processes garbling each circuit (default None)
+        batch_mode: Optional; garble one half-gates instance per input combination
+            and evaluate them all in one batch (default false)
+        endpoint: Optional; the endpoint of the evaluator (default localhost)
+        garbled_pool: Optional; the pool.GarbledPool of circuits garbled offline,
+            whose scheme and cipher must be the ones of Alice (default None)
+        random_ots: Optional; the number of random OTs precomputed with Bob
+            before each circuit, 0 to disable them (default 0)
+        optimize: Optional; optimize the circuits before garbling them (default false)
+        inputs: Optional; the file of Alice's input vectors, or "-" for stdin,
+            to evaluate each circuit on them instead of on all inputs (default None)
+        input_format: Optional; the format of the input vectors, csv or
+            binary (default from the file name)
+        pipelined: Optional; evaluate the truth tables with one instance per
+            input combination, pipelined as input vectors are (default false)
+        window: Optional; the number of instances garbled ahead of their
+            evaluation, and evaluated by Bob at once (default PIPELINE_DEPTH)
+        fuse: Optional; fuse small subcircuits into LUT gates of up to this
+            number of inputs, with the classic scheme only, 0 to disable (default 0)
+        seed: Optional; the yao.SEED_SIZE-byte secret seed of the run, from
+            which the instances garbled online derive theirs, for reproducible
+            runs (default None: random instances)
+        keep_keys: Optional; keep the keys of all wires of the instances in
+            memory, instead of only those of live wires while garbling and of
+            the inputs after (default true)
     """
 
-    def __init__(self, circuits, oblivious_transfer=True):
-        super().__init__(circuits)
-        self.socket = util.GarblerSocket()
-        self.ot = ot.ObliviousTransfer(self.socket, oblivious_transfer)
+    def __init__(self, circuits, oblivious_transfer=True, scheme=yao.CLASSIC,
+                 cipher=yao.FERNET, ot_extension=False, ot_group=util.DEFAULT_GROUP,
+                 ot_backend=ot.PRIME_BACKEND, stream=False, workers=None, batch_mode=False,
+                 endpoint=util.GARBLER_ENDPOINT, garbled_pool=None,
+                 random_ots=0, optimize=False, inputs=None, input_format=None,
+                 pipelined=False, window=ot.PIPELINE_DEPTH, fuse=0, seed=None,
+                 keep_keys=True):
+        if (inputs is not None or pipelined) and (stream or batch_mode):
+            raise ValueError("Pipelined instances are evaluated neither streamed nor batched")
+        super().__init__(circuits, scheme, cipher, stream, workers, batch_mode, garbled_pool,
+                         optimize, vector_mode=inputs is not None or pipelined, fuse=fuse,
+                         seed=seed, keep_keys=keep_keys)
+        if inputs is not None:
+            for circuit in self.circuits:
+                if not circuit["circuit"].get("alice") and not circuit["circuit"].get("bob"):
+                    raise ValueError(f"Circuit {circuit['circuit']['id']} has no inputs to "
+                                     f"read vectors for")
+        self.inputs = vectors.VectorReader(inputs, input_format) if inputs is not None else None
+        self.pipelined = pipelined
+        self.window = window
+        self.socket = util.GarblerSocket(endpoint)
+        self.ot = ot.ObliviousTransfer(self.socket, oblivious_transfer, ot_extension, ot_group,
+                                       ot_backend, random_ots)
 
     def start(self):
         """
@@ -62,14 +182,41 @@ class Alice(YaoGarbler):
 
         """
         for circuit in self.circuits:
+            if circuit.get("pooled"):
+                circuit = self.pop(circuit["circuit"])
+            if self.inputs is None:
+                # Random OTs for Bob's wires of all evaluations of the circuit
+                inputs = circuit["circuit"].get("alice", []) + circuit["circuit"].get("bob", [])
+                self.ot.precompute(len(circuit["circuit"].get("bob", [])) * 2**len(inputs))
             to_send = {
                 "circuit": circuit["circuit"],
-                "garbled_tables": circuit["garbled_tables"],
-                "p_bits_out": circuit["p_bits_out"],
+                "scheme": circuit["scheme"],
+                "cipher": circuit["cipher"],
             }
+            if self.batch:
+                to_send["batch"] = True
+            elif self.stream:
+                to_send["stream"] = True
+            elif self.inputs is not None:
+                to_send["inputs"] = True
+                to_send["window"] = self.window
+            elif self.pipelined:
+                to_send["pipelined"] = True
+                to_send["window"] = self.window
+            else:
+                to_send["garbled_tables"] = circuit["garbled_tables"]
+                to_send["p_bits_out"] = circuit["p_bits_out"]
             logging.debug(f"Sending {circuit['circuit']['id']}")
             self.socket.send_wait(to_send)
-            self.print(circuit)
+            if self.inputs is not None:
+                self.evaluate_inputs(circuit)
+            else:
+                self.print(circuit)
+
+        # End the session
+        self.socket.send_wait(None)
+        if self.pool is not None:
+            self.pool.join()
 
     def print(self, entry):
         """
@@ -77,39 +224,163 @@ class Alice(YaoGarbler):
         :param entry:
         :return:
         """
-        circuit, p_bits, keys = entry["circuit"], entry["p_bits"], entry["keys"]
-        outputs = circuit["out"]
+        circuit = entry["circuit"]
         a_wires = circuit.get("alice", [])  # Alice's wires
-        a_inputs = {}  # map from Alice's wires to (key, encr_bit) inputs
         b_wires = circuit.get("bob", [])  # Bob's wires
-        b_keys = {
-            w: util.get_encr_bits(p_bits[w], key0, key1)
-            for w, (key0, key1) in keys.items() if w in b_wires
-        }
         input_count = len(a_wires) + len(b_wires)
 
         print(f"======== {circuit['id']} ========")
 
         # Generate all inputs for both Alice and Bob
-        for bits in [format(n, 'b').zfill(input_count) for n in range(2 ** input_count)]:
+        all_bits = [format(n, 'b').zfill(input_count) for n in range(2 ** input_count)]
+        if self.batch:
+            results = self._get_batch_results(circuit, all_bits)
+        elif self.pipelined:
+            lines = iter(all_bits)
+            start = time.perf_counter()
+            count = self._evaluate_vectors(
+                entry, ([int(b) for b in bits[:len(a_wires)]] for bits in all_bits),
+                lambda result: self._print_line(circuit, next(lines), result))
+            print(pipeline.report_rate(circuit["id"], count, time.perf_counter() - start),
+                  file=sys.stderr)
+            return
+
+        for n, bits in enumerate(all_bits):
             bits_a = [int(b) for b in bits[:len(a_wires)]]  # Alice's inputs
 
-            # Map Alice's wires to (key, encr_bit)
-            for i in range(len(a_wires)):
-                a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]],
-                                        p_bits[a_wires[i]] ^ bits_a[i])
-
             # Send Alice's encrypted inputs and keys to Bob; retrieve result after evaluation
-            result = self.ot.get_result(a_inputs, b_keys)
+            if self.batch:
+                result = results[n]
+            elif self.stream:
+                garbler = yao.StreamingGarbler(circuit, entry["scheme"], entry["cipher"],
+                                               seed=self.instance_seed())
+                a_inputs, b_keys = self._get_inputs(circuit, garbler.get_keys(),
+                                                    garbler.get_p_bits(), bits_a)
+                result = self.ot.get_streamed_result(a_inputs, b_keys, garbler)
+            else:
+                a_inputs, b_keys = self._get_inputs(circuit, entry["keys"], entry["p_bits"],
+                                                    bits_a)
+                result = self.ot.get_result(a_inputs, b_keys)
+
+            self._print_line(circuit, bits, result)
+
+    @staticmethod
+    def _print_line(circuit, bits, result):
+        """
+        Print a line of the truth table of a circuit
+        :param circuit: A dict containing circuit spec
+        :param bits: The input combination, as a string of Alice's bits
+            followed by Bob's bits
+        :param result: A dict mapping each output to its bit
+        :return:
+        """
+        outputs = circuit["out"]
+        a_wires, b_wires = circuit.get("alice", []), circuit.get("bob", [])
+        str_bits_a = ' '.join(bits[:len(a_wires)])
+        str_bits_b = ' '.join(bits[len(a_wires):])
+        str_result = ' '.join([str(result[w]) for w in outputs])
+
+        print(f"  Alice{a_wires} = {str_bits_a} "
+              f"Bob{b_wires} = {str_bits_b}  "
+              f"Outputs{outputs} = {str_result}")
+
+    def evaluate_inputs(self, entry):
+        """
+        Evaluate a circuit on Alice's input vectors of the circuit, each on a
+        garbled instance of its own, and print the outputs of each vector as a
+        line of CSV as soon as Bob returns them. A circuit without inputs of
+        Alice is evaluated once per input vector of Bob.
+        :param entry: The entry of the circuit
+        :return: The number of evaluated vectors
+        """
+        circuit = entry["circuit"]
+        a_wires = circuit.get("alice", [])
 
-            # Format output
-            str_bits_a = ' '.join(bits[:len(a_wires)])
-            str_bits_b = ' '.join(bits[len(a_wires):])
-            str_result = ' '.join([str(result[w]) for w in outputs])
+        def print_result(result):
+            print(vectors.format_bits(result[w] for w in circuit["out"]), flush=True)
 
-            print(f"  Alice{a_wires} = {str_bits_a} "
-                  f"Bob{b_wires} = {str_bits_b}  "
-                  f"Outputs{outputs} = {str_result}")
+        print(f"======== {circuit['id']} ========")
+        start = time.perf_counter()
+        if a_wires:
+            all_bits_a = ([bits_a[w] for w in a_wires]
+                          for bits_a in iter(lambda: self.inputs.read(a_wires), None))
+        else:
+            all_bits_a = itertools.repeat([], self.socket.send_wait("vector_count"))
+        count = self._evaluate_vectors(entry, all_bits_a, print_result)
+        self.inputs.end_section()
+        print(pipeline.report_rate(circuit["id"], count, time.perf_counter() - start),
+              file=sys.stderr)
+        return count
+
+    def _evaluate_vectors(self, entry, all_bits_a, handle_result):
+        """
+        Evaluate a circuit on vectors of Alice's inputs, each on a garbled
+        instance of its own: instances are garbled in the background, up to
+        the window ahead, while the current one is sent and Bob evaluates the
+        previous ones
+        :param entry: The entry of the circuit
+        :param all_bits_a: An iterable of Alice's input vectors, as lists of bits
+        :param handle_result: A function called on the result of each vector,
+            in order, as a dict mapping each output to its bit
+        :return: The number of evaluated vectors
+        """
+        circuit = entry["circuit"]
+        b_wires = circuit.get("bob", [])
+        garble = self.pop if self.pool is not None else self.garble
+        count = 0
+        with pipeline.InstancePipeline(lambda: garble(circuit), all_bits_a,
+                                       self.window) as instances:
+            for bits_a, instance in instances:
+                random_ots = self.ot.random_ots
+                if random_ots is not None and len(random_ots) < len(b_wires):
+                    self.ot.precompute(len(b_wires) * PRECOMPUTED_VECTORS)
+                a_inputs, b_keys = self._get_inputs(circuit, instance["keys"],
+                                                    instance["p_bits"], bits_a)
+                for result in self.ot.send_vector(a_inputs, b_keys, instance["garbled_tables"],
+                                                  instance["p_bits_out"]):
+                    handle_result(result)
+                count += 1
+        for result in self.ot.end_vectors():
+            handle_result(result)
+        metrics.count("evaluations", count)
+        return count
+
+    def _get_batch_results(self, circuit, all_bits):
+        """
+        Garble one instance per input combination and evaluate them in one batch
+        :param circuit: A dict containing circuit spec
+        :param all_bits: The list of input combinations, as strings of Alice's
+            bits followed by Bob's bits
+        :return: The list of results, as dicts mapping each output to its bit
+        """
+        a_wires, b_wires = circuit.get("alice", []), circuit.get("bob", [])
+        garbled = batch.BatchGarbledCircuit(circuit, len(all_bits))
+        bits_a = np.array([[int(b) for b in bits[:len(a_wires)]] for bits in all_bits],
+                          np.uint8).reshape(len(all_bits), len(a_wires))
+        outputs = self.ot.get_batch_result(garbled.encode(a_wires, bits_a),
+                                           garbled.get_label_pairs(b_wires), garbled)
+        return [dict(zip(circuit["out"], row.tolist())) for row in outputs]
+
+    @staticmethod
+    def _get_inputs(circuit, keys, p_bits, bits_a):
+        """
+        Select Alice's input keys and prepare the pairs of keys of Bob's wires
+        :param circuit: A dict containing circuit spec
+        :param keys: A dict mapping each input wire to its pair of keys
+        :param p_bits: A dict mapping each input wire to its p-bit
+        :param bits_a: The list of Alice's input bits
+        :return: A pair (dict mapping Alice's wires to (key, encr_bit) inputs,
+            dict mapping Bob's wires to pairs (key, encr_bit))
+        """
+        a_inputs = {
+            w: (keys[w][bit], p_bits[w] ^ bit)
+            for w, bit in zip(circuit.get("alice", []), bits_a)
+        }
+        b_keys = {
+            w: util.get_encr_bits(p_bits[w], *keys[w])
+            for w in circuit.get("bob", [])
+        }
+        return a_inputs, b_keys
 
 
 class Bob:
@@ -120,10 +391,25 @@ class Bob:
 
     Attributes:
         oblivious_transfer: Optional; enable the Oblivious Transfer protocol (default true)
+        ot_extension: Optional; derive Bob's OTs from base OTs (default false)
+        ot_group: Optional; the named group of the base OTs of OT extension,
+            None for a random one (default modp2048)
+        ot_backend: Optional; the public-key OT, prime or ec (default prime)
+        socket: Optional; the socket to the garblers (default an EvaluatorSocket)
+        random_ots: Optional; the number of random OTs precomputed with Alice
+            that can be stored, 0 to disable them (default 0)
+        inputs: Optional; the file of Bob's input vectors, or "-" for stdin,
+            for the circuits Alice evaluates on input vectors (default None)
+        input_format: Optional; the format of the input vectors, csv or
+            binary (default from the file name)
     """
-    def __init__(self, oblivious_transfer=True):
-        self.socket = util.EvaluatorSocket()
-        self.ot = ot.ObliviousTransfer(self.socket, oblivious_transfer)
+    def __init__(self, oblivious_transfer=True, ot_extension=False, ot_group=util.DEFAULT_GROUP,
+                 ot_backend=ot.PRIME_BACKEND, socket=None, random_ots=0, inputs=None,
+                 input_format=None):
+        self.inputs = vectors.VectorReader(inputs, input_format) if inputs is not None else None
+        self.socket = socket or util.EvaluatorSocket()
+        self.ot = ot.ObliviousTransfer(self.socket, oblivious_transfer, ot_extension, ot_group,
+                                       ot_backend, random_ots)
 
     def listen(self):
         """
@@ -133,28 +419,51 @@ class Bob:
         logging.info("Start listening")
         while True:
             try:
-                entry = self.socket.receive()
-                self.socket.send(True)
-                self.send_evaluation(entry)
+                self.run_session()
             except KeyboardInterrupt:
                 logging.info("Stop listening")
                 break
 
+    def run_session(self):
+        """
+        Evaluate the circuits of a garbler until it ends the session
+        :return:
+        """
+        while True:
+            entry = self.socket.receive()
+            if entry is not None and "random_ots" in entry:
+                self.ot.answer_precompute(entry)
+                continue
+            self.socket.send(True)
+            if entry is None:
+                break
+            self.send_evaluation(entry)
+        logging.info("Session ended")
+        self.ot.reset()
+
     def send_evaluation(self, entry):
         """
         Evaluate yao circuit for all Bob and Alice's inputs and send back the results
         :param entry: A dict representing the circuit to evaluate
         :return:
         """
-        circuit, p_bits_out = entry["circuit"], entry["p_bits_out"]
-        garbled_tables = entry["garbled_tables"]
+        circuit = entry["circuit"]
+        scheme = entry.get("scheme", yao.CLASSIC)
+        cipher = entry.get("cipher", yao.FERNET)
         a_wires = circuit.get("alice", [])  # list of Alice's wires
         b_wires = circuit.get("bob", [])  # list of Bob's wires
         input_count = len(a_wires) + len(b_wires)
+        plan = yao.compile_circuit(circuit)  # compiled once for all evaluations
 
         print(f"Received {circuit['id']}")
 
+        window = entry.get("window", ot.PIPELINE_DEPTH)
+        if entry.get("inputs"):
+            self.send_input_evaluations(circuit, plan, scheme, cipher, window)
+            return
+
         # Generate all possible inputs for both Alice and Bob
+        all_b_inputs = []
         for bits in [format(n, 'b').zfill(input_count) for n in range(2**input_count)]:
             bits_b = [int(b) for b in bits[input_count - len(b_wires):]]  # Bob's inputs
 
@@ -163,9 +472,50 @@ class Bob:
                 b_wires[i]: bits_b[i]
                 for i in range(len(b_wires))
             }
+            if entry.get("batch") or entry.get("pipelined"):
+                all_b_inputs.append(b_inputs_clear)
+                continue
 
             # Evaluate and send result to Alice
-            self.ot.send_result(circuit, garbled_tables, p_bits_out, b_inputs_clear)
-
-
-
+            if entry.get("stream"):
+                self.ot.send_streamed_result(plan, b_inputs_clear, scheme, cipher)
+            else:
+                self.ot.send_result(plan, entry["garbled_tables"], entry["p_bits_out"],
+                                    b_inputs_clear, scheme, cipher)
+
+        if entry.get("batch"):
+            # Evaluate all instances at once and send all results to Alice
+            self.ot.send_batch_result(circuit, all_b_inputs)
+        elif entry.get("pipelined"):
+            # Evaluate one instance per input combination, in the background
+            b_inputs = iter(all_b_inputs)
+            self.ot.send_vector_results(plan, lambda: next(b_inputs, None), scheme, cipher,
+                                        window)
+
+    def send_input_evaluations(self, circuit, plan, scheme, cipher, window=ot.PIPELINE_DEPTH):
+        """
+        Evaluate a circuit on Bob's input vectors of the circuit, one per
+        input vector of Alice, or one per input vector of Bob, whose count is
+        sent to Alice first, if the circuit has no inputs of Alice, and send
+        back the results
+        :param circuit: A dict containing circuit spec
+        :param plan: The CompiledCircuit of the circuit
+        :param scheme: The garbling scheme of the circuit
+        :param cipher: The label cipher of the circuit
+        :param window: Optional; the maximum number of instances evaluated at
+            once (default PIPELINE_DEPTH)
+        :return:
+        """
+        if self.inputs is None:
+            raise ValueError(f"Bob has no input vectors for circuit {circuit['id']}")
+        b_wires = circuit.get("bob", [])
+        b_inputs = iter(lambda: self.inputs.read(b_wires), None)
+        if not circuit.get("alice"):
+            all_b_inputs = list(b_inputs)
+            self.socket.receive()
+            self.socket.send(len(all_b_inputs))
+            b_inputs = iter(all_b_inputs)
+        count = self.ot.send_vector_results(plan, lambda: next(b_inputs, None), scheme, cipher,
+                                            window)
+        self.inputs.end_section()
+        logging.info(f"Evaluated {circuit['id']} on {count} input vectors")
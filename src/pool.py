@@ -0,0 +1,278 @@
+import logging
+import mmap
+import os
+import secrets
+import struct
+import threading
+
+from src import fusion, loader, optimizer, wire, yao
+
+# POOL FILES
+# An instance file holds the wire frames of one garbled instance, each
+# prefixed by its byte size, so that the tables are read from the memory map
+# without copy.
+MAGIC = b"YAOP"
+FILE_HEADER = struct.Struct("!4sI")  # magic, count of frames
+FRAME_SIZE = struct.Struct("!Q")
+READY_SUFFIX = ".gc"  # instances ready to be claimed
+CLAIMED_SUFFIX = ".claimed"  # instances claimed by a garbler, deleted once loaded
+
+POOL_LOW = 4  # number of ready instances under which a circuit is refilled
+POOL_HIGH = 16  # number of ready instances after a refill
+
+
+class PoolEmpty(LookupError):
+    """No garbled instance of a circuit is ready"""
+
+
+def write_instance(path, instance):
+    """
+    Write a garbled instance to a file, atomically
+    :param path: The path of the file
+    :param instance: A dict of encodable values
+    :return:
+    """
+    frames = wire.encode(instance)
+    tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(FILE_HEADER.pack(MAGIC, len(frames)))
+        for frame in frames:
+            f.write(FRAME_SIZE.pack(memoryview(frame).nbytes))
+            f.write(frame)
+    os.replace(tmp_path, path)
+
+
+def read_instance(path):
+    """
+    Map a garbled instance file in memory
+    :param path: The path of the file
+    :return: The decoded instance, whose buffers are views of the memory map
+    :raise wire.WireFormatError: if the file is not an instance file
+    """
+    with open(path, "rb") as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    if len(data) < FILE_HEADER.size:
+        raise wire.WireFormatError(f"Truncated instance file {path}")
+    magic, count = FILE_HEADER.unpack(data[:FILE_HEADER.size])
+    if magic != MAGIC:
+        raise wire.WireFormatError(f"{path} is not an instance file")
+    frames, offset = [], FILE_HEADER.size
+    for _ in range(count):
+        if offset + FRAME_SIZE.size > len(data):
+            raise wire.WireFormatError(f"Truncated instance file {path}")
+        (size,) = FRAME_SIZE.unpack(data[offset:offset + FRAME_SIZE.size])
+        offset += FRAME_SIZE.size
+        if offset + size > len(data):
+            raise wire.WireFormatError(f"Truncated instance file {path}")
+        frames.append(data[offset:offset + size])
+        offset += size
+    return wire.decode(frames)
+
+
+class GarbledPool:
+    """
+    A persistent pool of garbled instances of circuits, garbled offline.
+
+    Each circuit has a directory of instance files named after its hash,
+    scheme and cipher. An instance is claimed by renaming its file, which
+    succeeds for one garbler only, and its file is deleted once loaded: an
+    instance is never handed out twice, even to concurrent processes.
+
+    Args:
+        directory: The directory of the pool
+        scheme: Optional; the garbling scheme, classic or half-gates (default classic)
+        cipher: Optional; the label cipher of the classic scheme (default fernet)
+        low: Optional; the number of ready instances under which a circuit
+            is refilled (default POOL_LOW)
+        high: Optional; the number of ready instances after a refill (default POOL_HIGH)
+        workers: Optional; the number of processes garbling each instance (default None)
+    """
+
+    def __init__(self, directory, scheme=yao.CLASSIC, cipher=yao.FERNET, low=POOL_LOW,
+                 high=POOL_HIGH, workers=None):
+        if not 0 <= low <= high:
+            raise ValueError("Pool thresholds must satisfy 0 <= low <= high")
+        self.directory = directory
+        self.scheme = scheme
+        self.cipher = yao.FIXED_KEY if scheme == yao.HALF_GATES else cipher
+        self.low = low
+        self.high = high
+        self.workers = workers
+        self._refills = {}  # map from circuit directory to its refill thread
+
+    def _circuit_dir(self, circuit):
+        name = f"{yao.circuit_hash(circuit).hex()[:32]}-{self.scheme}-{self.cipher}"
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _ready(self, circuit_dir):
+        return sorted(name for name in os.listdir(circuit_dir) if name.endswith(READY_SUFFIX))
+
+    def size(self, circuit):
+        """
+        Return the number of ready instances of a circuit
+        :param circuit: A dict containing circuit spec
+        :return:
+        """
+        return len(self._ready(self._circuit_dir(circuit)))
+
+    def garble(self, circuit):
+        """
+        Garble an instance of a circuit and add it to the pool
+        :param circuit: A dict containing circuit spec
+        :return:
+        """
+        garbled_circuit = yao.GarbledCircuit(circuit, scheme=self.scheme, cipher=self.cipher,
+                                             workers=self.workers)
+        keys, p_bits = garbled_circuit.get_keys(), garbled_circuit.get_p_bits()
+        inputs = garbled_circuit.plan.inputs
+        instance = {
+            "scheme": self.scheme,
+            "cipher": self.cipher,
+            "inputs": inputs,
+            "key_size": len(keys[inputs[0]][0]) if inputs else 0,
+            # keys of bits 0 and 1 of each input wire, in the order of inputs
+            "keys": b"".join(key for w in inputs for key in keys[w]),
+            "p_bits": bytes(p_bits[w] for w in inputs),
+            "p_bits_out": {w: p_bits[w] for w in circuit["out"]},
+            "garbled_tables": yao.PackedTables.pack(garbled_circuit.get_garbled_tables()),
+        }
+        name = secrets.token_hex(16) + READY_SUFFIX
+        write_instance(os.path.join(self._circuit_dir(circuit), name), instance)
+
+    def fill(self, circuit, count=None):
+        """
+        Garble instances of a circuit until the pool holds high ready instances
+        :param circuit: A dict containing circuit spec
+        :param count: Optional; the number of instances to garble instead
+        :return: The number of garbled instances
+        """
+        if count is None:
+            count = max(0, self.high - self.size(circuit))
+        for _ in range(count):
+            self.garble(circuit)
+        logging.debug(f"Garbled {count} instances of {circuit['id']}")
+        return count
+
+    def refill(self, circuit, background=True):
+        """
+        Fill the pool of a circuit if it holds fewer than low ready instances
+        :param circuit: A dict containing circuit spec
+        :param background: Optional; garble in a background thread (default true)
+        :return:
+        """
+        if self.size(circuit) >= self.low:
+            return
+        if not background:
+            self.fill(circuit)
+            return
+        circuit_dir = self._circuit_dir(circuit)
+        thread = self._refills.get(circuit_dir)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=self.fill, args=(circuit,), daemon=True)
+            self._refills[circuit_dir] = thread
+            thread.start()
+
+    def join(self):
+        """
+        Wait for the background refills to finish
+        :return:
+        """
+        for thread in list(self._refills.values()):
+            thread.join()
+
+    def pop(self, circuit):
+        """
+        Claim a ready instance of a circuit, then refill the pool if needed
+        :param circuit: A dict containing circuit spec
+        :return: An entry of the circuit as created by YaoGarbler
+        :raise PoolEmpty: if no instance is ready
+        """
+        circuit_dir = self._circuit_dir(circuit)
+        for name in self._ready(circuit_dir):
+            path = os.path.join(circuit_dir, name)
+            claimed_path = path[:-len(READY_SUFFIX)] + CLAIMED_SUFFIX
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                continue  # claimed by another garbler
+            try:
+                instance = read_instance(claimed_path)
+            finally:
+                os.remove(claimed_path)
+            self.refill(circuit)
+            return self._entry(circuit, instance)
+
+        self.refill(circuit)
+        raise PoolEmpty(f"No garbled instance of {circuit['id']} in {circuit_dir}")
+
+    @staticmethod
+    def _entry(circuit, instance):
+        inputs, key_size, keys = instance["inputs"], instance["key_size"], instance["keys"]
+        if len(keys) != 2 * key_size * len(inputs) or len(instance["p_bits"]) != len(inputs):
+            raise wire.WireFormatError("Inconsistent instance keys")
+        return {
+            "circuit": circuit,
+            "scheme": instance["scheme"],
+            "cipher": instance["cipher"],
+            "garbled_tables": instance["garbled_tables"],
+            "keys": {
+                w: (bytes(keys[2 * i * key_size:(2 * i + 1) * key_size]),
+                    bytes(keys[(2 * i + 1) * key_size:(2 * i + 2) * key_size]))
+                for i, w in enumerate(inputs)
+            },
+            "p_bits": dict(zip(inputs, instance["p_bits"])),
+            "p_bits_out": instance["p_bits_out"],
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Garble circuits offline into a pool.")
+    parser.add_argument("directory", help="the directory of the pool")
+    parser.add_argument("-c",
+                        "--circuit",
+                        metavar="circuit.json",
+                        default="circuits/default.json",
+                        help="the circuit file to garble: JSON, Bristol Fashion or binary")
+    parser.add_argument("-n",
+                        "--count",
+                        type=int,
+                        help=f"the number of instances to add to each circuit "
+                             f"(default up to {POOL_HIGH} ready instances)")
+    parser.add_argument("-s",
+                        "--scheme",
+                        choices=yao.SCHEMES,
+                        default=yao.CLASSIC,
+                        help="the garbling scheme (default 'classic')")
+    parser.add_argument("--cipher",
+                        choices=list(yao.CIPHERS),
+                        default=yao.FERNET,
+                        help="the label cipher of the classic scheme (default 'fernet')")
+    parser.add_argument("-w",
+                        "--workers",
+                        type=int,
+                        help="the number of processes garbling each instance")
+    parser.add_argument("-O",
+                        "--optimize",
+                        action="store_true",
+                        help="optimize the circuits first, as garblers run with --optimize")
+    parser.add_argument("--fuse",
+                        type=int,
+                        default=0,
+                        metavar="k",
+                        help="fuse the circuits into LUT gates of up to k inputs, as garblers "
+                             "run with --fuse")
+    args = parser.parse_args()
+
+    pool = GarbledPool(args.directory, args.scheme, args.cipher, workers=args.workers)
+    circuits = loader.load_circuits(args.circuit)["circuits"]
+    if args.optimize:
+        circuits = optimizer.optimize_all(circuits)
+    if args.fuse:
+        circuits = fusion.fuse_all(circuits, args.fuse)
+    for circuit in circuits:
+        pool.fill(circuit, args.count)
+        print(f"{circuit['id']}: {pool.size(circuit)} ready instances")
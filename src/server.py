@@ -0,0 +1,227 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import zmq
+
+from src import metrics, ot, player, util, wire
+
+SESSION_WORKERS = 8  # number of sessions evaluated at the same time
+SESSION_TIMEOUT = 60  # seconds of silence after which a session is dropped
+POLL_INTERVAL = 100  # milliseconds between checks of the stop event
+LATENCY_WINDOW = 10000  # number of latest sessions of the latency statistics
+
+_server_ids = itertools.count()
+
+
+class SessionSocket:
+    """
+    The socket of one session of an EvaluatorServer.
+
+    Messages of the garbler are put in the inbox of the session by the
+    routing thread; replies are pushed back to the routing thread, the only
+    user of the ROUTER socket, over an inproc socket of the session.
+
+    Args:
+        session_id: The ROUTER identity of the garbler
+        context: The zmq.Context of the server
+        outbox: The inproc endpoint of the routing thread
+    """
+
+    def __init__(self, session_id, context, outbox):
+        self.session_id = session_id
+        self.inbox = queue.Queue()
+        self.socket = context.socket(zmq.PUSH)
+        self.socket.connect(outbox)
+
+    def send(self, msg):
+        frames = wire.encode(msg)
+        with metrics.timer("send"):
+            self.socket.send_multipart([self.session_id, b""] + frames, copy=False)
+        metrics.count("messages_sent")
+        metrics.count("bytes_sent", sum(memoryview(frame).nbytes for frame in frames))
+
+    def receive(self):
+        try:
+            with metrics.timer("recv"):
+                frames = self.inbox.get(timeout=SESSION_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f"Session {self.session_id.hex()} timed out") from None
+        metrics.count("messages_received")
+        metrics.count("bytes_received", sum(frame.nbytes for frame in frames))
+        return wire.decode(frames)
+
+    def send_wait(self, msg):
+        self.send(msg)
+        return self.receive()
+
+    def close(self):
+        self.socket.close(linger=1000)
+
+
+class Session:
+    """
+    The state of the session of one garbler: its socket, its Bob and its OT state.
+
+    Args:
+        session_id: The ROUTER identity of the garbler
+        socket: The SessionSocket of the session
+        bob_options: The keyword arguments of the Bob of the session
+    """
+
+    def __init__(self, session_id, socket, bob_options):
+        self.id = session_id
+        self.socket = socket
+        self.bob = player.Bob(socket=socket, **bob_options)
+        self.start = time.perf_counter()
+
+
+class EvaluatorServer:
+    """
+    An evaluator running the sessions of many garblers at the same time.
+
+    Garblers connect with their usual REQ socket to a ROUTER socket, which
+    tells their sessions apart by identity. Each session gets its own Bob and
+    OT state and runs on a pool of worker threads; further sessions wait for
+    a free worker.
+
+    Args:
+        endpoint: Optional; the endpoint to bind (default all interfaces, LOCAL_PORT)
+        workers: Optional; the number of sessions run at the same time
+            (default SESSION_WORKERS)
+        oblivious_transfer: Optional; enable the Oblivious Transfer protocol (default true)
+        ot_extension: Optional; derive Bob's OTs from base OTs (default false)
+        ot_group: Optional; the named group of the OTs, None for a random one (default modp2048)
+        ot_backend: Optional; the public-key OT, prime or ec (default prime)
+        random_ots: Optional; the number of random OTs precomputed with each
+            garbler that can be stored, 0 to disable them (default 0)
+        context: Optional; the zmq.Context of the server (default the context
+            of the process for inproc endpoints, a new one otherwise)
+    """
+
+    def __init__(self, endpoint=util.EVALUATOR_ENDPOINT, workers=SESSION_WORKERS,
+                 oblivious_transfer=True, ot_extension=False, ot_group=util.DEFAULT_GROUP,
+                 ot_backend=ot.PRIME_BACKEND, random_ots=0, context=None):
+        self.bob_options = {
+            "oblivious_transfer": oblivious_transfer,
+            "ot_extension": ot_extension,
+            "ot_group": ot_group,
+            "ot_backend": ot_backend,
+            "random_ots": random_ots,
+        }
+        self.own_context = context is None and not endpoint.startswith(f"{util.INPROC}://")
+        self.context = context or util.endpoint_context(endpoint)
+        self.router = self.context.socket(zmq.ROUTER)
+        self.router.bind(endpoint)
+        self.outbox_endpoint = f"inproc://yao-server-{next(_server_ids)}"
+        self.outbox = self.context.socket(zmq.PULL)
+        self.outbox.bind(self.outbox_endpoint)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="session")
+
+        self.lock = threading.Lock()
+        self.sessions = {}  # map from session id to running Session
+        # seconds from first message to end of the latest finished sessions
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.finished = 0  # number of finished sessions
+        self.failures = 0  # number of sessions ended by an error
+        self.started = None
+
+    def serve(self, stop=None):
+        """
+        Route messages between garblers and sessions
+        :param stop: Optional; a threading.Event ending the routing loop
+        :return:
+        """
+        logging.info("Start serving")
+        self.started = time.perf_counter()
+        poller = zmq.Poller()
+        poller.register(self.router, zmq.POLLIN)
+        poller.register(self.outbox, zmq.POLLIN)
+        try:
+            while stop is None or not stop.is_set():
+                events = dict(poller.poll(POLL_INTERVAL))
+                if self.outbox in events:
+                    self.router.send_multipart(self.outbox.recv_multipart(copy=False), copy=False)
+                if self.router in events:
+                    self._dispatch(self.router.recv_multipart(copy=False))
+        except KeyboardInterrupt:
+            logging.info("Stop serving")
+
+    def _dispatch(self, frames):
+        """
+        Put a message of a garbler in the inbox of its session, starting the session if new
+        :param frames: The frames of the message: identity, delimiter and wire frames
+        :return:
+        """
+        session_id = frames[0].bytes
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                socket = SessionSocket(session_id, self.context, self.outbox_endpoint)
+                session = Session(session_id, socket, self.bob_options)
+                self.sessions[session_id] = session
+                self.pool.submit(self._run, session)
+        session.socket.inbox.put([frame.buffer for frame in frames[2:]])
+
+    def _run(self, session):
+        """
+        Run a session in a worker thread until the garbler ends it
+        :param session: The Session
+        :return:
+        """
+        failed = False
+        try:
+            session.bob.run_session()
+        except Exception:
+            logging.exception(f"Session {session.id.hex()} failed")
+            failed = True
+        finally:
+            session.socket.close()
+            with self.lock:
+                del self.sessions[session.id]
+                self.latencies.append(time.perf_counter() - session.start)
+                self.finished += 1
+                self.failures += failed
+
+    def stats(self):
+        """
+        Return the throughput of the finished sessions and the latency of the
+        latest LATENCY_WINDOW ones
+        :return: A dict of statistics
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            finished, failures = self.finished, self.failures
+        seconds = time.perf_counter() - self.started if self.started else 0
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            "sessions": finished,
+            "failures": failures,
+            "seconds": seconds,
+            "sessions_per_sec": finished / seconds if seconds else 0,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_p99": percentile(0.99),
+            "latency_max": latencies[-1] if latencies else None,
+            "metrics": metrics.snapshot(),
+        }
+
+    def close(self):
+        """
+        Wait for the running sessions and close the sockets
+        :return:
+        """
+        self.pool.shutdown()
+        self.outbox.close()
+        self.router.close()
+        if self.own_context:
+            self.context.term()
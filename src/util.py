@@ -1,26 +1,91 @@
+import itertools
 import json
 import operator
-import random
 import secrets
+import tempfile
 
 import sympy
 import zmq.sugar.socket
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat
+
+from src import metrics, wire
 
 # SOCKET
 LOCAL_PORT = 4080
 SERVER_HOST = "localhost"
 SERVER_PORT = 4080
+EVALUATOR_ENDPOINT = f"tcp://*:{LOCAL_PORT}"
+GARBLER_ENDPOINT = f"tcp://{SERVER_HOST}:{SERVER_PORT}"
+
+# TRANSPORTS
+# Sockets of inproc endpoints share the context of the process, so that
+# parties of one process connect without network: messages are sent without
+# copy (copy=False) and the frames of the garbled tables are handed over by
+# reference. Parties of one host connect over ipc endpoints, Unix domain
+# sockets skipping TCP. Sockets of other endpoints keep a context of their
+# own, whose endpoints are released as soon as they are closed. The name of
+# an inproc endpoint is only released once the shared context has processed
+# the close of its socket, so each local inproc endpoint gets a new name.
+TCP = "tcp"
+IPC = "ipc"
+INPROC = "inproc"
+TRANSPORTS = (TCP, IPC, INPROC)
+_inproc_ids = itertools.count()  # suffixes of the names of local inproc endpoints
+
+
+def local_endpoint(transport=TCP, port=LOCAL_PORT):
+    """
+    Return the endpoint of an evaluator on this host
+    :param transport: Optional; the transport, tcp, ipc or inproc (default tcp)
+    :param port: Optional; the TCP port, which also names the ipc and inproc
+        endpoints (default LOCAL_PORT)
+    :return: The endpoint, for both the evaluator and the garbler, a new one
+        for each call with inproc
+    """
+    if transport == TCP:
+        return f"tcp://127.0.0.1:{port}"
+    if transport == IPC:
+        return f"ipc://{tempfile.gettempdir()}/yao-{port}.ipc"
+    if transport == INPROC:
+        return f"inproc://yao-{port}-{next(_inproc_ids)}"
+    raise ValueError(f"Unknown transport '{transport}'")
+
+
+def endpoint_context(endpoint):
+    """
+    Return the zmq.Context of a new socket of an endpoint
+    :param endpoint: The endpoint
+    :return: The context of the process for inproc endpoints, a new one otherwise
+    """
+    if endpoint.startswith(f"{INPROC}://"):
+        return zmq.Context.instance()
+    return zmq.Context()
 
 
 class Socket:
-    def __init__(self, socket_type):
-        self.socket = zmq.Context().socket(socket_type)
+    def __init__(self, socket_type, context=None):
+        self.socket = (context or zmq.Context()).socket(socket_type)
+        self.bytes_sent = 0  # bytes of the frames of the sent messages
+        self.bytes_received = 0  # bytes of the frames of the received messages
 
     def send(self, msg):
-        self.socket.send_pyobj(msg)
+        frames = wire.encode(msg)
+        size = sum(memoryview(frame).nbytes for frame in frames)
+        self.bytes_sent += size
+        with metrics.timer("send"):
+            self.socket.send_multipart(frames, copy=False)
+        metrics.count("messages_sent")
+        metrics.count("bytes_sent", size)
 
     def receive(self):
-        return self.socket.recv_pyobj()
+        with metrics.timer("recv"):
+            frames = [frame.buffer for frame in self.socket.recv_multipart(copy=False)]
+        size = sum(frame.nbytes for frame in frames)
+        self.bytes_received += size
+        metrics.count("messages_received")
+        metrics.count("bytes_received", size)
+        return wire.decode(frames)
 
     def send_wait(self, msg):
         self.send(msg)
@@ -28,19 +93,52 @@ class Socket:
 
 
 class EvaluatorSocket(Socket):
-    def __init__(self, endpoint=f"tcp://*:{LOCAL_PORT}"):
-        super(EvaluatorSocket, self).__init__(zmq.REP)
+    def __init__(self, endpoint=EVALUATOR_ENDPOINT, context=None):
+        super(EvaluatorSocket, self).__init__(zmq.REP, context or endpoint_context(endpoint))
         self.socket.bind(endpoint)
 
 
 class GarblerSocket(Socket):
-    def __init__(self, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}"):
-        super(GarblerSocket, self).__init__(zmq.REQ)
+    def __init__(self, endpoint=GARBLER_ENDPOINT, context=None):
+        super(GarblerSocket, self).__init__(zmq.REQ, context or endpoint_context(endpoint))
         self.socket.connect(endpoint)
 
 
 # PRIME GROUP
 PRIME_BITS = 64
+EXPONENT_BITS = 256  # short exponents of the named groups (RFC 7919, section 5.2)
+FIXED_BASE_WINDOW = 6  # bit width of the windows of fixed-base exponentiation
+
+# Vetted safe primes p = 2q + 1 of RFC 2409 and RFC 3526, with generator 2 of
+# the subgroup of prime order q
+NAMED_GROUPS = {
+    "modp768": int(
+        "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+        "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+        "4FE1356D6D51C245E485B576625E7EC6F44C42E9A63A3620FFFFFFFFFFFFFFFF", 16),
+    "modp1024": int(
+        "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+        "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+        "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+        "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE65381FFFFFFFFFFFFFFFF", 16),
+    "modp1536": int(
+        "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+        "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+        "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+        "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+        "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+        "9ED529077096966D670C354E4ABC9804F1746C08CA237327FFFFFFFFFFFFFFFF", 16),
+    "modp2048": int(
+        "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74"
+        "020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437"
+        "4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+        "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05"
+        "98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB"
+        "9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+        "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718"
+        "3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF", 16),
+}
+DEFAULT_GROUP = "modp2048"
 
 
 def next_prime(num):
@@ -67,13 +165,55 @@ def xor_bytes(seq1, seq2):
 class PrimeGroup:
     """
     Cyclic Abelian group of prime order 'prime'
+
+    Args:
+        prime: Optional; the prime modulus (default a random PRIME_BITS prime)
+        generator: Optional; the generator (default a random generator)
+        order: Optional; the order of the generator when it generates a
+            subgroup, in which case exponents are EXPONENT_BITS long
     """
 
-    def __init__(self, prime=None):
+    def __init__(self, prime=None, generator=None, order=None):
         self.prime = prime or gen_prime(PRIME_BITS)
         self.prime_m1 = self.prime - 1
         self.prime_m2 = self.prime - 2
-        self.generator = self.find_generator()
+        self.order = order
+        self.name = None
+        self.generator = generator or self.find_generator()
+        self.gen_table = None  # fixed-base table of the generator
+
+    @classmethod
+    def named(cls, name):
+        """
+        Create the group of a safe prime of NAMED_GROUPS
+        :param name: The name of the group
+        :return: The subgroup of prime order generated by 2
+        """
+        if name not in NAMED_GROUPS:
+            raise ValueError(f"Unknown group '{name}'")
+        prime = NAMED_GROUPS[name]
+        group = cls(prime, 2, (prime - 1) // 2)
+        group.name = name
+        return group
+
+    def precompute(self, window=FIXED_BASE_WINDOW):
+        """
+        Precompute the fixed-base table of the generator, so that gen_pow
+        takes one multiplication per window of the exponent
+        :param window: The bit width of the windows
+        :return: The group
+        """
+        exponent_bits = EXPONENT_BITS if self.order else self.prime_m1.bit_length()
+        base = self.generator
+        self.gen_table = []
+        for _ in range((exponent_bits + window - 1) // window):
+            row = [1]
+            for _ in range((1 << window) - 1):
+                row.append(self.mul(row[-1], base))
+            self.gen_table.append(row)
+            base = self.mul(row[-1], base)  # base ** (2 ** window)
+        self.window = window
+        return self
 
     def mul(self, num1, num2):
         """
@@ -91,19 +231,31 @@ class PrimeGroup:
         """
         Compute nth power of a generator
         """
-        return pow(self.generator, exponent, self.prime)
+        table = self.gen_table
+        if table is None or exponent.bit_length() > len(table) * self.window:
+            return pow(self.generator, exponent, self.prime)
+
+        result, mask = 1, (1 << self.window) - 1
+        for row in table:
+            if exponent & mask:
+                result = result * row[exponent & mask] % self.prime
+            exponent >>= self.window
+        return result
 
     def rand_int(self):
         """
-        :return: random int in [1, prime -1]
+        :return: random exponent in [1, prime -1], or a random non-zero
+            EXPONENT_BITS exponent in a subgroup of prime order
         """
-        return random.randint(1, self.prime_m1)
+        if self.order:
+            return secrets.randbits(EXPONENT_BITS) or 1
+        return secrets.randbelow(self.prime_m1) + 1
 
     def inv(self, num):
         """
         Multiplicative inverse of an element
         """
-        return pow(num, self.prime_m2, self.prime)
+        return pow(num, -1, self.prime)
 
     def find_generator(self):
         """
@@ -122,6 +274,181 @@ class PrimeGroup:
                     return candidate
 
 
+def _group_from_state(state):
+    prime, generator, order, name = state
+    if not all(isinstance(n, int) and n > 0 for n in (prime, generator)):
+        raise ValueError("Invalid group parameters")
+    if name is not None:
+        return get_group(name)
+    return PrimeGroup(prime, generator, order)
+
+
+wire.register(PrimeGroup, "group",
+              lambda g: (g.prime, g.generator, g.order, g.name),
+              _group_from_state)
+
+_groups = {}  # shared groups with their fixed-base tables
+
+
+def get_group(name):
+    """
+    Return the shared instance of a named group, with its fixed-base table
+    :param name: The name of the group in NAMED_GROUPS
+    :return: A PrimeGroup
+    """
+    if name not in _groups:
+        _groups[name] = PrimeGroup.named(name).precompute()
+    return _groups[name]
+
+
+# CURVE25519
+ED25519_P = 2 ** 255 - 19
+ED25519_D = -121665 * pow(121666, -1, ED25519_P) % ED25519_P
+ED25519_D2 = 2 * ED25519_D % ED25519_P
+ED25519_SQRT_M1 = pow(2, (ED25519_P - 1) // 4, ED25519_P)
+ED25519_BASE_Y = 4 * pow(5, -1, ED25519_P) % ED25519_P
+CURVE_WINDOW = 4  # bit width of the windows of fixed-base multiplication
+
+
+class Curve25519:
+    """
+    Group of the points of Edwards25519, for the simplest OT of Chou and Orlandi.
+
+    Points are kept in extended coordinates (X, Y, Z, T) and encoded as in
+    RFC 8032. Scalars are X25519 private keys: variable-base multiplications
+    go through X25519 of the cryptography package, which returns the
+    Montgomery u-coordinate of the product, while the few additions and
+    fixed-base multiplications the protocol needs are done here.
+    """
+
+    IDENTITY = (0, 1, 1, 0)
+
+    def __init__(self):
+        base_x = self._recover_x(ED25519_BASE_Y, 0)
+        self.base = (base_x, ED25519_BASE_Y, 1, base_x * ED25519_BASE_Y % ED25519_P)
+        self.base_table = None  # fixed-base table of the base point
+
+    @staticmethod
+    def rand_scalar():
+        """
+        :return: a random X25519 private key as 32 bytes
+        """
+        return X25519PrivateKey.generate().private_bytes(
+            Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+
+    @staticmethod
+    def clamp(scalar):
+        """
+        The scalar X25519 actually multiplies by for a private key
+        """
+        num = int.from_bytes(scalar, "little")
+        return (num & ((1 << 254) - 8)) | (1 << 254)
+
+    @staticmethod
+    def add(point1, point2):
+        """
+        Add two points (RFC 8032, section 5.1.4)
+        """
+        p = ED25519_P
+        x1, y1, z1, t1 = point1
+        x2, y2, z2, t2 = point2
+        a = (y1 - x1) * (y2 - x2) % p
+        b = (y1 + x1) * (y2 + x2) % p
+        c = t1 * ED25519_D2 * t2 % p
+        d = 2 * z1 * z2 % p
+        e, f, g, h = b - a, d - c, d + c, b + a
+        return e * f % p, g * h % p, f * g % p, e * h % p
+
+    @staticmethod
+    def neg(point):
+        """
+        Opposite of a point
+        """
+        x, y, z, t = point
+        return -x % ED25519_P, y, z, -t % ED25519_P
+
+    def base_mul(self, scalar):
+        """
+        Multiply the base point by an X25519 private key
+        """
+        if self.base_table is None:
+            self.base_table = []
+            base = self.base
+            for _ in range((255 + CURVE_WINDOW - 1) // CURVE_WINDOW):
+                row = [self.IDENTITY]
+                for _ in range((1 << CURVE_WINDOW) - 1):
+                    row.append(self.add(row[-1], base))
+                self.base_table.append(row)
+                base = self.add(row[-1], base)
+
+        num, mask = self.clamp(scalar), (1 << CURVE_WINDOW) - 1
+        result = self.IDENTITY
+        for row in self.base_table:
+            if num & mask:
+                result = self.add(result, row[num & mask])
+            num >>= CURVE_WINDOW
+        return result
+
+    @staticmethod
+    def dh(scalar, point):
+        """
+        Multiply a point by an X25519 private key
+        :return: The u-coordinate of the product as 32 bytes
+        """
+        x, y, z, t = point
+        u = (z + y) * pow(z - y, -1, ED25519_P) % ED25519_P
+        public_key = X25519PublicKey.from_public_bytes(u.to_bytes(32, "little"))
+        return X25519PrivateKey.from_private_bytes(scalar).exchange(public_key)
+
+    @staticmethod
+    def encode(point):
+        """
+        Encode a point as 32 bytes
+        """
+        x, y, z, t = point
+        z_inv = pow(z, -1, ED25519_P)
+        x, y = x * z_inv % ED25519_P, y * z_inv % ED25519_P
+        return (y | ((x & 1) << 255)).to_bytes(32, "little")
+
+    def decode(self, data):
+        """
+        Decode a point of 32 bytes
+        :raise ValueError: if the data is not a point of the curve
+        """
+        num = int.from_bytes(data, "little")
+        y, sign = num & ((1 << 255) - 1), num >> 255
+        if len(data) != 32 or y >= ED25519_P:
+            raise ValueError("Invalid point encoding")
+        x = self._recover_x(y, sign)
+        return x, y, 1, x * y % ED25519_P
+
+    @staticmethod
+    def _recover_x(y, sign):
+        p = ED25519_P
+        x2 = (y * y - 1) * pow(ED25519_D * y * y + 1, -1, p) % p
+        if x2 == 0:
+            if sign:
+                raise ValueError("Invalid point encoding")
+            return 0
+        x = pow(x2, (p + 3) // 8, p)
+        if (x * x - x2) % p:
+            x = x * ED25519_SQRT_M1 % p
+        if (x * x - x2) % p:
+            raise ValueError("Invalid point encoding")
+        if (x & 1) != sign:
+            x = p - x
+        return x
+
+
+def get_curve():
+    """
+    Return the shared instance of Curve25519, with its fixed-base table
+    """
+    if "curve25519" not in _groups:
+        _groups["curve25519"] = Curve25519()
+    return _groups["curve25519"]
+
+
 def parse_json(json_path):
     with open(json_path) as json_file:
         return json.load(json_file)
@@ -129,3 +456,17 @@ def parse_json(json_path):
 
 def get_encr_bits(p_bit, key0, key1):
     return (key0, 0 ^ p_bit), (key1, 1 ^ p_bit)
+
+
+def pack_input(key, encr_bit):
+    """
+    Serialize a (key, encr_bit) input as the key followed by one byte
+    """
+    return bytes(key) + bytes((encr_bit,))
+
+
+def unpack_input(data):
+    """
+    Deserialize a (key, encr_bit) input of pack_input
+    """
+    return bytes(data[:-1]), data[-1]
@@ -0,0 +1,124 @@
+import struct
+import sys
+
+# Files of input vectors, one vector per evaluation. CSV: one vector per
+# line, its bits separated by commas or spaces, or written together ("0,1,1"
+# or "011"), the vectors of successive circuits separated by an empty line.
+# Binary: the vectors of each circuit after a header of their count and of
+# their number of bits, each vector packed in ceil(bits / 8) bytes, least
+# significant bit first. A party without input wires in a circuit reads no
+# vector for it, its section of a CSV file is empty, and the circuit is
+# evaluated once per vector of the other party.
+CSV = "csv"
+BINARY = "binary"
+FORMATS = (CSV, BINARY)
+BINARY_SUFFIX = ".bin"
+STDIN = "-"
+SECTION_HEADER = struct.Struct("<II")  # count of vectors, bits per vector
+
+
+class VectorReader:
+    """
+    A reader of the input vectors of a party, circuit after circuit.
+
+    Args:
+        path: The file of input vectors, or "-" for stdin
+        input_format: Optional; the format of the file, csv or binary
+            (default binary if the path ends with .bin, csv otherwise)
+    """
+
+    def __init__(self, path, input_format=None):
+        if input_format is None:
+            input_format = BINARY if path.endswith(BINARY_SUFFIX) else CSV
+        if input_format not in FORMATS:
+            raise ValueError(f"Unknown input format '{input_format}'")
+        self.path = path
+        self.format = input_format
+        self.file = sys.stdin.buffer if path == STDIN else open(path, "rb")
+        self.section_ended = False  # whether the vectors of the current circuit were all read
+        self.remaining = None  # vectors left in the current circuit of a binary file, and bits
+        self.bits = None
+
+    def read(self, wires):
+        """
+        Read the next vector of the current circuit
+        :param wires: The input wires of the party
+        :return: A dict mapping each wire to its bit, or None after the last
+            vector of the circuit
+        """
+        if self.section_ended:
+            return None
+        if not wires:
+            return {}
+        bits = self._read_binary(len(wires)) if self.format == BINARY else self._read_csv(
+            len(wires))
+        if bits is None:
+            self.section_ended = True
+            return None
+        return dict(zip(wires, bits))
+
+    def _read_header(self):
+        header = self.file.read(SECTION_HEADER.size)
+        if len(header) < SECTION_HEADER.size:
+            raise ValueError(f"Missing circuit header in {self.path}")
+        self.remaining, self.bits = SECTION_HEADER.unpack(header)
+
+    def _read_binary(self, count):
+        if self.remaining is None:
+            self._read_header()
+        if self.bits != count:
+            raise ValueError(f"Expected vectors of {count} bits in {self.path}, "
+                             f"got {self.bits}")
+        if not self.remaining:
+            return None
+        size = (count + 7) // 8
+        data = self.file.read(size)
+        if len(data) < size:
+            raise ValueError(f"Truncated input vector in {self.path}")
+        self.remaining -= 1
+        value = int.from_bytes(data, "little")
+        return [(value >> j) & 1 for j in range(count)]
+
+    def _read_csv(self, count):
+        line = self.file.readline()
+        if not line.strip():
+            return None
+        tokens = line.replace(b",", b" ").split()
+        if len(tokens) == 1 and count > 1:
+            tokens = [tokens[0][j:j + 1] for j in range(len(tokens[0]))]
+        if len(tokens) != count or any(token not in (b"0", b"1") for token in tokens):
+            raise ValueError(f"Expected {count} bits in {self.path}, got {line!r}")
+        return [int(token) for token in tokens]
+
+    def end_section(self):
+        """
+        Skip the unread vectors of the current circuit, before reading the
+        vectors of the next one
+        :return:
+        """
+        if self.format == CSV and not self.section_ended:
+            while self.file.readline().strip():
+                pass
+        elif self.format == BINARY:
+            if self.remaining is None:
+                self._read_header()
+            self.file.read(self.remaining * ((self.bits + 7) // 8))
+            self.remaining = None
+        self.section_ended = False
+
+    def close(self):
+        """
+        Close the file, unless it is stdin
+        :return:
+        """
+        if self.path != STDIN:
+            self.file.close()
+
+
+def format_bits(bits):
+    """
+    Format a vector of bits as a line of CSV
+    :param bits: The bits
+    :return: The line, without newline
+    """
+    return ",".join(str(bit) for bit in bits)
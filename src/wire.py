@@ -0,0 +1,124 @@
+import base64
+import json
+import struct
+
+from src import metrics
+
+# WIRE FORMAT
+# A message is a list of frames: a header, a JSON document describing the
+# message, then the large buffers the document refers to by index. Nothing
+# is unpickled: decoding only rebuilds JSON values, tuples, dicts, bytes and
+# the types registered with `register`.
+MAGIC = b"YAO"
+VERSION = 1
+HEADER = struct.Struct("!3sBI")  # magic, version, count of buffer frames
+FRAME_THRESHOLD = 1024  # byte size from which a buffer gets its own frame
+
+_encoders = {}  # map from registered class to (tag, to_state)
+_decoders = {}  # map from tag to from_state
+
+
+class WireFormatError(ValueError):
+    """A received message does not follow the wire format"""
+
+
+def register(cls, tag, to_state, from_state):
+    """
+    Register a class to send over the wire
+    :param cls: The class
+    :param tag: A name unique to the class
+    :param to_state: A function returning the state of an instance, made of
+        encodable values
+    :param from_state: A function creating an instance from its decoded state,
+        raising ValueError or TypeError on invalid states
+    :return:
+    """
+    _encoders[cls] = (tag, to_state)
+    _decoders[tag] = from_state
+
+
+def encode(msg):
+    """
+    Encode a message
+    :param msg: The message
+    :return: The list of frames of the message
+    """
+    with metrics.timer("serialize"):
+        return _encode(msg)
+
+
+def _encode(msg):
+    buffers = []
+
+    def encode_obj(obj):
+        if obj is None or isinstance(obj, (bool, int, float, str)):
+            return obj
+        if isinstance(obj, list):
+            return [encode_obj(item) for item in obj]
+        if isinstance(obj, tuple):
+            return {"t": [encode_obj(item) for item in obj]}
+        if isinstance(obj, dict):
+            if all(isinstance(k, str) for k in obj):
+                return {"m": {k: encode_obj(v) for k, v in obj.items()}}
+            return {"d": [[encode_obj(k), encode_obj(v)] for k, v in obj.items()]}
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            if memoryview(obj).nbytes < FRAME_THRESHOLD:
+                return {"s": base64.b64encode(obj).decode("ascii")}
+            buffers.append(obj)
+            return {"f": len(buffers) - 1}
+        if type(obj) in _encoders:
+            tag, to_state = _encoders[type(obj)]
+            return {"x": tag, "v": encode_obj(to_state(obj))}
+        raise TypeError(f"Cannot send objects of type {type(obj).__name__}")
+
+    document = json.dumps(encode_obj(msg), separators=(",", ":")).encode()
+    return [HEADER.pack(MAGIC, VERSION, len(buffers)), document] + buffers
+
+
+def decode(frames):
+    """
+    Decode a message
+    :param frames: The list of frames of the message, as bytes-like objects.
+        Buffer frames are returned as memoryviews without copy.
+    :return: The message
+    :raise WireFormatError: if the frames are not a valid message
+    """
+    with metrics.timer("deserialize"):
+        return _decode(frames)
+
+
+def _decode(frames):
+    if len(frames) < 2 or memoryview(frames[0]).nbytes != HEADER.size:
+        raise WireFormatError("Missing message header")
+    magic, version, buffer_count = HEADER.unpack(frames[0])
+    if magic != MAGIC or version != VERSION:
+        raise WireFormatError(f"Unsupported message format {magic!r} version {version}")
+    if buffer_count != len(frames) - 2:
+        raise WireFormatError(f"Expected {buffer_count} buffer frames, got {len(frames) - 2}")
+    buffers = [memoryview(frame) for frame in frames[2:]]
+
+    def decode_obj(obj):
+        if isinstance(obj, list):
+            return [decode_obj(item) for item in obj]
+        if not isinstance(obj, dict):
+            return obj
+        if "t" in obj:
+            return tuple(decode_obj(item) for item in obj["t"])
+        if "m" in obj:
+            return {k: decode_obj(v) for k, v in obj["m"].items()}
+        if "d" in obj:
+            return {decode_obj(k): decode_obj(v) for k, v in obj["d"]}
+        if "s" in obj:
+            return base64.b64decode(obj["s"], validate=True)
+        if "f" in obj:
+            return buffers[obj["f"]]
+        if "x" in obj:
+            return _decoders[obj["x"]](decode_obj(obj["v"]))
+        raise WireFormatError(f"Unknown node {list(obj)}")
+
+    try:
+        return decode_obj(json.loads(bytes(frames[1])))
+    except WireFormatError:
+        raise
+    except (ValueError, TypeError, KeyError, IndexError) as e:
+        raise WireFormatError(f"Invalid message: {e}") from e
@@ -1,6 +1,100 @@
-import pickle
-import random
-from cryptography.fernet import Fernet
+import base64
+import hashlib
+import heapq
+import itertools
+import json
+import secrets
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from src import metrics, util, wire
+
+# Garbling schemes
+CLASSIC = "classic"  # 4-row tables for every gate
+HALF_GATES = "half-gates"  # free-XOR with two-row half-gates
+SCHEMES = (CLASSIC, HALF_GATES)
+
+LABEL_SIZE = 16  # byte size of a fixed-key wire label
+LABEL_BITS = 8 * LABEL_SIZE
+LABEL_MASK = (1 << LABEL_BITS) - 1
+
+CHUNK_SIZE = 1024  # number of gates per chunk of a streamed circuit
+
+# SEEDED LABELS
+# The p-bits and keys of a garbled circuit are derived from a secret seed,
+# expanded with AES-128 in counter mode. Classic: bit i of the stream, least
+# significant bit first, is the p-bit of the wire of dense index i, and the
+# random data of the keys of wire i follow at _key_offset(cipher,
+# wire_count, i). Half-gates: the global offset delta, then the label of
+# bit 0 of each input wire.
+SEED_SIZE = 16  # byte size of the seed of a garbled circuit
+_BITS = bytes.maketrans(b"01", b"\x00\x01")
+
+# Gate codes of compiled circuits; non-free gates of half-gates come first
+GATE_TYPES = ("AND", "NAND", "OR", "NOR", "XOR", "XNOR", "NOT")
+GATE_CODES = {gate_type: code for code, gate_type in enumerate(GATE_TYPES)}
+AND, NAND, OR, NOR, XOR, XNOR, NOT = range(len(GATE_TYPES))
+
+# LOOKUP-TABLE GATES
+# A LUT gate has 1 to LUT_MAX_INPUTS inputs and an arbitrary truth table:
+# {"id": 9, "type": "LUT", "in": [1, 2, 3], "table": [0, 0, 0, 1, 0, 1, 1, 1]}.
+# Entry n of the table is the output for the input bits of n, the first input
+# being the most significant bit. It is garbled with the classic scheme as
+# one table of 2^k rows, ordered by encrypted input bits (point-and-permute),
+# and evaluated with one decryption.
+LUT_TYPE = "LUT"
+LUT = len(GATE_TYPES)  # gate code of LUT gates
+GATE_CODES[LUT_TYPE] = LUT
+GATE_NAMES = GATE_TYPES + (LUT_TYPE,)  # gate type of each gate code
+LUT_MAX_INPUTS = 6
+
+# With free-XOR, each non-free gate is an AND gate with optionally inverted
+# inputs and output: gate type -> (invert_a, invert_b, invert_out)
+HALF_GATES_AND = {
+    "AND": (0, 0, 0),
+    "NAND": (0, 0, 1),
+    "OR": (1, 1, 1),
+    "NOR": (1, 1, 0),
+}
+
+
+def check_lut(gate):
+    """
+    Check the spec of a LUT gate
+    :param gate: A dict containing gate spec
+    :return:
+    :raise ValueError: if the gate has no input or more than LUT_MAX_INPUTS
+        inputs, or if its table is not a list of 2^k bits
+    """
+    inputs, table = gate["in"], gate.get("table")
+    if not 1 <= len(inputs) <= LUT_MAX_INPUTS:
+        raise ValueError(f"LUT gate {gate['id']} has {len(inputs)} inputs, not 1 to "
+                         f"{LUT_MAX_INPUTS}")
+    if table is None or len(table) != 2**len(inputs) or any(bit not in (0, 1)
+                                                             for bit in table):
+        raise ValueError(f"LUT gate {gate['id']} needs a table of {2**len(inputs)} bits")
+
+
+def check_scheme(plan, scheme):
+    """
+    Check that a circuit can be garbled with a scheme
+    :param plan: The CompiledCircuit of the circuit
+    :param scheme: The garbling scheme
+    :return:
+    :raise ValueError: if the scheme is unknown, or not classic for a
+        circuit with LUT gates
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown garbling scheme '{scheme}'")
+    if scheme != CLASSIC and plan.lut_inputs:
+        raise ValueError(f"Circuit {plan.id} has LUT gates, only garbled with the classic "
+                         f"scheme")
 
 
 def encrypt(key, data):
@@ -28,49 +122,998 @@ def decrypt(key, data):
     return f.decrypt(data)
 
 
-def evaluate(circuit, g_tables, p_bits_out, a_inputs, b_inputs):
+def expand_seed(seed, offset, size):
+    """
+    Read the pseudorandom stream of a seed
+    :param seed: The SEED_SIZE-byte seed
+    :param offset: The offset of the first byte in the stream
+    :param size: The number of bytes
+    :return: The bytes
+    """
+    block, skip = divmod(offset, 16)
+    counter = block.to_bytes(16, "big")
+    encryptor = Cipher(algorithms.AES(seed), modes.CTR(counter)).encryptor()
+    return encryptor.update(bytes(skip + size))[skip:]
+
+
+def instance_seed(seed, n):
+    """
+    Derive the seed of a garbled instance from the seed of a run, so that
+    the instances of a run are reproducible but garbled with distinct labels
+    :param seed: The SEED_SIZE-byte seed of the run
+    :param n: The index of the instance in the run
+    :return: A SEED_SIZE-byte seed
+    """
+    return expand_seed(seed, n * SEED_SIZE, SEED_SIZE)
+
+
+def _key_offset(cipher, wire_count, i):
+    # offset in the stream of a seed of the random data of the keys of wire i
+    return (wire_count + 7) // 8 + i * cipher.random_size
+
+
+def _unpack_bits(bits, start, stop):
+    """
+    Read bits of a bit array, least significant bit first
+    :param bits: The bytes of the bit array
+    :param start: The index of the first bit
+    :param stop: The index after the last bit
+    :return: The bits, one per byte
+    """
+    count = stop - start
+    if count <= 0:
+        return b""
+    value = int.from_bytes(bits[start >> 3:(stop + 7) >> 3], "little") >> (start & 7)
+    return format(value & ((1 << count) - 1), f"0{count}b")[::-1].encode().translate(_BITS)
+
+
+def derive_keys(cipher, seed, offset, p_bits):
+    """
+    Derive the pairs of keys of consecutive wires from a seed
+    :param cipher: The LabelCipher of the keys
+    :param seed: The SEED_SIZE-byte seed
+    :param offset: The offset in the stream of the random data of the first wire
+    :param p_bits: The p-bit of each wire
+    :return: The keys of bits 0 and 1 of each wire, concatenated
+    """
+    return cipher.derive_key_buffer(p_bits, expand_seed(seed, offset,
+                                                        cipher.random_size * len(p_bits)))
+
+
+def derive_labels(seed, start, count):
+    """
+    Derive the global offset and the labels of input wires of half-gates from a seed
+    :param seed: The SEED_SIZE-byte seed
+    :param start: The dense index of the first input wire
+    :param count: The number of input wires
+    :return: A pair (delta, list of the int labels of bit 0 of the wires)
+    """
+    delta = int.from_bytes(expand_seed(seed, 0, LABEL_SIZE), "little") | 1
+    data = expand_seed(seed, LABEL_SIZE * (start + 1), LABEL_SIZE * count)
+    return delta, [int.from_bytes(data[i * LABEL_SIZE:(i + 1) * LABEL_SIZE], "little")
+                   for i in range(count)]
+
+
+def gf_double(label):
+    """
+    Multiply a label by x in GF(2^128)
+    :param label: A LABEL_BITS int
+    :return: A LABEL_BITS int
+    """
+    label <<= 1
+    if label >> LABEL_BITS:
+        label ^= (1 << LABEL_BITS) | 0x87
+    return label
+
+
+class LabelCipher(ABC):
+    """
+    An abstract class for the ciphers encrypting the rows of garbled tables.
+
+    A row encrypts the output key of a gate and its encrypted bit under the
+    keys of the gate's input wires and a tweak unique to the gate.
+    """
+    name = None
+    key_size = None  # byte size of the keys
+    random_size = None  # byte size of the random data of a pair of keys
+
+    @abstractmethod
+    def derive_keys(self, p_bit, data):
+        """
+        Create the pair of keys of a wire from random data
+        :param p_bit: The p-bit of the wire
+        :param data: random_size random bytes
+        :return: A pair (key0, key1)
+        """
+        pass
+
+    def derive_key_buffer(self, p_bits, data):
+        """
+        Create the pairs of keys of consecutive wires from random data
+        :param p_bits: The p-bit of each wire
+        :param data: random_size random bytes per wire
+        :return: The keys of bits 0 and 1 of each wire, concatenated
+        """
+        size = self.random_size
+        return b"".join(b"".join(self.derive_keys(p_bit, data[i * size:(i + 1) * size]))
+                        for i, p_bit in enumerate(p_bits))
+
+    @abstractmethod
+    def encrypt(self, keys, tweak, key_out, encr_bit_out):
+        """
+        Encrypt a row of a garbled table
+        :param keys: The keys of the gate's input wires
+        :param tweak: An int unique to the gate
+        :param key_out: The output key
+        :param encr_bit_out: The encrypted output bit
+        :return: The encrypted row as a byte stream
+        """
+        pass
+
+    @abstractmethod
+    def decrypt(self, keys, tweak, row):
+        """
+        Decrypt a row of a garbled table
+        :param keys: The keys of the gate's input wires
+        :param tweak: An int unique to the gate
+        :param row: The encrypted row
+        :return: A pair (key_out, encr_bit_out)
+        """
+        pass
+
+
+class FernetCipher(LabelCipher):
+    """Legacy cipher: rows nested in one Fernet token per input key."""
+    name = "fernet"
+    key_size = 44  # url-safe base64 of 32 bytes, as Fernet.generate_key
+    random_size = 64
+
+    def derive_keys(self, p_bit, data):
+        return base64.urlsafe_b64encode(data[:32]), base64.urlsafe_b64encode(data[32:64])
+
+    def encrypt(self, keys, tweak, key_out, encr_bit_out):
+        msg = util.pack_input(key_out, encr_bit_out)
+        for key in reversed(keys):
+            msg = encrypt(key, msg)
+        return msg
+
+    def decrypt(self, keys, tweak, row):
+        row = bytes(row)
+        for key in keys:
+            row = decrypt(key, row)
+        return util.unpack_input(row)
+
+
+class FixedKeyCipher(LabelCipher):
+    """
+    Raw 16-byte wire labels garbled with fixed-key AES.
+
+    The label hash is H(K) = AES_k(K) XOR K with a public fixed key k, where
+    K is the tweak XOR the successive GF(2^128) doublings of the input
+    labels. The encrypted bit of a label is its least significant bit, so
+    a row is just the output label XOR the hash of the input labels.
+    """
+    name = "fixed-key"
+    key_size = LABEL_SIZE
+    random_size = 2 * LABEL_SIZE
+    FIXED_KEY = bytes.fromhex("61c5a7e6e8f34cb2b5e46a0e2d67b04d")
+
+    def __init__(self):
+        self._aes = Cipher(algorithms.AES(self.FIXED_KEY), modes.ECB()).encryptor()
+
+    def hash(self, labels, tweak):
+        """
+        Hash wire labels with a tweak
+        :param labels: A sequence of LABEL_BITS int labels
+        :param tweak: An int unique to the gate
+        :return: A LABEL_BITS int
+        """
+        block = tweak & LABEL_MASK
+        for i, label in enumerate(labels):
+            for _ in range(i + 1):
+                label = gf_double(label)
+            block ^= label
+        cipher_block = self._aes.update(block.to_bytes(LABEL_SIZE, "little"))
+        return int.from_bytes(cipher_block, "little") ^ block
+
+    def derive_keys(self, p_bit, data):
+        key0, key1 = bytearray(data[:LABEL_SIZE]), bytearray(data[LABEL_SIZE:2 * LABEL_SIZE])
+        key0[0] = (key0[0] & ~1) | p_bit
+        key1[0] = (key1[0] & ~1) | (p_bit ^ 1)
+        return bytes(key0), bytes(key1)
+
+    def derive_key_buffer(self, p_bits, data):
+        # Set the encrypted bits, in the first byte of each key, of all keys at once
+        keys, count = bytearray(data), len(p_bits)
+        bits = int.from_bytes(bytes(p_bits), "little")
+        ones = int.from_bytes(b"\x01" * count, "little")
+        for start, flip in ((0, 0), (LABEL_SIZE, ones)):
+            first = int.from_bytes(keys[start::self.random_size], "little")
+            first = (first & ~ones) | (bits ^ flip)
+            keys[start::self.random_size] = first.to_bytes(count, "little")
+        return bytes(keys)
+
+    def encrypt(self, keys, tweak, key_out, encr_bit_out):
+        pad = self.hash([int.from_bytes(key, "little") for key in keys], tweak)
+        return (pad ^ int.from_bytes(key_out, "little")).to_bytes(LABEL_SIZE, "little")
+
+    def decrypt(self, keys, tweak, row):
+        pad = self.hash([int.from_bytes(key, "little") for key in keys], tweak)
+        label = pad ^ int.from_bytes(row, "little")
+        return label.to_bytes(LABEL_SIZE, "little"), label & 1
+
+
+FERNET = FernetCipher.name
+FIXED_KEY = FixedKeyCipher.name
+CIPHERS = {FERNET: FernetCipher, FIXED_KEY: FixedKeyCipher}
+_ciphers = {}
+
+
+def get_cipher(name):
+    """
+    Return the shared instance of a label cipher
+    :param name: The cipher name, fernet or fixed-key
+    :return: A LabelCipher
+    """
+    if name not in _ciphers:
+        if name not in CIPHERS:
+            raise ValueError(f"Unknown label cipher '{name}'")
+        _ciphers[name] = CIPHERS[name]()
+    return _ciphers[name]
+
+
+class PackedTables(Mapping):
+    """
+    Garbled tables of a circuit packed in one contiguous buffer.
+
+    The rows of the k-th gate are the rows row_starts[k] to row_starts[k + 1] - 1,
+    and row r is buffer[row_offsets[r]:row_offsets[r + 1]], or
+    buffer[r * row_size:(r + 1) * row_size] when all rows have the same size,
+    as with fixed-key labels. Rows of classic tables are ordered by their
+    tuple of encrypted bits.
+
+    Indexing a gate ID returns a sequence of its rows as memoryviews of the
+    buffer, which also accepts the tuple of encrypted bits of a classic row.
+
+    Args:
+        gate_ids: An array of the gate IDs
+        row_starts: An array of the index of the first row of each gate, plus the row count
+        row_offsets: An array of the byte offset of each row, plus the buffer
+            size, or the byte size of all rows
+        buffer: The bytes-like buffer of all rows
+    """
+
+    def __init__(self, gate_ids, row_starts, row_offsets, buffer):
+        self.gate_ids = gate_ids
+        self.row_starts = row_starts
+        self.row_offsets = row_offsets
+        self.buffer = memoryview(buffer)
+        self._positions = None
+
+    @property
+    def positions(self):
+        """The map from gate ID to its index, created at the first lookup"""
+        if self._positions is None:
+            self._positions = {gate_id: k for k, gate_id in enumerate(self.gate_ids)}
+        return self._positions
+
+    @classmethod
+    def pack(cls, g_tables):
+        """
+        Pack garbled tables
+        :param g_tables: A dict mapping each gate to its garbled table, a dict
+            of classic rows or a sequence of rows, or an iterable of pairs
+            (gate ID, sequence of rows). PackedTables are returned as they are.
+        :return: A PackedTables
+        """
+        if isinstance(g_tables, PackedTables):
+            return g_tables
+        if isinstance(g_tables, Mapping):
+            g_tables = g_tables.items()
+        gate_ids, row_starts, row_offsets = array("q"), array("q", [0]), array("q", [0])
+        rows = []
+        for gate_id, table in g_tables:
+            if isinstance(table, dict):
+                table = [table[k] for k in sorted(table)]
+            for row in table:
+                rows.append(row)
+                row_offsets.append(row_offsets[-1] + len(row))
+            gate_ids.append(gate_id)
+            row_starts.append(len(rows))
+        if rows and all(len(row) == len(rows[0]) for row in rows):
+            row_offsets = len(rows[0])
+        return cls(gate_ids, row_starts, row_offsets, b"".join(rows))
+
+    def row(self, r):
+        """
+        Return a row
+        :param r: The index of the row
+        :return: A memoryview of the buffer
+        """
+        if isinstance(self.row_offsets, int):
+            return self.buffer[r * self.row_offsets:(r + 1) * self.row_offsets]
+        return self.buffer[self.row_offsets[r]:self.row_offsets[r + 1]]
+
+    def __getitem__(self, gate_id):
+        k = self.positions[gate_id]
+        return PackedRows(self, self.row_starts[k], self.row_starts[k + 1])
+
+    def __iter__(self):
+        return iter(self.gate_ids)
+
+    def __len__(self):
+        return len(self.gate_ids)
+
+    def to_state(self):
+        row_offsets = self.row_offsets
+        if not isinstance(row_offsets, int):
+            row_offsets = row_offsets.tobytes()
+        return self.gate_ids.tobytes(), self.row_starts.tobytes(), row_offsets, self.buffer
+
+    @classmethod
+    def from_state(cls, state):
+        gate_ids, row_starts = (array("q", bytes(a)) for a in state[:2])
+        row_offsets, buffer = state[2], state[3]
+        if (len(row_starts) != len(gate_ids) + 1 or row_starts[0]
+                or any(a > b for a, b in zip(row_starts, row_starts[1:]))):
+            raise ValueError("Inconsistent packed tables")
+        if isinstance(row_offsets, int):
+            if row_offsets < 0 or row_starts[-1] * row_offsets != len(buffer):
+                raise ValueError("Inconsistent packed tables")
+            return cls(gate_ids, row_starts, row_offsets, buffer)
+        row_offsets = array("q", bytes(row_offsets))
+        if (row_offsets[0:1] != array("q", [0])
+                or row_starts[-1] + 1 != len(row_offsets)
+                or row_offsets[-1] != len(buffer)
+                or any(a > b for a, b in zip(row_offsets, row_offsets[1:]))):
+            raise ValueError("Inconsistent packed tables")
+        return cls(gate_ids, row_starts, row_offsets, buffer)
+
+
+class PackedRows(Sequence):
+    """The rows of a gate of PackedTables, as memoryviews of the buffer"""
+
+    def __init__(self, tables, start, stop):
+        self.tables = tables
+        self.start = start
+        self.stop = stop
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            # Classic rows are indexed by their tuple of encrypted bits
+            bits, index = index, 0
+            for bit in bits:
+                index = 2 * index + bit
+        if not 0 <= index < self.stop - self.start:
+            raise IndexError(index)
+        return self.tables.row(self.start + index)
+
+    def __len__(self):
+        return self.stop - self.start
+
+
+wire.register(PackedTables, "tables", PackedTables.to_state, PackedTables.from_state)
+
+
+class CompiledCircuit:
+    """
+    A topologically ordered evaluation plan of a circuit.
+
+    Wires are renumbered to dense indexes: input wires first, then the
+    output wire of each gate in evaluation order. Gates are stored as flat
+    lists, NOT gates having -1 as second input. LUT gates also have all
+    their inputs in lut_inputs and their truth table in lut_tables, by
+    index of the gate.
+
+    Args:
+        circuit: A dict containing circuit spec
+
+    Raises:
+        ValueError: if a wire is the output of several gates, if the circuit
+            has a cycle or if a LUT gate is malformed
+    """
+
+    def __init__(self, circuit):
+        self.id = circuit.get("id")
+        gates = {}  # map from output wire to gate
+        for gate in circuit["gates"]:
+            if gate["id"] in gates:
+                raise ValueError(f"Wire {gate['id']} is the output of several gates")
+            if gate["type"] == LUT_TYPE:
+                check_lut(gate)
+            gates[gate["id"]] = gate
+
+        # Input wires are Alice's, then Bob's, then any other unproduced wire
+        inputs = list(circuit.get("alice", [])) + list(circuit.get("bob", []))
+        for gate in circuit["gates"]:
+            inputs.extend(w for w in gate["in"] if w not in gates)
+        inputs = list(dict.fromkeys(inputs))
+
+        # Kahn's algorithm, evaluating ready gates in order of id
+        pending = {}  # map from gate to its count of unevaluated inputs
+        consumers = {}  # map from wire to the gates reading it
+        ready = []
+        for gate_id, gate in gates.items():
+            pending[gate_id] = sum(1 for w in gate["in"] if w in gates)
+            for w in gate["in"]:
+                consumers.setdefault(w, []).append(gate_id)
+            if not pending[gate_id]:
+                heapq.heappush(ready, gate_id)
+
+        order = []
+        while ready:
+            gate_id = heapq.heappop(ready)
+            order.append(gate_id)
+            for consumer in consumers.get(gate_id, ()):
+                pending[consumer] -= 1
+                if not pending[consumer]:
+                    heapq.heappush(ready, consumer)
+
+        if len(order) < len(gates):
+            cycle = sorted(w for w, count in pending.items() if count)
+            raise ValueError(f"Circuit {self.id} has a cycle through gates {cycle}")
+
+        self.wires = inputs + order  # wire ID of each dense index
+        self.index = {w: i for i, w in enumerate(self.wires)}
+        self.inputs = inputs
+        self.gate_ids = order
+        self.types = [GATE_CODES[gates[g]["type"]] for g in order]
+        self.in_a = [self.index[gates[g]["in"][0]] for g in order]
+        self.in_b = [self.index[gates[g]["in"][1]] if len(gates[g]["in"]) > 1 else -1
+                     for g in order]
+        self.out = [self.index[g] for g in order]
+        self.outputs = list(circuit["out"])
+        self.lut_inputs, self.lut_tables = {}, {}
+        for k, g in enumerate(order):
+            if gates[g]["type"] == LUT_TYPE:
+                self.lut_inputs[k] = tuple(self.index[w] for w in gates[g]["in"])
+                self.lut_tables[k] = tuple(gates[g]["table"])
+        self._liveness = None
+
+    @classmethod
+    def from_arrays(cls, circuit_id, wires, input_count, types, in_a, in_b, outputs):
+        """
+        Create the plan of a circuit already in dense evaluation order
+        :param circuit_id: The circuit ID
+        :param wires: A sequence of the wire ID of each dense index, inputs first
+        :param input_count: The number of input wires
+        :param types: A sequence of the gate code of each gate
+        :param in_a: A sequence of the dense index of the first input of each gate
+        :param in_b: A sequence of the dense index of the second input of each
+            gate, -1 for NOT gates
+        :param outputs: A list of the dense index of each output
+        :return: A CompiledCircuit whose index only maps input and output wires
+        """
+        plan = cls.__new__(cls)
+        plan.id = circuit_id
+        plan.wires = wires
+        plan.inputs = list(wires[:input_count])
+        plan.gate_ids = wires[input_count:]
+        plan.types = types
+        plan.in_a = in_a
+        plan.in_b = in_b
+        plan.out = range(input_count, len(wires))
+        plan.outputs = [wires[i] for i in outputs]
+        plan.index = {w: i for i, w in enumerate(plan.inputs)}
+        plan.index.update(zip(plan.outputs, outputs))
+        plan.lut_inputs, plan.lut_tables = {}, {}
+        plan._liveness = None
+        return plan
+
+    def __len__(self):
+        return len(self.gate_ids)
+
+    def gate(self, k):
+        """
+        Return the spec of a gate
+        :param k: The index of the gate in the plan
+        :return: A dict containing gate spec
+        """
+        gate = {"id": self.gate_ids[k], "type": GATE_NAMES[self.types[k]],
+                "in": [self.wires[i] for i in self.gate_inputs(k)]}
+        if k in self.lut_tables:
+            gate["table"] = list(self.lut_tables[k])
+        return gate
+
+    def gate_inputs(self, k):
+        """
+        Return the inputs of a gate
+        :param k: The index of the gate in the plan
+        :return: A tuple of the dense indexes of the input wires
+        """
+        if k in self.lut_inputs:
+            return self.lut_inputs[k]
+        return (self.in_a[k],) if self.in_b[k] < 0 else (self.in_a[k], self.in_b[k])
+
+    def liveness(self):
+        """Return the Liveness of the plan, computed at the first call"""
+        if self._liveness is None:
+            self._liveness = Liveness(self)
+        return self._liveness
+
+    def load_inputs(self, *inputs, size=None):
+        """
+        Create the dense list of wire values from dicts of input values
+        :param inputs: Dicts mapping input wires to values
+        :param size: Optional; the length of the list (default the number of wires)
+        :return: A list holding the value of each input wire by dense index
+        """
+        values = [None] * (len(self.wires) if size is None else size)
+        for wire_inputs in inputs:
+            for w, value in wire_inputs.items():
+                values[self.index[w]] = value
+        for i in range(len(self.inputs)):
+            if values[i] is None:
+                raise ValueError(f"Missing input for wire {self.wires[i]}")
+        return values
+
+
+class Liveness:
+    """
+    The live ranges of the wires of a CompiledCircuit, from the gate creating
+    a wire to the last gate reading it, and a register allocation of the
+    wires on them.
+
+    Each wire holds a slot while it is live; a gate frees the slots of its
+    dead inputs before taking the slot of its output, which may be one of
+    them. Input wires hold slots 0 to len(inputs) - 1 and outputs are never
+    freed, so an evaluation only needs slot_count values, the peak number of
+    live wires, instead of one value per wire. The slots of all the inputs
+    of LUT gates are in lut_inputs, by index of the gate.
+
+    Args:
+        plan: The CompiledCircuit
+    """
+
+    def __init__(self, plan):
+        gate_count, input_count = len(plan), len(plan.inputs)
+        # index of the last gate reading each wire by dense index, -1 if none
+        last_use = array("q", [-1]) * len(plan.wires)
+        for k, (in_a, in_b) in enumerate(zip(plan.in_a, plan.in_b)):
+            last_use[in_a] = k
+            if in_b >= 0:
+                last_use[in_b] = k
+        for k, inputs in plan.lut_inputs.items():
+            for i in inputs:
+                last_use[i] = max(last_use[i], k)
+        for w in plan.outputs:
+            last_use[plan.index[w]] = gate_count
+        self.last_use = last_use
+
+        slots = array("i", range(input_count)) + array("i", [-1]) * gate_count
+        free = [i for i in reversed(range(input_count)) if last_use[i] < 0]
+        slot_count = input_count
+        self.in_a, self.in_b, self.out = array("i"), array("i"), array("i")
+        self.lut_inputs = {}
+        for k, (in_a, in_b, out) in enumerate(zip(plan.in_a, plan.in_b, plan.out)):
+            self.in_a.append(slots[in_a])
+            self.in_b.append(slots[in_b] if in_b >= 0 else -1)
+            inputs = {in_a, in_b}
+            if k in plan.lut_inputs:
+                self.lut_inputs[k] = tuple(slots[i] for i in plan.lut_inputs[k])
+                inputs.update(plan.lut_inputs[k])
+            for i in inputs:
+                if i >= 0 and last_use[i] == k:
+                    free.append(slots[i])
+            if free:
+                slots[out] = free.pop()
+            else:
+                slots[out] = slot_count
+                slot_count += 1
+            self.out.append(slots[out])
+            if last_use[out] < 0:
+                free.append(slots[out])
+        self.slot_count = slot_count
+        self.outputs = {w: slots[plan.index[w]] for w in plan.outputs}
+
+    def dead(self, plan, start, stop):
+        """
+        Return the wires no gate reads after a range of gates, except inputs and outputs
+        :param plan: The CompiledCircuit
+        :param start: The index of the first gate
+        :param stop: The index after the last gate
+        :return: A list of the dense indexes of the wires
+        """
+        input_count, dead = len(plan.inputs), []
+        for k in range(start, stop):
+            for i in plan.lut_inputs.get(k, ()) + (plan.in_a[k], plan.in_b[k], plan.out[k]):
+                if i >= input_count and self.last_use[i] < stop:
+                    dead.append(i)
+        return dead
+
+
+_compiled_circuits = {}  # map from circuit hash to CompiledCircuit
+# map from the id of a circuit dict to the dict, kept alive so that its id is
+# not reused, and its hash
+_circuit_hashes = {}
+_cache_lock = threading.Lock()  # sessions of a server compile circuits in parallel
+COMPILED_CACHE_SIZE = 64
+
+
+def _cache_put(cache, key, value):
+    """
+    Insert a value in a cache of COMPILED_CACHE_SIZE entries, evicting the
+    oldest one if full, with the cache lock held
+    :param cache: The cache
+    :param key: The key
+    :param value: The value, unless the key is already cached
+    :return: The cached value of the key
+    """
+    if key not in cache and len(cache) >= COMPILED_CACHE_SIZE:
+        del cache[next(iter(cache))]
+    return cache.setdefault(key, value)
+
+
+def circuit_hash(circuit):
+    """
+    Return a hash of the spec of a circuit, cached by circuit dict: a circuit
+    dict is not to be modified once hashed
+    :param circuit: A dict containing circuit spec, or a circuit with a digest
+        method such as a loader.BinaryCircuit
+    :return: The SHA-256 digest of the spec
+    """
+    if hasattr(circuit, "digest"):
+        return circuit.digest()
+    with _cache_lock:
+        cached = _circuit_hashes.get(id(circuit))
+    if cached is not None:
+        return cached[1]
+    spec = json.dumps([circuit.get(k) for k in ("id", "alice", "bob", "out", "gates")],
+                      sort_keys=True)
+    digest = hashlib.sha256(spec.encode()).digest()
+    with _cache_lock:
+        _cache_put(_circuit_hashes, id(circuit), (circuit, digest))
+    return digest
+
+
+def compile_circuit(circuit):
+    """
+    Return the evaluation plan of a circuit, cached by circuit hash
+    :param circuit: A dict containing circuit spec, a CompiledCircuit, or a
+        circuit carrying its plan such as a loader.BinaryCircuit
+    :return: A CompiledCircuit
+    """
+    if isinstance(circuit, CompiledCircuit):
+        return circuit
+    if hasattr(circuit, "plan"):
+        return circuit.plan
+    key = circuit_hash(circuit)
+    with _cache_lock:
+        plan = _compiled_circuits.get(key)
+    if plan is None:
+        # Compiled outside the lock, so that sessions do not wait for each other
+        plan = CompiledCircuit(circuit)
+        with _cache_lock:
+            plan = _cache_put(_compiled_circuits, key, plan)
+    return plan
+
+
+def evaluate(circuit, g_tables, p_bits_out, a_inputs, b_inputs, scheme=CLASSIC,
+             cipher=FERNET):
     """
     Evaluate yao circuit with given inputs
-    :param circuit: A dict containing circuit spec.
+    :param circuit: A dict containing circuit spec, or its CompiledCircuit.
     :param g_tables: The yao circuit garbled tables.
     :param p_bits_out: The p-bits of outputs
     :param a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs
     :param b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+    :param scheme: Optional; the garbling scheme of the circuit (default classic)
+    :param cipher: Optional; the label cipher of a classic circuit (default fernet)
     :return:
     """
-    gates = circuit["gates"]  # dict containing circuit gates
-    wire_outputs = circuit["out"]  # list of output wires
-    wire_inputs = {}  # dict containing Alice and Bob inputs
-    evaluation = {}  # dict containing result of evaluation
-
-    wire_inputs.update(a_inputs)
-    wire_inputs.update(b_inputs)
-
-    # Iterate over all gates
-    for gate in sorted(gates, key=lambda g: g["id"]):
-        gate_id, gate_in, msg = gate["id"], gate["in"], None
-        # Special case if it's a NOT gate
-        if (len(gate_in) < 2) and (gate_in[0] in wire_inputs):
-            # Fetch input key associated with the gate's input wire
-            key_in, encr_bit_in = wire_inputs[gate_in[0]]
-            # Fetch the encrypted message in the gate's garbled table
-            encr_msg = g_tables[gate_id][(encr_bit_in,)]
-            # Decrypt message
-            msg = decrypt(key_in, encr_msg)
-        elif (gate_in[0] in wire_inputs) and (gate_in[1] in wire_inputs):
-            key_a, encr_bit_a = wire_inputs[gate_in[0]]
-            key_b, encr_bit_b = wire_inputs[gate_in[1]]
-            encr_msg = g_tables[gate_id][(encr_bit_a, encr_bit_b)]
-            msg = decrypt(key_b, decrypt(key_a, encr_msg))
-
-        if msg:
-            wire_inputs[gate_id] = pickle.loads(msg)
-
-    # After all gates have been evaluated, we populate the dict of results
-    for out in wire_outputs:
-        evaluation[out] = wire_inputs[out][1] ^ p_bits_out[out]
-
-    return evaluation
+    evaluator = Evaluator(circuit, a_inputs, b_inputs, scheme, cipher)
+    evaluator.evaluate(g_tables)
+    return evaluator.get_result(p_bits_out)
+
+
+class Evaluator:
+    """
+    An evaluation of a garbled circuit, gate range by gate range.
+
+    Gates are evaluated in the order of the CompiledCircuit. Garbled tables
+    may be given all at once or in consecutive chunks as they are received.
+    Wire values are held in the slots of the plan's Liveness, so that a
+    label is dropped once its last gate is evaluated and the memory of the
+    evaluation grows with the width of the circuit, peak_live_wires.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit
+        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs
+        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs
+        scheme: Optional; the garbling scheme of the circuit (default classic)
+        cipher: Optional; the label cipher of a classic circuit (default fernet)
+    """
+
+    def __init__(self, circuit, a_inputs, b_inputs, scheme=CLASSIC, cipher=FERNET):
+        self.plan = compile_circuit(circuit)
+        check_scheme(self.plan, scheme)
+        self.liveness = self.plan.liveness()
+        self.scheme = scheme
+        self.next_gate = 0  # index in the plan of the next gate to evaluate
+        size = self.liveness.slot_count
+        if scheme == HALF_GATES:
+            self.hash_label = get_cipher(FIXED_KEY).hash
+            # int label of each live wire by slot; its lsb is the encrypted bit
+            self.values = self.plan.load_inputs(
+                *({w: int.from_bytes(label, "little") for w, (label, _) in inputs.items()}
+                  for inputs in (a_inputs, b_inputs)), size=size)
+        else:
+            self.decrypt_row = get_cipher(cipher).decrypt
+            # (key, encr_bit) of each live wire by slot
+            self.values = self.plan.load_inputs(a_inputs, b_inputs, size=size)
+        metrics.peak("live_wires", size)
+
+    @property
+    def peak_live_wires(self):
+        """The peak number of wire values held during the evaluation"""
+        return self.liveness.slot_count
+
+    def evaluate(self, g_tables, start=None, stop=None):
+        """
+        Evaluate the next gates of the plan
+        :param g_tables: The garbled tables of the gates, as a Mapping from gate ID
+        :param start: Optional; the index of the first gate, which must be the
+            next gate to evaluate (default the next gate)
+        :param stop: Optional; the index after the last gate (default all gates)
+        :return:
+        """
+        if start is not None and start != self.next_gate:
+            raise ValueError(f"Expected gate {self.next_gate} of {self.plan.id}, got {start}")
+        start = self.next_gate
+        stop = len(self.plan) if stop is None else stop
+        with metrics.timer("evaluate"):
+            if self.scheme == HALF_GATES:
+                self._evaluate_half_gates(g_tables, start, stop)
+            else:
+                try:
+                    self._evaluate_classic(g_tables, start, stop)
+                except InvalidToken:
+                    metrics.count("decrypt_failures")
+                    raise
+        metrics.count("gates_evaluated", stop - start)
+        self.next_gate = stop
+
+    def _evaluate_classic(self, g_tables, start, stop):
+        plan, wire_inputs, decrypt_row = self.plan, self.values, self.decrypt_row
+        slots = self.liveness
+        lut_inputs = slots.lut_inputs
+        for k, gate_id, in_a, in_b, out in zip(range(start, stop), plan.gate_ids[start:stop],
+                                               slots.in_a[start:stop], slots.in_b[start:stop],
+                                               slots.out[start:stop]):
+            # LUT gates decrypt the row of the encrypted bits of all their inputs
+            if k in lut_inputs:
+                keys, encr_bits = zip(*(wire_inputs[i] for i in lut_inputs[k]))
+                encr_msg = g_tables[gate_id][encr_bits]
+                wire_inputs[out] = decrypt_row(keys, gate_id, encr_msg)
+                continue
+            key_a, encr_bit_a = wire_inputs[in_a]
+            # Special case if it's a NOT gate
+            if in_b < 0:
+                encr_msg = g_tables[gate_id][(encr_bit_a,)]
+                wire_inputs[out] = decrypt_row((key_a,), gate_id, encr_msg)
+            else:
+                key_b, encr_bit_b = wire_inputs[in_b]
+                encr_msg = g_tables[gate_id][(encr_bit_a, encr_bit_b)]
+                wire_inputs[out] = decrypt_row((key_a, key_b), gate_id, encr_msg)
+
+    def _evaluate_half_gates(self, g_tables, start, stop):
+        """
+        Evaluate gates garbled with free-XOR and half-gates
+        :param g_tables: A Mapping from each non-free gate to its (T_G, T_E) pair
+        :return:
+        """
+        plan, labels, hash_label = self.plan, self.values, self.hash_label
+        slots = self.liveness
+        for gate_id, gate_type, in_a, in_b, out in zip(
+                plan.gate_ids[start:stop], plan.types[start:stop], slots.in_a[start:stop],
+                slots.in_b[start:stop], slots.out[start:stop]):
+            if gate_type == NOT:
+                labels[out] = labels[in_a]
+            elif gate_type >= XOR:
+                labels[out] = labels[in_a] ^ labels[in_b]
+            else:
+                label_a, label_b = labels[in_a], labels[in_b]
+                t_g, t_e = g_tables[gate_id]
+                # Garbler half-gate, keyed by the colour bit of a
+                w_g = hash_label((label_a,), 2 * gate_id)
+                if label_a & 1:
+                    w_g ^= int.from_bytes(t_g, "little")
+                # Evaluator half-gate, keyed by the colour bit of b
+                w_e = hash_label((label_b,), 2 * gate_id + 1)
+                if label_b & 1:
+                    w_e ^= int.from_bytes(t_e, "little") ^ label_a
+                labels[out] = w_g ^ w_e
+
+    def get_result(self, p_bits_out):
+        """
+        Decode the outputs once all gates are evaluated
+        :param p_bits_out: The p-bits of outputs
+        :return: A dict mapping each output wire to its clear bit
+        """
+        if self.next_gate < len(self.plan):
+            raise ValueError(f"Circuit {self.plan.id} is not fully evaluated")
+        slots = self.liveness.outputs
+        if self.scheme == HALF_GATES:
+            return {out: (self.values[slots[out]] & 1) ^ p_bits_out[out]
+                    for out in self.plan.outputs}
+        return {out: self.values[slots[out]][1] ^ p_bits_out[out] for out in self.plan.outputs}
+
+
+def _garble_half_gates(plan, labels, delta, indexes, tables):
+    """
+    Garble gates with free-XOR and half-gates
+    :param plan: The CompiledCircuit to garble
+    :param labels: The int label of bit 0 of each wire by dense index, as a
+        list or a dict, filled in for the outputs of the gates
+    :param delta: The global offset of the labels of bit 1
+    :param indexes: The indexes in the plan of the gates, in evaluation order
+    :param tables: A dict to fill with the (T_G, T_E) pair of each non-free gate
+    :return:
+    """
+    hash_label = get_cipher(FIXED_KEY).hash
+    for k in indexes:
+        gate_id, gate_type = plan.gate_ids[k], plan.types[k]
+        in_a, in_b, out = plan.in_a[k], plan.in_b[k], plan.out[k]
+        if gate_type == NOT:
+            labels[out] = labels[in_a] ^ delta
+        elif gate_type == XOR:
+            labels[out] = labels[in_a] ^ labels[in_b]
+        elif gate_type == XNOR:
+            labels[out] = labels[in_a] ^ labels[in_b] ^ delta
+        else:
+            invert_a, invert_b, invert_out = HALF_GATES_AND[GATE_TYPES[gate_type]]
+            label_a = labels[in_a] ^ (delta if invert_a else 0)
+            label_b = labels[in_b] ^ (delta if invert_b else 0)
+            p_a, p_b = label_a & 1, label_b & 1
+
+            # Garbler half-gate
+            h_a0 = hash_label((label_a,), 2 * gate_id)
+            h_a1 = hash_label((label_a ^ delta,), 2 * gate_id)
+            t_g = h_a0 ^ h_a1 ^ (delta if p_b else 0)
+            w_g = h_a0 ^ (t_g if p_a else 0)
+
+            # Evaluator half-gate
+            h_b0 = hash_label((label_b,), 2 * gate_id + 1)
+            h_b1 = hash_label((label_b ^ delta,), 2 * gate_id + 1)
+            t_e = h_b0 ^ h_b1 ^ label_a
+            w_e = h_b0 ^ ((t_e ^ label_a) if p_b else 0)
+
+            labels[out] = w_g ^ w_e ^ (delta if invert_out else 0)
+            tables[gate_id] = (t_g.to_bytes(LABEL_SIZE, "little"),
+                               t_e.to_bytes(LABEL_SIZE, "little"))
+
+
+def _and_levels(plan):
+    """
+    Group the gates of a plan by AND depth, the number of non-free gates on
+    the longest path from the inputs. Non-free gates of a level only read
+    wires of lower levels; free gates of a level may also read wires of
+    their own level, written earlier in evaluation order.
+    :param plan: The CompiledCircuit
+    :return: A list of pairs (indexes of the non-free gates, indexes of the
+        free gates) of each level, in evaluation order
+    """
+    depths = [0] * len(plan.wires)
+    levels = [([], [])]
+    for k, (gate_type, in_a, in_b, out) in enumerate(zip(plan.types, plan.in_a, plan.in_b,
+                                                         plan.out)):
+        depth = max(depths[in_a], depths[in_b] if in_b >= 0 else 0)
+        free = gate_type >= XOR
+        if not free:
+            depth += 1
+            if depth == len(levels):
+                levels.append(([], []))
+        depths[out] = depth
+        levels[depth][free].append(k)
+    return levels
+
+
+# GARBLING WORKERS
+PARALLEL_CHUNK_SIZE = 4096  # number of classic gates or wires per worker task
+PARALLEL_MIN_GATES = 256  # minimum number of half-gates of a level sent to workers
+_worker_plan = None  # CompiledCircuit of the half-gates worker processes
+
+
+def _init_half_gates_worker(circuit):
+    """
+    Compile the circuit once in a worker process
+    :param circuit: A dict containing circuit spec
+    :return:
+    """
+    global _worker_plan
+    _worker_plan = compile_circuit(circuit)
+
+
+def _garble_half_gates_task(indexes, labels, delta):
+    """
+    Garble independent half-gates in a worker process
+    :param indexes: The indexes in the plan of the gates
+    :param labels: A dict mapping the dense index of their input wires to labels
+    :param delta: The global offset of the labels of bit 1
+    :return: A pair (dict mapping the dense index of their output wires to
+        labels, dict mapping each gate to its (T_G, T_E) pair)
+    """
+    tables = {}
+    _garble_half_gates(_worker_plan, labels, delta, indexes, tables)
+    return {_worker_plan.out[k]: labels[_worker_plan.out[k]] for k in indexes}, tables
+
+
+def _gen_keys_task(cipher, seed, offset, p_bits):
+    """
+    Derive the pairs of keys of consecutive wires in a worker process
+    :param cipher: The name of the label cipher
+    :param seed: The seed of the garbled circuit
+    :param offset: The offset in the stream of the random data of the first wire
+    :param p_bits: A list of the p-bits of the wires
+    :return: The keys of bits 0 and 1 of each wire, concatenated
+    """
+    return derive_keys(get_cipher(cipher), seed, offset, p_bits)
+
+
+def _garble_gates_task(cipher, gates):
+    """
+    Create the garbled tables of classic gates in a worker process
+    :param cipher: The name of the label cipher
+    :param gates: A list of the arguments of garble_rows after the cipher, one per gate
+    :return: A list of the rows of each gate
+    """
+    cipher = get_cipher(cipher)
+    return [garble_rows(cipher, *gate) for gate in gates]
+
+
+# Logical function of each gate type
+GATE_LOGIC = {
+    "AND": lambda b1, b2: b1 & b2,
+    "NAND": lambda b1, b2: 1 - (b1 & b2),
+    "OR": lambda b1, b2: b1 | b2,
+    "NOR": lambda b1, b2: 1 - (b1 | b2),
+    "XOR": lambda b1, b2: b1 ^ b2,
+    "XNOR": lambda b1, b2: 1 - (b1 ^ b2),
+    "NOT": lambda b: 1 - b,
+}
+
+
+def gate_logic(gate_type, table=None):
+    """
+    Return the logical function of a gate
+    :param gate_type: The type of the gate
+    :param table: Optional; the truth table of a LUT gate (default None)
+    :return: A function of the input bits returning the output bit
+    """
+    if gate_type != LUT_TYPE:
+        return GATE_LOGIC[gate_type]
+
+    def lut(*bits):
+        index = 0
+        for bit in bits:
+            index = 2 * index + bit
+        return table[index]
+    return lut
+
+
+def garble_rows(cipher, gate_type, tweak, in_keys, in_p_bits, out_keys, out_p_bit, table=None):
+    """
+    Create the garbled table of a classic gate
+    :param cipher: The LabelCipher encrypting the rows
+    :param gate_type: The type of the gate
+    :param tweak: The tweak of the gate, its output wire ID
+    :param in_keys: The pair of keys of each input wire
+    :param in_p_bits: The p-bit of each input wire
+    :param out_keys: The pair of keys of the output wire
+    :param out_p_bit: The p-bit of the output wire
+    :param table: Optional; the truth table of a LUT gate (default None)
+    :return: The list of the rows, ordered by their tuple of encrypted input bits
+    """
+    operator = gate_logic(gate_type, table)
+    rows = []
+    for encr_bits in itertools.product((0, 1), repeat=len(in_keys)):
+        # Retrieve the original bits and the keys encrypting the row
+        bits = [encr_bit ^ p_bit for encr_bit, p_bit in zip(encr_bits, in_p_bits)]
+        keys = tuple(pair[bit] for pair, bit in zip(in_keys, bits))
+        bit_out = operator(*bits)
+        # Encrypt the output key along with the encrypted bit
+        rows.append(cipher.encrypt(keys, tweak, out_keys[bit_out], bit_out ^ out_p_bit))
+    return rows
 
 
 class GarbledGate:
@@ -79,90 +1122,53 @@ class GarbledGate:
 
     Args:
         gate: A dict containing gate spec.
-        keys: A dict mapping each wire to a pair of keys
-        p_bits: A dict mapping each wire to its p-bit
+        keys: A mapping of each wire to a pair of keys
+        p_bits: A mapping of each wire to its p-bit
+        cipher: Optional; the LabelCipher encrypting the table rows (default Fernet)
     """
+    __slots__ = ("keys", "p_bits", "cipher", "input", "output", "gate_type", "table",
+                 "garbled_table")
 
-    def __init__(self, gate, keys, p_bits):
+    def __init__(self, gate, keys, p_bits, cipher=None):
         self.keys = keys
         self.p_bits = p_bits
+        self.cipher = cipher or get_cipher(FERNET)
         self.input = gate["in"]
         self.output = gate["id"]
         self.gate_type = gate["type"]
-        self.garbled_table = {}
-        # A clear representation of the garbled table for debugging purposes
-        self.clear_garbled_table = {}
-
-        switch = {
-            "OR": lambda b1, b2: b1 or b2,
-            "AND": lambda b1, b2: b1 and b2,
-            "XOR": lambda b1, b2: b1 ^ b2,
-            "NOR": lambda b1, b2: not (b1 or b2),
-            "NAND": lambda b1, b2: not (b1 and b2),
-            "XNOR": lambda b1, b2: not (b1 ^ b2)
-        }
-
-        # NOT gate is a special case since it has only one input
-        if self.gate_type == "NOT":
-            self._gen_garbled_table_not()
-        else:
-            operator = switch[self.gate_type]
-            self._gen_garbled_table(operator)
-
-    def _gen_garbled_table_not(self):
-        inp, out = self.input[0], self.output
-
-        # For each entry in the garbled table
-        for encr_bit_in in (0, 1):
-            # Retrieve original bit
-            bit_in = encr_bit_in ^ self.p_bits[inp]
-            # Compute output bit according to the gate type
-            bit_out = int(not bit_in)
-            # Compute encrypted bit with the p-bit table
-            encr_bit_out = bit_out ^ self.p_bits[out]
-            # Retrieve related keys
-            key_in = self.keys[inp][bit_in]
-            key_out = self.keys[out][bit_out]
-
-            # Serialize the output key along with the encrypted bit
-            msg = pickle.dumps((key_out, encr_bit_out))
-            # Encrypt message and add it to the garbled circuit
-            self.garbled_table[(encr_bit_in, )] = encrypt(key_in, msg)
-            # Add to the clear table indexes of each key
-            self.clear_garbled_table[(encr_bit_in, )] = [(inp, bit_in), (out, bit_out),
-                                                         encr_bit_out]
-
-    def _gen_garbled_table(self, operator):
-        """
-        Create the garbled table of a 2-input gate
-        :param operator: The logical function of the 2-input gate
-        :return:
+        self.table = gate.get("table")
+        rows = garble_rows(self.cipher, self.gate_type, self.output,
+                           [keys[w] for w in self.input], [p_bits[w] for w in self.input],
+                           keys[self.output], p_bits[self.output], self.table)
+        self.garbled_table = dict(zip(itertools.product((0, 1), repeat=len(self.input)), rows))
+
+    def get_clear_garbled_table(self):
         """
-        in_a, in_b, out = self.input[0], self.input[1], self.output
-
-        for encr_bit_a in (0, 1):
-            for encr_bit_b in (0, 1):
-                bit_a = encr_bit_a ^ self.p_bits[in_a]
-                bit_b = encr_bit_b ^ self.p_bits[in_b]
-                bit_out = int(operator(bit_a, bit_b))
-                encr_bit_out = bit_out ^ self.p_bits[out]
-                key_a = self.keys[in_a][bit_a]
-                key_b = self.keys[in_b][bit_b]
-                key_out = self.keys[out][bit_out]
-
-                msg = pickle.dumps((key_out, encr_bit_out))
-                self.garbled_table[(encr_bit_a, encr_bit_b)] = encrypt(
-                    key_a, encrypt(key_b, msg))
-                self.clear_garbled_table[(encr_bit_a, encr_bit_b)] = [
-                    (in_a, bit_a), (in_b, bit_b), (out, bit_out), encr_bit_out
-                ]
+        Create a clear representation of the garbled table for debugging purposes
+        :return: A dict mapping each tuple of encrypted input bits to the list
+            of (wire, bit) of the inputs and output, and the encrypted output bit
+        """
+        operator = gate_logic(self.gate_type, self.table)
+        clear_garbled_table = {}
+        for encr_bits in self.garbled_table:
+            bits = [encr_bit ^ self.p_bits[w] for encr_bit, w in zip(encr_bits, self.input)]
+            bit_out = operator(*bits)
+            clear_garbled_table[encr_bits] = [*zip(self.input, bits), (self.output, bit_out),
+                                              bit_out ^ self.p_bits[self.output]]
+        return clear_garbled_table
 
     def print_garbled_table(self):
         """Print a clear representation of the garbled table."""
         print(f"GATE: {self.output}, TYPE: {self.gate_type}")
-        for k, v in self.clear_garbled_table.items():
+        for k, v in self.get_clear_garbled_table().items():
+            # If it's a LUT gate
+            if len(k) > 2 or self.gate_type == LUT_TYPE:
+                *keys_in, key_out, encr_bit_out = v
+                print(f"{list(k)}: "
+                      + "".join(f"[{key_in[0]}, {key_in[1]}]" for key_in in keys_in)
+                      + f"([{key_out[0]}, {key_out[1]}], {encr_bit_out})")
             # If it's a 2-input gate
-            if len(k) > 1:
+            elif len(k) > 1:
                 key_a, key_b, key_out = v[0], v[1], v[2]
                 encr_bit_out = v[3]
                 print(f"[{k[0]}, {k[1]}]: "
@@ -181,62 +1187,385 @@ class GarbledGate:
         return self.garbled_table
 
 
+def _get_bit(bits, i):
+    return (bits[i >> 3] >> (i & 7)) & 1
+
+
+def _set_bit(bits, i, bit):
+    if bit:
+        bits[i >> 3] |= 1 << (i & 7)
+    else:
+        bits[i >> 3] &= ~(1 << (i & 7))
+
+
+class WireKeys(Mapping):
+    """
+    The pairs of keys of the wires of a garbled circuit, read from a buffer
+    holding the keys of bits 0 and 1 of each wire by dense index.
+
+    Args:
+        index: The map from wire ID to dense index of the wires exposed
+        key_size: The byte size of a key
+        buffer: The buffer of the keys
+    """
+    __slots__ = ("index", "key_size", "buffer")
+
+    def __init__(self, index, key_size, buffer):
+        self.index = index
+        self.key_size = key_size
+        self.buffer = buffer
+
+    def pair(self, i):
+        """
+        Return the pair of keys of a wire
+        :param i: The dense index of the wire
+        :return: The keys of bits 0 and 1
+        """
+        start, size = 2 * i * self.key_size, self.key_size
+        return (bytes(self.buffer[start:start + size]),
+                bytes(self.buffer[start + size:start + 2 * size]))
+
+    def __getitem__(self, wire):
+        return self.pair(self.index[wire])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class WirePBits(Mapping):
+    """
+    The p-bits of the wires of a garbled circuit, read from a bit array
+    holding the p-bit of each wire by dense index, least significant bit first.
+
+    Args:
+        index: The map from wire ID to dense index of the wires exposed
+        bits: The bit array of the p-bits
+    """
+    __slots__ = ("index", "bits")
+
+    def __init__(self, index, bits):
+        self.index = index
+        self.bits = bits
+
+    def __getitem__(self, wire):
+        return _get_bit(self.bits, self.index[wire])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class DerivedKeys(Mapping):
+    """
+    The pairs of keys of the input wires of a garbled circuit, derived again
+    from its seed at each lookup instead of being kept in memory.
+
+    Args:
+        inputs: The input wires, by dense index
+        pair: A function returning the pair of keys of a dense index
+    """
+    __slots__ = ("index", "pair")
+
+    def __init__(self, inputs, pair):
+        self.index = {w: i for i, w in enumerate(inputs)}
+        self.pair = pair
+
+    def __getitem__(self, wire):
+        return self.pair(self.index[wire])
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class _LiveKeys(dict):
+    """The pairs of keys of the live wires of a circuit being garbled, by dense index"""
+    pair = dict.__getitem__
+
+
 class GarbledCircuit:
     """
     A representation of a garbled circuit
 
+    The keys of all wires are held in one buffer and their p-bits in one bit
+    array, both by dense wire index, and the garbled tables in one
+    PackedTables. keys and p_bits map the wires of the CompiledCircuit's
+    index to them. Clear tables are only created when printing.
+
+    The p-bits and keys are derived from a seed (see SEEDED LABELS), so that
+    a given seed garbles reproducibly. Without keep_keys, no key buffer is
+    allocated: the gates are garbled chunk by chunk, the keys of the outputs
+    of each chunk are derived when it is garbled and the keys of the wires
+    no later gate reads are dropped after it, as by StreamingGarbler. Once
+    garbled, keys only maps the input wires, whose keys are derived again
+    from the seed. Half-gates garbled by workers still hold the labels of
+    all wires until garbling ends, as the levels of gates of the workers
+    are not in the order of the plan.
+
     Args:
         circuit: A dict containing circuit spec
         p_bits: Optional; a dict of p-bits for the given circuit
+        scheme: Optional; the garbling scheme, classic or half-gates (default classic)
+        cipher: Optional; the label cipher of the classic scheme, fernet or
+            fixed-key (default fernet). Half-gates always use fixed-key labels.
+        workers: Optional; the number of worker processes garbling in
+            parallel, None or 1 to garble in this process (default None)
+        seed: Optional; the SEED_SIZE-byte secret seed of the p-bits and
+            keys, for reproducible runs (default None: a random seed)
+        keep_keys: Optional; keep the keys of all wires in memory (default true)
     """
-    def __init__(self, circuit, p_bits=None):
+    __slots__ = ("circuit", "scheme", "cipher", "plan", "seed", "key_buffer", "p_bit_buffer",
+                 "keys", "p_bits", "garbled_tables")
+
+    def __init__(self, circuit, p_bits=None, scheme=CLASSIC, cipher=FERNET, workers=None,
+                 seed=None, keep_keys=True):
         if p_bits is None:
             p_bits = {}
+        if seed is not None and len(seed) != SEED_SIZE:
+            raise ValueError(f"Seeds are {SEED_SIZE} bytes long")
         self.circuit = circuit
-        self.gates = circuit["gates"]
-        self.wires = set()
+        self.scheme = scheme
+        self.cipher = get_cipher(FIXED_KEY if scheme == HALF_GATES else cipher)
+        self.plan = compile_circuit(circuit)
+        check_scheme(self.plan, scheme)
+        self.seed = seed or secrets.token_bytes(SEED_SIZE)
 
-        self.p_bits = {}
-        self.keys = {}
-        self.garbled_tables = {}
+        wire_count = len(self.plan.wires)
+        self.p_bit_buffer = bytearray((wire_count + 7) // 8)
+        self.p_bits = WirePBits(self.plan.index, self.p_bit_buffer)
+        if keep_keys:
+            self.key_buffer = bytearray(2 * self.cipher.key_size * wire_count)
+            self.keys = WireKeys(self.plan.index, self.cipher.key_size, self.key_buffer)
+        else:
+            self.key_buffer = None
+            self.keys = _LiveKeys()
+        self.garbled_tables = None
 
-        # Retrieve all wire IDs from the circuit
-        for gate in self.gates:
-            self.wires.add(gate["id"])
-            self.wires.update(set(gate["in"]))
-        self.wires = list(self.wires)
+        with metrics.timer("garble"):
+            if workers is not None and workers > 1:
+                initializer = _init_half_gates_worker if scheme == HALF_GATES else None
+                with ProcessPoolExecutor(workers, initializer=initializer,
+                                         initargs=(circuit,) if initializer else ()) as pool:
+                    self._garble(p_bits, pool, workers)
+            else:
+                self._garble(p_bits)
+        metrics.count("gates_garbled", len(self.plan))
 
-        self._gen_p_bits(p_bits)
-        self._gen_keys()
-        self._gen_garbled_tables()
+        if not keep_keys:
+            self.keys = DerivedKeys(self.plan.inputs, self._derive_pair)
+
+    def _garble(self, p_bits, pool=None, workers=1):
+        """
+        Create p-bits, keys and garbled tables
+        :param p_bits: For debugging purpose, user can give determined p_bits
+        :param pool: Optional; the ProcessPoolExecutor of the workers
+        :param workers: Optional; the number of workers of the pool
+        :return:
+        """
+        if self.scheme == HALF_GATES:
+            self._gen_half_gates(p_bits, pool, workers)
+        else:
+            self._gen_p_bits(p_bits)
+            if self.key_buffer is not None:
+                self._gen_keys(self.key_buffer, pool)
+            self._gen_garbled_tables(pool)
 
     def _gen_p_bits(self, p_bits):
         """
-        Create a dict mapping each wire to a random p-bit
+        Derive the p-bit of each wire from the seed
         :param p_bits: For debugging purpose, user can give determined p_bits
         :return:
         """
-        if p_bits:
-            self.p_bits = p_bits
+        self.p_bit_buffer[:] = expand_seed(self.seed, 0, len(self.p_bit_buffer))
+        for wire, p_bit in p_bits.items():
+            _set_bit(self.p_bit_buffer, self.plan.index[wire], p_bit)
+
+    def _gen_keys(self, buffer, pool=None):
+        """
+        Derive the pair of keys of each wire from the seed, chunk by chunk
+        :param buffer: The buffer to fill with the keys of bits 0 and 1 of each wire
+        :param pool: Optional; the ProcessPoolExecutor deriving the chunks
+        :return:
+        """
+        wire_count, size = len(self.plan.wires), 2 * self.cipher.key_size
+        starts = range(0, wire_count, PARALLEL_CHUNK_SIZE)
+        offsets = [_key_offset(self.cipher, wire_count, start) for start in starts]
+        chunks = [_unpack_bits(self.p_bit_buffer, start,
+                               min(start + PARALLEL_CHUNK_SIZE, wire_count))
+                  for start in starts]
+        if pool is None:
+            keys = (derive_keys(self.cipher, self.seed, offset, chunk)
+                    for offset, chunk in zip(offsets, chunks))
         else:
-            self.p_bits = {wire: random.randint(0, 1) for wire in self.wires}
+            keys = pool.map(_gen_keys_task, [self.cipher.name] * len(chunks),
+                            [self.seed] * len(chunks), offsets, chunks)
+        for start, chunk_keys in zip(starts, keys):
+            buffer[start * size:start * size + len(chunk_keys)] = chunk_keys
 
-    def _gen_keys(self):
+    def _derive_live_keys(self, start, stop):
         """
-        Create pari of keys for each wire
+        Derive the pairs of keys of consecutive wires from the seed into the
+        keys of the live wires
+        :param start: The dense index of the first wire
+        :param stop: The dense index after the last wire
         :return:
         """
-        for wire in self.wires:
-            self.keys[wire] = (Fernet.generate_key(), Fernet.generate_key())
+        size = self.cipher.key_size
+        keys = derive_keys(self.cipher, self.seed,
+                           _key_offset(self.cipher, len(self.plan.wires), start),
+                           _unpack_bits(self.p_bit_buffer, start, stop))
+        for j in range(stop - start):
+            pair = keys[2 * j * size:(2 * j + 2) * size]
+            self.keys[start + j] = pair[:size], pair[size:]
+
+    def _derive_pair(self, i):
+        """
+        Derive again the pair of keys of an input wire from the seed
+        :param i: The dense index of the wire
+        :return: The keys of bits 0 and 1
+        """
+        p_bit = _get_bit(self.p_bit_buffer, i)
+        if self.scheme == HALF_GATES:
+            delta, (label,) = derive_labels(self.seed, i, 1)
+            label = (label & ~1) | p_bit
+            return (label.to_bytes(LABEL_SIZE, "little"),
+                    (label ^ delta).to_bytes(LABEL_SIZE, "little"))
+        offset = _key_offset(self.cipher, len(self.plan.wires), i)
+        keys = derive_keys(self.cipher, self.seed, offset, [p_bit])
+        return keys[:self.cipher.key_size], keys[self.cipher.key_size:]
 
-    def _gen_garbled_tables(self):
+    def _gate_args(self, k):
         """
-        Create the garbled table of each gate
+        Return the arguments of garble_rows after the cipher for a gate
+        :param k: The index of the gate in the plan
+        :return: A tuple of the arguments
+        """
+        plan = self.plan
+        inputs = plan.gate_inputs(k)
+        return (GATE_NAMES[plan.types[k]], plan.gate_ids[k],
+                [self.keys.pair(i) for i in inputs],
+                [_get_bit(self.p_bit_buffer, i) for i in inputs],
+                self.keys.pair(plan.out[k]), _get_bit(self.p_bit_buffer, plan.out[k]),
+                plan.lut_tables.get(k))
+
+    def _gen_garbled_tables(self, pool=None):
+        """
+        Create the garbled table of each gate, packed in the order of the plan
+        :param pool: Optional; the ProcessPoolExecutor garbling chunks of gates
         :return:
         """
-        for gate in self.gates:
-            garbled_gate = GarbledGate(gate, self.keys, self.p_bits)
-            self.garbled_tables[gate["id"]] = garbled_gate.get_garbled_table()
+        plan = self.plan
+        if pool is None:
+            tables = (garble_rows(self.cipher, *gate)
+                      for gates in self._chunk_args() for gate in gates)
+        else:
+            # Workers only receive the keys of the wires of their gates
+            futures = [pool.submit(_garble_gates_task, self.cipher.name, gates)
+                       for gates in self._chunk_args()]
+            tables = (rows for future in futures for rows in future.result())
+        self.garbled_tables = PackedTables.pack(zip(plan.gate_ids, tables))
+
+    def _chunk_args(self):
+        """
+        Generate the arguments of garble_rows of the gates chunk by chunk.
+        Without a key buffer, the keys of the outputs of each chunk are derived
+        before it and the keys of the wires no later gate reads dropped after it.
+        :return: A generator of lists of the arguments of garble_rows after
+            the cipher, one per gate
+        """
+        plan = self.plan
+        live = self.key_buffer is None
+        if live:
+            liveness = plan.liveness()
+            self._derive_live_keys(0, len(plan.inputs))
+        for start in range(0, len(plan), PARALLEL_CHUNK_SIZE):
+            stop = min(start + PARALLEL_CHUNK_SIZE, len(plan))
+            if live:
+                self._derive_live_keys(plan.out[start], plan.out[stop - 1] + 1)
+            yield [self._gate_args(k) for k in range(start, stop)]
+            if live:
+                for i in liveness.dead(plan, start, stop):
+                    self.keys.pop(i, None)
+
+    def _gen_half_gates(self, p_bits, pool=None, workers=1):
+        """
+        Create wire labels and garbled tables with free-XOR and half-gates.
+
+        The label of bit 1 is the label of bit 0 XOR a global offset delta,
+        whose least significant bit is set so that the colour bit of a label
+        is its encrypted bit. XOR, XNOR and NOT gates get no garbled table;
+        AND, NAND, OR and NOR gates get a (T_G, T_E) pair of ciphertexts.
+
+        With a pool of workers, the gates are garbled level by level of AND
+        depth: the non-free gates of a level are independent and split among
+        the workers, then the free gates of the level are computed here.
+        :param p_bits: For debugging purpose, user can give p-bits of the input wires
+        :param pool: Optional; the ProcessPoolExecutor of the workers
+        :param workers: Optional; the number of workers of the pool
+        :return:
+        """
+        plan = self.plan
+        delta, labels = derive_labels(self.seed, 0, len(plan.inputs))
+        for i, wire in enumerate(plan.inputs):
+            if wire in p_bits:
+                labels[i] = (labels[i] & ~1) | p_bits[wire]
+
+        tables = {}
+        if self.key_buffer is None and pool is None:
+            # Only the labels of live wires are held, by dense index
+            liveness = plan.liveness()
+            labels = dict(enumerate(labels))
+            for i, label in labels.items():
+                _set_bit(self.p_bit_buffer, i, label & 1)
+            for start in range(0, len(plan), PARALLEL_CHUNK_SIZE):
+                stop = min(start + PARALLEL_CHUNK_SIZE, len(plan))
+                _garble_half_gates(plan, labels, delta, range(start, stop), tables)
+                for out in plan.out[start:stop]:
+                    _set_bit(self.p_bit_buffer, out, labels[out] & 1)
+                for i in liveness.dead(plan, start, stop):
+                    labels.pop(i, None)
+            self.garbled_tables = PackedTables.pack(tables)
+            return
+
+        # int label of bit 0 of each wire by dense index
+        labels += [0] * (len(plan.wires) - len(plan.inputs))
+        if pool is None:
+            _garble_half_gates(plan, labels, delta, range(len(plan)), tables)
+        else:
+            for and_gates, free_gates in _and_levels(plan):
+                if len(and_gates) < PARALLEL_MIN_GATES:
+                    _garble_half_gates(plan, labels, delta, and_gates, tables)
+                else:
+                    size = -(-len(and_gates) // workers)
+                    futures = []
+                    for i in range(0, len(and_gates), size):
+                        indexes = and_gates[i:i + size]
+                        inputs = {w: labels[w] for k in indexes
+                                  for w in (plan.in_a[k], plan.in_b[k])}
+                        futures.append(pool.submit(_garble_half_gates_task, indexes, inputs,
+                                                   delta))
+                    for future in futures:
+                        out_labels, level_tables = future.result()
+                        for out, label in out_labels.items():
+                            labels[out] = label
+                        tables.update(level_tables)
+                _garble_half_gates(plan, labels, delta, free_gates, tables)
+        self.garbled_tables = PackedTables.pack(tables)
+
+        size = 2 * LABEL_SIZE
+        for i, label in enumerate(labels):
+            if self.key_buffer is not None:
+                label1 = label ^ delta
+                self.key_buffer[i * size:(i + 1) * size] = (
+                    label.to_bytes(LABEL_SIZE, "little") + label1.to_bytes(LABEL_SIZE, "little"))
+            _set_bit(self.p_bit_buffer, i, label & 1)
 
     def print_garbled_tables(self):
         """
@@ -244,20 +1573,152 @@ class GarbledCircuit:
         :return:
         """
         print(f"======== {self.circuit['id']} ========")
-        print(f"P-BITS: {self.p_bits}")
-        for gate in self.gates:
-            garbled_table = GarbledGate(gate, self.keys, self.p_bits)
+        print(f"P-BITS: {dict(self.p_bits)}")
+        gates = [self.plan.gate(k) for k in range(len(self.plan))]
+        if self.scheme == HALF_GATES:
+            for gate in gates:
+                table = self.garbled_tables.get(gate["id"])
+                rows = f"[{table[0].hex()}, {table[1].hex()}]" if table else "free"
+                print(f"GATE: {gate['id']}, TYPE: {gate['type']}: {rows}")
+            print()
+            return
+        keys = self.keys
+        if self.key_buffer is None:
+            # The keys of all wires were dropped: derive them again
+            buffer = bytearray(2 * self.cipher.key_size * len(self.plan.wires))
+            self._gen_keys(buffer)
+            keys = WireKeys(self.plan.index, self.cipher.key_size, buffer)
+        for gate in gates:
+            garbled_table = GarbledGate(gate, keys, self.p_bits, self.cipher)
             garbled_table.print_garbled_table()
         print()
 
     def get_p_bits(self):
-        """Return dict mapping each wire to its p-bit"""
+        """Return mapping of each wire to its p-bit"""
         return self.p_bits
 
     def get_garbled_tables(self):
-        """Return dict mapping each gate to its garbled table"""
+        """Return PackedTables mapping each gate to its garbled table"""
         return self.garbled_tables
 
     def get_keys(self):
-        """Return dict mapping each wire to its pair of keys"""
+        """Return mapping of each wire to its pair of keys"""
+        return self.keys
+
+
+class StreamingGarbler:
+    """
+    A garbled circuit created chunk by chunk while it is sent.
+
+    The keys of the input wires are created upfront. The garbled tables are
+    created in the order of the CompiledCircuit, chunk_size gates at a time,
+    so that only the tables of the current chunk are held in memory. After
+    each chunk, the keys of the wires no later gate reads are dropped, except
+    those of inputs and outputs. The p-bits of outputs are known once all
+    chunks have been created.
+
+    Args:
+        circuit: A dict containing circuit spec
+        scheme: Optional; the garbling scheme, classic or half-gates (default classic)
+        cipher: Optional; the label cipher of the classic scheme, fernet or
+            fixed-key (default fernet). Half-gates always use fixed-key labels.
+        chunk_size: Optional; the number of gates per chunk (default CHUNK_SIZE)
+        seed: Optional; the SEED_SIZE-byte secret seed of the p-bits and
+            keys, as for GarbledCircuit (default None: a random seed)
+    """
+    def __init__(self, circuit, scheme=CLASSIC, cipher=FERNET, chunk_size=CHUNK_SIZE,
+                 seed=None):
+        if chunk_size < 1:
+            raise ValueError("Chunks must hold at least one gate")
+        if seed is not None and len(seed) != SEED_SIZE:
+            raise ValueError(f"Seeds are {SEED_SIZE} bytes long")
+        self.circuit = circuit
+        self.scheme = scheme
+        self.cipher = get_cipher(FIXED_KEY if scheme == HALF_GATES else cipher)
+        self.chunk_size = chunk_size
+        self.plan = compile_circuit(circuit)
+        check_scheme(self.plan, scheme)
+        self.liveness = self.plan.liveness()
+        self.seed = seed or secrets.token_bytes(SEED_SIZE)
+        self.p_bits = {}
+        self.keys = {}
+
+        if scheme == HALF_GATES:
+            self.delta, labels = derive_labels(self.seed, 0, len(self.plan.inputs))
+            self.labels = dict(enumerate(labels))  # map from live dense index to int label
+            for i in range(len(self.plan.inputs)):
+                self._set_key(i)
+        else:
+            self._derive_keys(0, len(self.plan.inputs))
+
+    def _derive_keys(self, start, stop):
+        """
+        Derive the p-bits and pairs of keys of classic wires from the seed
+        :param start: The dense index of the first wire
+        :param stop: The dense index after the last wire
+        :return:
+        """
+        wire_count, size = len(self.plan.wires), self.cipher.key_size
+        first = start >> 3
+        stream = expand_seed(self.seed, first, ((stop + 7) >> 3) - first)
+        p_bits = _unpack_bits(stream, start - 8 * first, stop - 8 * first)
+        keys = derive_keys(self.cipher, self.seed, _key_offset(self.cipher, wire_count, start),
+                           p_bits)
+        for j, wire in enumerate(self.plan.wires[start:stop]):
+            self.p_bits[wire] = p_bits[j]
+            pair = keys[2 * j * size:(2 * j + 2) * size]
+            self.keys[wire] = pair[:size], pair[size:]
+
+    def _set_key(self, i):
+        """
+        Record the p-bit and the pair of keys of a half-gates wire
+        :param i: The dense index of the wire
+        :return:
+        """
+        wire, label = self.plan.wires[i], self.labels[i]
+        self.p_bits[wire] = label & 1
+        self.keys[wire] = (label.to_bytes(LABEL_SIZE, "little"),
+                           (label ^ self.delta).to_bytes(LABEL_SIZE, "little"))
+
+    def chunks(self):
+        """
+        Garble the circuit chunk by chunk
+        :return: A generator of dicts holding the range of gates of the chunk,
+            start and stop, and their garbled tables as PackedTables
+        """
+        plan = self.plan
+        for start in range(0, len(plan), self.chunk_size):
+            stop = min(start + self.chunk_size, len(plan))
+            tables = {}
+            with metrics.timer("garble"):
+                if self.scheme == HALF_GATES:
+                    _garble_half_gates(plan, self.labels, self.delta, range(start, stop), tables)
+                    for out in plan.out[start:stop]:
+                        self._set_key(out)
+                else:
+                    self._derive_keys(plan.out[start], plan.out[stop - 1] + 1)
+                    for k in range(start, stop):
+                        gate_id = plan.gate_ids[k]
+                        garbled_gate = GarbledGate(plan.gate(k), self.keys, self.p_bits,
+                                                   self.cipher)
+                        tables[gate_id] = garbled_gate.get_garbled_table()
+                for i in self.liveness.dead(plan, start, stop):
+                    wire = plan.wires[i]
+                    self.keys.pop(wire, None)
+                    self.p_bits.pop(wire, None)
+                    if self.scheme == HALF_GATES:
+                        self.labels.pop(i, None)
+            metrics.count("gates_garbled", stop - start)
+            yield {"start": start, "stop": stop, "tables": PackedTables.pack(tables)}
+
+    def get_p_bits(self):
+        """Return dict mapping each live wire garbled so far to its p-bit"""
+        return self.p_bits
+
+    def get_p_bits_out(self):
+        """Return dict mapping each output wire to its p-bit, once all chunks are created"""
+        return {w: self.p_bits[w] for w in self.plan.outputs}
+
+    def get_keys(self):
+        """Return dict mapping each live wire garbled so far to its pair of keys"""
         return self.keys
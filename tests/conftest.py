@@ -0,0 +1,50 @@
+import itertools
+
+import pytest
+
+from src import yao
+
+
+def evaluate_clear(circuit, bits):
+    """
+    Evaluate a circuit on clear bits
+    :param circuit: A dict containing circuit spec
+    :param bits: A dict mapping each input wire to its bit
+    :return: The list of the output bits, in the order of the outputs
+    """
+    plan = yao.compile_circuit(circuit)
+    values = dict(bits)
+    for k in range(len(plan)):
+        gate = plan.gate(k)
+        logic = yao.gate_logic(gate["type"], gate.get("table"))
+        values[gate["id"]] = logic(*(values[w] for w in gate["in"]))
+    return [values[w] for w in circuit["out"]]
+
+
+def all_inputs(circuit):
+    """
+    Enumerate the input combinations of a circuit
+    :param circuit: A dict containing circuit spec
+    :return: An iterator over dicts mapping each input wire to its bit
+    """
+    wires = circuit.get("alice", []) + circuit.get("bob", [])
+    for bits in itertools.product((0, 1), repeat=len(wires)):
+        yield dict(zip(wires, bits))
+
+
+@pytest.fixture
+def clear_outputs():
+    """Return a check that a result has the clear outputs of a circuit on all input combinations"""
+    def check(circuit, evaluate):
+        for bits in all_inputs(circuit):
+            assert evaluate(bits) == evaluate_clear(circuit, bits), bits
+    return check
+
+
+@pytest.fixture
+def assert_equivalent():
+    """Return a check that two circuits have the same outputs on all input combinations"""
+    def check(circuit, other):
+        for bits in all_inputs(circuit):
+            assert evaluate_clear(circuit, bits) == evaluate_clear(other, bits), bits
+    return check
@@ -0,0 +1,60 @@
+import pytest
+
+from src import batch, fusion, generators, yao
+
+MAJORITY = {"id": "majority", "alice": [1, 2], "bob": [3], "out": [4, 5],
+            "gates": [{"id": 4, "type": "LUT", "in": [1, 2, 3],
+                       "table": [0, 0, 0, 1, 0, 1, 1, 1]},
+                      {"id": 5, "type": "XOR", "in": [4, 1]}]}
+
+
+@pytest.mark.parametrize("max_inputs", range(1, yao.LUT_MAX_INPUTS + 1))
+@pytest.mark.parametrize("seed", range(5))
+def test_fuse_random_dag(max_inputs, seed, assert_equivalent):
+    circuit = generators.random_dag(80, inputs=8, outputs=16, seed=seed)
+    fused = fusion.fuse(circuit, max_inputs)
+    assert_equivalent(circuit, fused)
+    assert all(len(gate["in"]) <= max(max_inputs, 2) for gate in fused["gates"])
+
+
+@pytest.mark.parametrize("max_inputs", range(1, yao.LUT_MAX_INPUTS + 1))
+def test_fuse_generated(max_inputs, assert_equivalent):
+    for circuit in (generators.adder(3), generators.comparator(3), generators.multiplier(3)):
+        assert_equivalent(circuit, fusion.fuse(circuit, max_inputs))
+
+
+def test_fuse_invalid_max_inputs():
+    circuit = generators.adder(2)
+    for max_inputs in (0, yao.LUT_MAX_INPUTS + 1):
+        with pytest.raises(ValueError):
+            fusion.fuse(circuit, max_inputs)
+
+
+@pytest.mark.parametrize("cipher", list(yao.CIPHERS))
+@pytest.mark.parametrize("circuit", [MAJORITY, fusion.fuse(generators.adder(2))],
+                         ids=lambda circuit: circuit["id"])
+def test_garble_lut_classic(circuit, cipher, clear_outputs):
+    assert any(gate["type"] == yao.LUT_TYPE for gate in circuit["gates"])
+    garbled = yao.GarbledCircuit(circuit, scheme=yao.CLASSIC, cipher=cipher)
+    keys, p_bits = garbled.get_keys(), garbled.get_p_bits()
+    p_bits_out = {w: p_bits[w] for w in circuit["out"]}
+
+    def evaluate(bits):
+        a_inputs = {w: (keys[w][bits[w]], p_bits[w] ^ bits[w]) for w in circuit["alice"]}
+        b_inputs = {w: (keys[w][bits[w]], p_bits[w] ^ bits[w]) for w in circuit["bob"]}
+        result = yao.evaluate(circuit, garbled.get_garbled_tables(), p_bits_out, a_inputs,
+                              b_inputs, yao.CLASSIC, cipher)
+        return [result[w] for w in circuit["out"]]
+
+    clear_outputs(circuit, evaluate)
+
+
+def test_half_gates_reject_lut():
+    plan = yao.compile_circuit(MAJORITY)
+    yao.check_scheme(plan, yao.CLASSIC)
+    with pytest.raises(ValueError):
+        yao.check_scheme(plan, yao.HALF_GATES)
+    with pytest.raises(ValueError):
+        yao.GarbledCircuit(MAJORITY, scheme=yao.HALF_GATES)
+    with pytest.raises(ValueError):
+        batch.BatchGarbledCircuit(MAJORITY, 2)
@@ -0,0 +1,52 @@
+import pytest
+
+from src import generators, optimizer
+
+EDGE_CASES = [
+    # an output that is an input, listed twice
+    {"id": "input output", "alice": [1], "bob": [2], "out": [1, 3, 1],
+     "gates": [{"id": 3, "type": "AND", "in": [1, 2]}]},
+    # the same gate output listed twice
+    {"id": "duplicate output", "alice": [1], "bob": [2], "out": [3, 3],
+     "gates": [{"id": 3, "type": "NAND", "in": [1, 2]}]},
+    # constant outputs: x AND NOT x, x OR NOT x
+    {"id": "constant outputs", "alice": [1], "bob": [2], "out": [4, 5, 6],
+     "gates": [{"id": 3, "type": "NOT", "in": [1]},
+               {"id": 4, "type": "AND", "in": [1, 3]},
+               {"id": 5, "type": "OR", "in": [1, 3]},
+               {"id": 6, "type": "XOR", "in": [4, 2]}]},
+    # outputs copying and negating other outputs
+    {"id": "copied outputs", "alice": [1], "bob": [2], "out": [3, 4, 5, 6, 7],
+     "gates": [{"id": 3, "type": "OR", "in": [1, 2]},
+               {"id": 4, "type": "NOT", "in": [3]},
+               {"id": 5, "type": "NOT", "in": [4]},
+               {"id": 6, "type": "NOR", "in": [2, 1]},
+               {"id": 7, "type": "NOT", "in": [1]}]},
+    # OR of disjoint inputs, rewritten as XOR
+    {"id": "disjoint OR", "alice": [1], "bob": [2], "out": [5],
+     "gates": [{"id": 3, "type": "NOT", "in": [2]},
+               {"id": 4, "type": "AND", "in": [1, 3]},
+               {"id": 6, "type": "AND", "in": [2, 2]},
+               {"id": 5, "type": "OR", "in": [4, 6]}]},
+]
+
+
+@pytest.mark.parametrize("circuit", EDGE_CASES, ids=lambda circuit: circuit["id"])
+def test_optimize_edge_cases(circuit, assert_equivalent):
+    assert_equivalent(circuit, optimizer.optimize(circuit))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_optimize_random_dag(seed, assert_equivalent):
+    circuit = generators.random_dag(60, inputs=8, outputs=16, seed=seed)
+    assert_equivalent(circuit, optimizer.optimize(circuit))
+
+
+@pytest.mark.parametrize("circuit", [generators.adder(3), generators.comparator(3),
+                                     generators.multiplier(3)],
+                         ids=lambda circuit: circuit["id"])
+def test_optimize_generated(circuit, assert_equivalent):
+    optimized = optimizer.optimize(circuit)
+    assert_equivalent(circuit, optimized)
+    after, before = optimizer.count_gates(optimized), optimizer.count_gates(circuit)
+    assert after["non_free"] <= before["non_free"]
@@ -0,0 +1,41 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src import generators, yao
+
+
+def test_compile_circuit_threads():
+    # Concurrent sessions compiling more distinct circuits than the cache holds
+    circuits = [generators.random_dag(3, inputs=2, outputs=1, seed=seed)
+                for seed in range(4 * yao.COMPILED_CACHE_SIZE)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads often, inside the cache updates too
+    try:
+        with ThreadPoolExecutor(16) as executor:
+            plans = list(executor.map(lambda n: yao.compile_circuit(circuits[n % len(circuits)]),
+                                      range(30000)))
+    finally:
+        sys.setswitchinterval(interval)
+    for n, plan in enumerate(plans):
+        expected = yao.CompiledCircuit(circuits[n % len(circuits)])
+        assert (plan.gate_ids, plan.in_a, plan.in_b) == (expected.gate_ids, expected.in_a,
+                                                        expected.in_b)
+
+
+@pytest.mark.parametrize("scheme", yao.SCHEMES)
+@pytest.mark.parametrize("workers", [None, 2])
+def test_garble_without_keeping_keys(scheme, workers):
+    # Same seed: the same tables and input keys, whether the keys of all wires are kept or not
+    circuit = generators.random_dag(3 * yao.PARALLEL_CHUNK_SIZE, seed=1)  # several chunks
+    seed = yao.instance_seed(bytes(yao.SEED_SIZE), 0)
+    kept, derived = (yao.GarbledCircuit(circuit, scheme=scheme, cipher=yao.FIXED_KEY,
+                                        workers=workers, seed=seed, keep_keys=keep_keys)
+                     for keep_keys in (True, False))
+    assert derived.key_buffer is None
+    kept_tables, derived_tables = kept.get_garbled_tables(), derived.get_garbled_tables()
+    assert list(kept_tables.gate_ids) == list(derived_tables.gate_ids)
+    assert bytes(kept_tables.buffer) == bytes(derived_tables.buffer)
+    assert dict(kept.get_p_bits()) == dict(derived.get_p_bits())
+    assert {w: kept.get_keys()[w] for w in derived.get_keys()} == dict(derived.get_keys())